@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from decimal import Decimal
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'core.apps.CoreConfig',
     'django.contrib.humanize',
+    'django.contrib.postgres',
     'rest_framework',
     'drf_spectacular',
     'drf_spectacular_sidecar',
@@ -48,10 +51,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Сжимает ответ последним: стоит выше всего, что читает или меняет тело
+    'core.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.audit.AuditRequestMiddleware',
+    'core.db_routing.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -94,21 +101,64 @@ SIMPLE_JWT = {
 from decouple import config
 
 
-# settings.py
+# Параметры подключения — из окружения/.env. Без пула соединения постоянные
+# (CONN_MAX_AGE) с проверкой перед переиспользованием; DB_POOL=True включает пул
+# psycopg 3 (нужны пакеты psycopg и psycopg-pool), постоянные соединения тогда выключаются.
+# Под ASGI постоянные соединения не переиспользуются между запросами — там нужен пул
+# или DB_CONN_MAX_AGE=0.
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',
-        'USER': 'postgres',
-        'PASSWORD': '123',
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'NAME': config('DB_NAME', default='postgres'),
+        'USER': config('DB_USER', default='postgres'),
+        'PASSWORD': config('DB_PASSWORD', default='123'),
+        'HOST': config('DB_HOST', default='localhost'),
+        'PORT': config('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
         'OPTIONS': {
             'options': '-c search_path="CRM",public',
             'client_encoding': 'UTF-8',
         },
     }
 }
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),  # ожидание свободного соединения, с
+    }
+
+# Реплика для чтения (core.db_routing): те же параметры, кроме хоста/порта/базы.
+# Локально — второй экземпляр PostgreSQL: DB_REPLICA_HOST=localhost DB_REPLICA_PORT=5433
+if config('DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'OPTIONS': {**DATABASES['default']['OPTIONS']},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db_routing.ReplicaRouter']
+
+CRM_DATABASE = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': config('DB_REPLICA_STICKY_SECONDS', default=5, cast=int),
+}
+
+# Кэш (профили пользователей и т.п.). Локальный кэш — только для одного процесса:
+# при нескольких воркерах нужен общий (Redis/Memcached), иначе сброс не дойдёт до остальных
+# (справочники и ETag там устаревают не дольше чем на 5 с, см. core/shared_cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='crm'),
+    }
+}
 
 
 # Password validation
@@ -139,6 +189,53 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Курсорная пагинация для всех ViewSet; справочники переключаются на
+    # core.pagination.CRMPageNumberPagination явно
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.CRMCursorPagination',
+    'PAGE_SIZE': 50,
+    # JSON через orjson (core.renderers, core.parsers); MessagePack — если установлен msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        *(['core.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        *(['core.parsers.MessagePackParser'] if find_spec('msgpack') else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Журнал изменений (core.audit): фоновая пакетная запись в change_logs
+CRM_AUDIT = {
+    'ENABLED': config('CRM_AUDIT_ENABLED', default=True, cast=bool),
+    'ASYNC': config('CRM_AUDIT_ASYNC', default=True, cast=bool),
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL_MS': 200,
+    'QUEUE_SIZE': 10000,
+}
+
+# Сжатие ответов (core.compression): zstd/br/gzip по Accept-Encoding, потоковые — по частям
+CRM_COMPRESSION = {
+    'ENABLED': config('CRM_COMPRESSION_ENABLED', default=True, cast=bool),
+    'MIN_SIZE': config('CRM_COMPRESSION_MIN_SIZE', default=1024, cast=int),
+    'ENCODINGS': ['zstd', 'br', 'gzip'],
+    'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'ROUTES': [
+        # Админка: HTML с CSRF-токеном не сжимаем (BREACH)
+        (r'^/admin/', None),
+        # Многомегабайтные выгрузки: быстрые уровни, иначе сжатие упирается в CPU
+        (r'^/api/[^/]+/export/$', {'zstd': 1, 'br': 1, 'gzip': 1}),
+    ],
+}
+
+# Инвентарь (core.equipment): пеня за день просрочки возврата, интервалы обслуживания
+CRM_EQUIPMENT = {
+    'LATE_FEE_PER_DAY': config('CRM_EQUIPMENT_LATE_FEE_PER_DAY', default='100.00', cast=Decimal),
+    'MAINTENANCE_INTERVAL_DAYS': 180,
+    'MAINTENANCE_INTERVALS': {},  # {'skis': 90, ...}
 }
 
 
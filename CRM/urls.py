@@ -8,14 +8,14 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, Sp
 from django.conf import settings
 from django.conf.urls.static import static
 
-from core import views
+from core import async_views, views
 from core.views import (
     ParticipantsViewSet, TariffPlansViewSet, SubscriptionsViewSet,
     PaymentsViewSet, TrainingSessionsViewSet, TrainingAttendanceViewSet,
     EquipmentViewSet, EquipmentRentalsViewSet, EventsViewSet,
     EventParticipantsViewSet, PositionsViewSet, SystemUsersViewSet,
     ChangeLogsViewSet, LockersViewSet, LockerRentalsViewSet,
-    CurrentUserProfile, CustomLoginView, participant_card_view, update_locker_view, create_locker_view
+    CurrentUserProfile, CustomLoginView, ImportUploadView, RevenueReportView, CalendarView, EquipmentAvailabilityView, ReferenceCacheStatsView, participant_card_view, update_locker_view, create_locker_view
 )
 
 # === Роутер DRF ===
@@ -85,6 +85,20 @@ urlpatterns = [
     path('api/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 
+    # Поиск участников — до роутера, иначе 'available' попадает в participants/<pk>/
+    path('api/participants/available/', views.get_available_participants, name='available_participants'),
+    path('api/import/<str:resource>/', ImportUploadView.as_view(), name='import_upload'),
+    path('api/reports/revenue/', RevenueReportView.as_view(), name='revenue_report'),
+    path('api/calendar/', CalendarView.as_view(), name='calendar'),
+    path('api/equipment/availability/', EquipmentAvailabilityView.as_view(), name='equipment_availability'),
+    path('api/reference-cache/stats/', ReferenceCacheStatsView.as_view(), name='reference_cache_stats'),
+
+    # Async-варианты для запуска под CRM.asgi
+    path('api/async/profile/', async_views.profile_view, name='async_profile'),
+    path('api/async/calendar/', async_views.calendar_view, name='async_calendar'),
+    path('api/async/participants/search/', async_views.participants_search_view, name='async_participants_search'),
+    path('api/async/lockers/', async_views.lockers_data_view, name='async_lockers'),
+
     # API через роутер
     path('api/', include(router.urls)),
 
@@ -107,7 +121,6 @@ urlpatterns = [
     path('lockers/', views.lockers_list_view, name='lockers_list'),
     path('api/lockers/<int:locker_id>/update/', update_locker_view, name='update_locker'),
     path('api/lockers/', create_locker_view, name='create_locker'),
-    path('api/participants/available/', views.get_available_participants, name='available_participants'),
     path('api/lockers/<int:locker_id>/delete/', views.delete_locker, name='delete_locker'),
     # Главная → логин
     path('', login_page),
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import audit, conditional, profile, reference, reports
+        audit.connect_signals()
+        conditional.connect_signals()
+        profile.connect_signals()
+        reference.connect_signals()
+        reports.connect_signals()
@@ -0,0 +1,231 @@
+# core/async_views.py
+#
+# Async-варианты самых частых запросов на чтение (для запуска под CRM.asgi).
+# Обычные представления под ASGI выполняются в отдельном потоке на каждый
+# запрос; здесь запросы к БД идут через async ORM (afirst/aaggregate/async for).
+# Async ORM Django — обёртка sync_to_async(thread_sensitive=True): запросы одного
+# запроса выполняются по очереди в одном потоке, поэтому они идут
+# последовательно (asyncio.gather их бы не распараллелил), а цикл событий
+# тем временем обслуживает другие запросы. Ответы совпадают с синхронными эндпоинтами.
+
+import asyncio
+import functools
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import LockerRentals, Lockers, SystemUsers
+from .profile import aget_profile
+from .renderers import FastJsonResponse
+from .schedule import acalendar_etag, calendar_queryset, calendar_sessions, parse_bound
+from .search import DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, search_participants
+from .serializers import CalendarSessionSerializer
+from .views import ACTIVE_LOCKER_RENTAL_STATUSES
+
+
+LOCKERS_PAGE_SIZE = 20
+
+# Под ASGI каждый запрос работает с БД в своём потоке и со своим соединением:
+# без ограничения сотни одновременных запросов упираются в max_connections PostgreSQL
+DB_CONCURRENCY = 32
+_db_slots = weakref.WeakKeyDictionary()  # цикл событий -> семафор
+
+
+def _release_connections():
+    """close_old_connections, но не внутри открытой транзакции (тесты, ATOMIC_REQUESTS)"""
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def limit_db_concurrency(view):
+    """Не больше DB_CONCURRENCY запросов с открытым соединением; остальные ждут в цикле событий"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        slots = _db_slots.get(loop)
+        if slots is None:
+            slots = _db_slots[loop] = asyncio.Semaphore(DB_CONCURRENCY)
+        async with slots:
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                # Соединение этого запроса закрываем до освобождения места (по CONN_MAX_AGE)
+                await sync_to_async(_release_connections)()
+    return wrapper
+
+
+def _json(data, status=200, **kwargs):
+    return FastJsonResponse(data, status=status, safe=not isinstance(data, list), **kwargs)
+
+
+def _token_user_id(request):
+    """id пользователя из проверенного JWT (подпись и срок проверяются без БД) или None"""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is None:
+        return None
+    try:
+        return authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+    except (InvalidToken, TokenError):
+        return None
+
+
+# === ПРОФИЛЬ ===
+@require_GET
+@limit_db_concurrency
+async def profile_view(request):
+    """Как /api/profile/: проверка пользователя, затем профиль из кэша"""
+    user_id = _token_user_id(request)
+    if user_id is None:
+        return _json({"detail": "Учетные данные не были предоставлены."}, status=401)
+    is_active = await SystemUsers.objects.filter(pk=user_id, is_active=True).aexists()
+    profile = await aget_profile(user_id) if is_active else None
+    if profile is None:
+        return _json({"detail": "Пользователь не найден или неактивен"}, status=401)
+
+    data, etag = profile
+    etag = quote_etag(etag)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    return _json(data, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+# === КАЛЕНДАРЬ ===
+@require_GET
+@limit_db_concurrency
+async def calendar_view(request):
+    """Как /api/calendar/"""
+    params = request.GET
+    if not params.get('start') or not params.get('end'):
+        return _json({"detail": "Нужны параметры start и end"}, status=400)
+    trainer = params.get('trainer')
+    if trainer and not trainer.isdigit():
+        return _json({"detail": "trainer: ожидается id"}, status=400)
+    try:
+        queryset = calendar_queryset(
+            parse_bound(params['start']), parse_bound(params['end'], end=True),
+            trainer=trainer, location=params.get('location'),
+        )
+    except ValueError as e:
+        return _json({"detail": str(e)}, status=400)
+
+    etag = quote_etag(await acalendar_etag(queryset))
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    sessions = [session async for session in calendar_sessions(queryset)]
+    data = CalendarSessionSerializer(sessions, many=True).data
+    return _json(data, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+# === ПОИСК УЧАСТНИКОВ ===
+@require_GET
+@limit_db_concurrency
+async def participants_search_view(request):
+    """
+    Как /api/participants/available/. Поиск выбирает SQL по СУБД и откатывается
+    на запасной вариант при ошибке, поэтому выполняется целиком в потоке БД.
+    """
+    try:
+        found = await sync_to_async(search_participants)(
+            request.GET.get('search', ''), limit=request.GET.get('limit') or DEFAULT_SEARCH_LIMIT,
+        )
+    except ValueError:
+        return _json({'success': False, 'error': 'Некорректный параметр limit'}, status=400)
+    return _json({
+        'success': True,
+        'participants': [
+            {
+                'id': row['id'],
+                'last_name': row['last_name'] or '',
+                'first_name': row['first_name'] or '',
+                'middle_name': '',
+                'phone': row['phone'] or '',
+                'email': row['email'] or '',
+                'full_name': f"{row['last_name']} {row['first_name']}".strip(),
+            }
+            for row in found
+        ],
+    })
+
+
+# === ШКАФЧИКИ ===
+@require_GET
+@limit_db_concurrency
+async def lockers_data_view(request):
+    """
+    Данные страницы шкафчиков: ?zone=&status=occupied|available&condition=&page=.
+    Итоги, итоги по зонам, число строк и сама страница — четыре запроса, по очереди.
+    """
+    active_rentals = LockerRentals.objects.filter(status__in=ACTIVE_LOCKER_RENTAL_STATUSES)
+    occupied = Exists(active_rentals.filter(locker=OuterRef('pk')))
+    lockers = Lockers.objects.annotate(is_occupied=occupied).order_by('zone', 'number')
+    params = request.GET
+    if params.get('zone'):
+        lockers = lockers.filter(zone=params['zone'])
+    if params.get('condition'):
+        lockers = lockers.filter(condition=params['condition'])
+    counted = lockers
+    if params.get('status') == 'occupied':
+        lockers = lockers.filter(is_occupied=True)
+    elif params.get('status') == 'available':
+        lockers = lockers.filter(is_occupied=False)
+
+    page = params.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    offset = (page - 1) * LOCKERS_PAGE_SIZE
+
+    stats = await counted.aaggregate(
+        total_count=Count('id'), occupied_count=Count('id', filter=Q(is_occupied=True)),
+    )
+    zones = [
+        row async for row in
+        Lockers.objects.annotate(is_occupied=occupied).values('zone')
+        .annotate(total=Count('id'), occupied=Count('id', filter=Q(is_occupied=True)))
+        .order_by('zone')
+    ]
+    count = await lockers.acount()
+    rows = [
+        locker async for locker in
+        lockers.values('id', 'number', 'zone', 'condition', 'monthly_rental_cost', 'is_occupied')
+        [offset:offset + LOCKERS_PAGE_SIZE]
+    ]
+
+    occupied_ids = [row['id'] for row in rows if row['is_occupied']]
+    current = {}
+    if occupied_ids:
+        rentals = (
+            active_rentals.filter(locker_id__in=occupied_ids)
+            .select_related('participant').order_by('start_date')
+        )
+        async for rental in rentals:
+            current[rental.locker_id] = {
+                'id': rental.id,
+                'start_date': rental.start_date,
+                'participant': {'id': rental.participant_id, 'name': str(rental.participant)},
+            }
+    for row in rows:
+        row['status'] = 'occupied' if row.pop('is_occupied') else 'available'
+        row['current_rental'] = current.get(row['id'])
+
+    return _json({
+        'total_count': stats['total_count'],
+        'occupied_count': stats['occupied_count'],
+        'available_count': stats['total_count'] - stats['occupied_count'],
+        'zone_stats': zones,
+        'count': count,
+        'page': page,
+        'num_pages': max(1, -(-count // LOCKERS_PAGE_SIZE)),
+        'lockers': rows,
+    })
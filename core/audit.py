@@ -0,0 +1,255 @@
+# core/audit.py
+
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+import time
+from functools import lru_cache
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from uuid import UUID
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DEFAULTS = {
+    'ENABLED': True,
+    'ASYNC': True,
+    'BATCH_SIZE': 500,          # сбрасывать, когда накопилось M записей
+    'FLUSH_INTERVAL_MS': 200,   # ... или прошло N миллисекунд
+    'QUEUE_SIZE': 10000,        # при переполнении запись уходит синхронно
+}
+
+# Запрос текущего потока/задачи — чтобы записать автора изменения
+_current_request = contextvars.ContextVar('audit_request', default=None)
+
+
+def audit_settings():
+    return {**AUDIT_DEFAULTS, **getattr(settings, 'CRM_AUDIT', {})}
+
+
+def _plain(value):
+    """Значение поля -> JSON-совместимое"""
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    return value
+
+
+# Значения этих полей в журнал не попадают
+EXCLUDED_FIELDS = {'password_hash'}
+
+
+@lru_cache(maxsize=None)
+def _logged_fields(model):
+    return tuple(field.attname for field in model._meta.concrete_fields if field.attname not in EXCLUDED_FIELDS)
+
+
+@lru_cache(maxsize=None)
+def _diff_fields(model):
+    """updated_at меняется при каждом save() — в дифф его не включаем"""
+    return tuple(
+        field.attname for field in model._meta.concrete_fields
+        if field.attname not in EXCLUDED_FIELDS and not getattr(field, 'auto_now', False)
+    )
+
+
+def _snapshot(instance, fields):
+    """Загруженные значения полей; отложенные (.only/.defer) не трогаем, чтобы не было запросов"""
+    values = instance.__dict__
+    return {name: values[name] for name in fields if name in values}
+
+
+def _current_user_id():
+    request = _current_request.get()
+    if request is None:
+        return None
+    # DRF записывает аутентифицированного (JWT) пользователя и в исходный HttpRequest
+    user = getattr(request, 'user', None)
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return None
+    return getattr(user, 'pk', None)
+
+
+# === ФОНОВАЯ ЗАПИСЬ ===
+class AuditWriter:
+    """
+    Ограниченная очередь + фоновый поток, пишущий change_logs пачками.
+
+    Поток сбрасывает очередь через bulk_create каждые FLUSH_INTERVAL_MS
+    или по накоплении BATCH_SIZE записей. При переполнении очереди,
+    выключенном ASYNC или остановленном потоке запись идёт синхронно.
+    При завершении процесса очередь дописывается (atexit).
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+
+    def enqueue(self, entry):
+        options = audit_settings()
+        if not options['ASYNC']:
+            self.write([entry])
+            return
+        self._ensure_started(options)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.write([entry])
+
+    def write(self, entries):
+        from .models import ChangeLogs
+        ChangeLogs.objects.bulk_create([ChangeLogs(**entry) for entry in entries])
+
+    def _ensure_started(self, options):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=options['QUEUE_SIZE'])
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, args=(options,), name='audit-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _drain(self, limit, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, options):
+        interval = options['FLUSH_INTERVAL_MS'] / 1000
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._drain(options['BATCH_SIZE'], interval)
+                if not batch:
+                    continue
+                close_old_connections()
+                try:
+                    self.write(batch)
+                except Exception:
+                    logger.exception('Не удалось записать %s записей аудита', len(batch))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Ждёт, пока фоновый поток запишет всё, что уже в очереди"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self, timeout=5):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+
+
+writer = AuditWriter()
+
+
+# === СБОР ИЗМЕНЕНИЙ ===
+# Журнал и производные таблицы (свёртки) не аудируем
+NOT_AUDITED_MODELS = {'ChangeLogs', 'RevenueDaily'}
+
+
+def _audited(sender):
+    return sender._meta.app_label == 'core' and sender.__name__ not in NOT_AUDITED_MODELS
+
+
+def _record(instance, action_type, changed_data):
+    entry = {
+        'user_id': _current_user_id(),
+        'table_name': instance._meta.db_table,
+        'record_id': instance.pk,
+        'action_type': action_type,
+        'changed_data': changed_data,
+    }
+    transaction.on_commit(lambda: writer.enqueue(entry), using=instance._state.db)
+
+
+def _remember(instance):
+    state = instance.__dict__.copy()
+    state.pop('_audit_snapshot', None)
+    instance._audit_snapshot = state
+
+
+def remember_state(sender, instance, **kwargs):
+    # Срабатывает на каждую прочитанную строку — только дешёвая копия __dict__
+    if instance.pk is not None:
+        _remember(instance)
+
+
+def log_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or not audit_settings()['ENABLED']:
+        return
+    if created:
+        _record(instance, 'create', {
+            name: _plain(value) for name, value in _snapshot(instance, _logged_fields(sender)).items()
+        })
+    else:
+        previous = getattr(instance, '_audit_snapshot', None) or {}
+        current = instance.__dict__
+        diff = {
+            name: [_plain(previous[name]), _plain(current[name])]
+            for name in _diff_fields(sender)
+            if name in previous and name in current and previous[name] != current[name]
+        }
+        if diff:
+            _record(instance, 'update', diff)
+    _remember(instance)
+
+
+def log_delete(sender, instance, **kwargs):
+    if not audit_settings()['ENABLED']:
+        return
+    _record(instance, 'delete', {
+        name: _plain(value) for name, value in _snapshot(instance, _logged_fields(sender)).items()
+    })
+
+
+def connect_signals():
+    for model in apps.get_app_config('core').get_models():
+        if not _audited(model):
+            continue
+        post_init.connect(remember_state, sender=model, dispatch_uid=f'audit_init_{model.__name__}')
+        post_save.connect(log_save, sender=model, dispatch_uid=f'audit_save_{model.__name__}')
+        post_delete.connect(log_delete, sender=model, dispatch_uid=f'audit_delete_{model.__name__}')
+
+
+# === MIDDLEWARE ===
+class AuditRequestMiddleware:
+    """Запоминает текущий запрос, чтобы сигналы знали автора изменения"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
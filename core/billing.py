@@ -0,0 +1,328 @@
+# core/billing.py
+
+import calendar
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .conditional import mark_changed
+from .models import LockerRentals, Payments, Subscriptions
+from .reports import add_payments_to_rollup, apply_revenue_deltas
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+EXPIRING_STATUSES = ('active', 'pending')
+RENEWABLE_STATUS = 'active'
+EXPIRED_STATUS = 'expired'
+
+AUTO_PAYMENT_METHOD = 'auto'
+AUTO_PAYMENT_STATUS = 'pending'  # счёт выставлен, оплату подтверждает администратор
+
+
+class CycleReport:
+    def __init__(self, run_date):
+        self.run_date = run_date
+        self.expired = 0
+        self.renewed = 0
+        self.payments = 0
+
+    def as_dict(self):
+        return {
+            'run_date': self.run_date,
+            'expired': self.expired,
+            'renewed': self.renewed,
+            'payments': self.payments,
+        }
+
+
+# === АБОНЕМЕНТЫ: ИСТЕЧЕНИЕ И АВТОПРОДЛЕНИЕ ===
+def lapsed_subscriptions(run_date):
+    """Действующие абонементы, срок которых закончился до run_date (end_date — последний день)"""
+    return Subscriptions.objects.filter(status__in=EXPIRING_STATUSES, end_date__lt=run_date)
+
+
+def renewal_period(end_date, duration_days, run_date):
+    """
+    Следующий период: с дня после окончания, но не раньше run_date —
+    пропущенные периоды не выставляются, а новый абонемент всегда
+    действует на run_date, поэтому повторный запуск за ту же дату его не продлит.
+    """
+    start = max(end_date + timedelta(days=1), run_date)
+    return start, start + timedelta(days=max(duration_days, 1) - 1)
+
+
+def _renew_chunk(renewable, run_date, last_id, chunk_size, now):
+    """Пачка продлений через ORM; возвращает (продлено, последний id пачки)"""
+    # Строки пачки блокируются до конца транзакции — параллельная правка через API подождёт
+    rows = list(
+        renewable.filter(id__gt=last_id).select_for_update(of=('self',)).order_by('id').values(
+            'id', 'participant_id', 'tariff_plan_id', 'end_date',
+            'tariff_plan__price', 'tariff_plan__duration_days',
+        )[:chunk_size]
+    )
+    if not rows:
+        return 0, last_id
+
+    subscriptions = []
+    for row in rows:
+        start, end = renewal_period(row['end_date'], row['tariff_plan__duration_days'], run_date)
+        subscriptions.append(Subscriptions(
+            participant_id=row['participant_id'], tariff_plan_id=row['tariff_plan_id'],
+            start_date=start, end_date=end, status=RENEWABLE_STATUS, auto_renew=True,
+        ))
+    Subscriptions.objects.bulk_create(subscriptions)
+
+    payments = [
+        Payments(
+            participant_id=row['participant_id'], subscription_id=subscription.pk,
+            amount=row['tariff_plan__price'], payment_date=run_date,
+            payment_method=AUTO_PAYMENT_METHOD, purpose='subscription', status=AUTO_PAYMENT_STATUS,
+            notes=f"Автопродление абонемента #{row['id']}",
+        )
+        for row, subscription in zip(rows, subscriptions)
+    ]
+    Payments.objects.bulk_create(payments)
+    # bulk_create не вызывает сигналы — свёртку выручки дополняем сами
+    add_payments_to_rollup(
+        {field: getattr(payment, field) for field in ('payment_date', 'payment_method', 'purpose', 'status', 'amount')}
+        for payment in payments
+    )
+    Subscriptions.objects.filter(id__in=[row['id'] for row in rows]).update(status=EXPIRED_STATUS, updated_at=now)
+    return len(rows), rows[-1]['id']
+
+
+# Продление пачки одним запросом: id новых абонементов берутся из последовательности
+# заранее, поэтому счета сразу ссылаются на них без обратного сопоставления.
+POSTGRES_RENEW_SQL = """
+WITH src AS (
+    SELECT s.id, s.participant_id, s.tariff_plan_id,
+           GREATEST(s.end_date + 1, %(run_date)s::date) AS start_date,
+           GREATEST(t.duration_days, 1) AS duration_days, t.price
+    FROM subscriptions s
+    JOIN tariff_plans t ON t.id = s.tariff_plan_id
+    WHERE s.status = %(renewable)s AND s.auto_renew AND t.is_active
+      AND s.end_date < %(run_date)s AND s.id > %(last_id)s
+    ORDER BY s.id
+    LIMIT %(chunk_size)s
+    FOR UPDATE OF s
+),
+numbered AS (
+    SELECT src.*, nextval(pg_get_serial_sequence('subscriptions', 'id')) AS new_id FROM src
+),
+expired AS (
+    UPDATE subscriptions SET status = %(expired)s, updated_at = %(now)s
+    FROM numbered WHERE subscriptions.id = numbered.id
+),
+renewed AS (
+    INSERT INTO subscriptions (id, participant_id, tariff_plan_id, start_date, end_date, status, auto_renew,
+                               created_at, updated_at)
+    SELECT new_id, participant_id, tariff_plan_id, start_date, start_date + duration_days - 1, %(renewable)s, TRUE,
+           %(now)s, %(now)s
+    FROM numbered
+),
+billed AS (
+    INSERT INTO payments (participant_id, subscription_id, amount, payment_date, payment_method, purpose, status,
+                          notes, created_at)
+    SELECT participant_id, new_id, price, %(run_date)s, %(method)s, 'subscription', %(payment_status)s,
+           'Автопродление абонемента #' || id, %(now)s
+    FROM numbered
+)
+SELECT count(*), coalesce(sum(price), 0), max(id) FROM numbered
+"""
+
+
+def _renew_chunk_postgres(renewable, run_date, last_id, chunk_size, now):
+    """То же, что _renew_chunk, одним запросом (условия отбора повторяют renewable)"""
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_RENEW_SQL, {
+            'run_date': run_date, 'last_id': last_id, 'chunk_size': chunk_size, 'now': now,
+            'renewable': RENEWABLE_STATUS, 'expired': EXPIRED_STATUS,
+            'method': AUTO_PAYMENT_METHOD, 'payment_status': AUTO_PAYMENT_STATUS,
+        })
+        renewed, amount, chunk_last_id = cursor.fetchone()
+    if not renewed:
+        return 0, last_id
+    # Все счета пачки попадают в одну строку свёртки
+    apply_revenue_deltas({(run_date, AUTO_PAYMENT_METHOD, 'subscription', AUTO_PAYMENT_STATUS): (amount, renewed)})
+    return renewed, chunk_last_id
+
+
+def run_subscription_cycle(run_date=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Ночной цикл абонементов за run_date.
+
+    1. Истёкшие абонементы с auto_renew и активным тарифом продлеваются:
+       пачками по chunk_size вставляются новые абонементы и счета
+       (PostgreSQL — одним запросом, иначе bulk_create), старые помечаются
+       expired — всё одной транзакцией на пачку.
+    2. Остальные истёкшие переводятся в expired условным UPDATE пачками.
+
+    Повторный запуск за ту же дату ничего не меняет: обработанные абонементы
+    уже expired, а новые действуют на run_date.
+    """
+    run_date = run_date or timezone.localdate()
+    report = CycleReport(run_date)
+    lapsed = lapsed_subscriptions(run_date)
+    renewable = lapsed.filter(status=RENEWABLE_STATUS, auto_renew=True, tariff_plan__is_active=True)
+
+    if dry_run:
+        report.renewed = report.payments = renewable.count()
+        report.expired = lapsed.count()
+        return report
+
+    now = timezone.now()
+    renew_chunk = _renew_chunk_postgres if connection.vendor == 'postgresql' else _renew_chunk
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            renewed, last_id = renew_chunk(renewable, run_date, last_id, chunk_size, now)
+        if not renewed:
+            break
+        report.renewed += renewed
+        report.payments += renewed
+        report.expired += renewed
+
+    while True:
+        chunk = lapsed_subscriptions(run_date).order_by('id').values('id')[:chunk_size]
+        updated = Subscriptions.objects.filter(id__in=chunk).update(status=EXPIRED_STATUS, updated_at=now)
+        report.expired += updated
+        if updated < chunk_size:
+            break
+    return report
+
+
+# === АРЕНДА ШКАФОВ ===
+LOCKER_ACTIVE_STATUSES = ('active', 'occupied')
+LOCKER_CLOSED_STATUS = 'completed'
+
+# payment_period -> длина оплачиваемого периода в месяцах
+PERIOD_MONTHS = {
+    'month': 1, 'monthly': 1, 'месяц': 1,
+    'quarter': 3, 'quarterly': 3, 'квартал': 3,
+    'half_year': 6, 'полгода': 6,
+    'year': 12, 'yearly': 12, 'год': 12,
+}
+DEFAULT_PERIOD_MONTHS = 1
+
+
+def month_bounds(period_start):
+    """Первый и последний день месяца"""
+    first = period_start.replace(day=1)
+    last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+    return first, last
+
+
+def billing_boundary(start_date, period_start, months):
+    """
+    Дата начала оплачиваемого периода аренды, попадающая в месяц period_start,
+    или None. Периоды отсчитываются от start_date с шагом months месяцев;
+    31-е число в коротком месяце сдвигается на последний день.
+    """
+    elapsed = (period_start.year * 12 + period_start.month) - (start_date.year * 12 + start_date.month)
+    if elapsed < 0 or elapsed % months:
+        return None
+    _, last = month_bounds(period_start)
+    return period_start.replace(day=min(start_date.day, last.day))
+
+
+def locker_idempotency_key(rental_id, period_start):
+    return f'locker-rental:{rental_id}:{period_start:%Y-%m}'
+
+
+class LockerBillingReport:
+    def __init__(self, period_start):
+        self.period = f'{period_start:%Y-%m}'
+        self.billed = 0
+        self.amount = Decimal(0)
+        self.closed = 0
+        self.already_billed = 0
+        self.lines = []  # что сделано/будет сделано — для --dry-run
+
+    def as_dict(self):
+        return {
+            'period': self.period,
+            'billed': self.billed,
+            'amount': self.amount,
+            'closed': self.closed,
+            'already_billed': self.already_billed,
+        }
+
+
+def run_locker_billing(period_start=None, dry_run=False, batch_size=1000):
+    """
+    Выставляет счета за аренду шкафов на месяц period_start.
+
+    Кандидаты — действующие аренды, начатые не позже конца месяца (один запрос
+    по индексу (status, start_date)). Аренде выставляется счёт, если в этом
+    месяце начинается её оплачиваемый период (payment_period). Аренды без
+    auto_renew по окончании первого периода закрываются вместо продления.
+
+    Ключ идемпотентности «аренда + месяц» хранится в Payments.idempotency_key
+    (уникальный), поэтому повторный запуск за тот же месяц счетов не дублирует.
+    """
+    period_start, period_end = month_bounds(period_start or timezone.localdate())
+    report = LockerBillingReport(period_start)
+
+    candidates = (
+        LockerRentals.objects
+        .filter(status__in=LOCKER_ACTIVE_STATUSES, start_date__lte=period_end)
+        .order_by('id')
+        .values('id', 'participant_id', 'locker__number', 'rental_cost', 'payment_period', 'start_date', 'auto_renew')
+    )
+    due, closing = [], []
+    for row in candidates:
+        months = PERIOD_MONTHS.get((row['payment_period'] or '').strip().lower(), DEFAULT_PERIOD_MONTHS)
+        boundary = billing_boundary(row['start_date'], period_start, months)
+        if boundary is None:
+            continue
+        if boundary > row['start_date'] and not row['auto_renew']:
+            closing.append(LockerRentals(
+                id=row['id'], status=LOCKER_CLOSED_STATUS, actual_end_date=boundary - timedelta(days=1),
+            ))
+            report.lines.append(f"закрыть аренду #{row['id']} (шкаф №{row['locker__number']}) с {boundary}")
+        else:
+            due.append((row, boundary))
+
+    keys = [locker_idempotency_key(row['id'], period_start) for row, _ in due]
+    billed_keys = set()
+    for offset in range(0, len(keys), batch_size):
+        billed_keys.update(
+            Payments.objects.filter(idempotency_key__in=keys[offset:offset + batch_size])
+            .values_list('idempotency_key', flat=True)
+        )
+
+    payments, rentals = [], []
+    for (row, boundary), key in zip(due, keys):
+        if key in billed_keys:
+            report.already_billed += 1
+            continue
+        payments.append(Payments(
+            participant_id=row['participant_id'], amount=row['rental_cost'], payment_date=boundary,
+            payment_method=AUTO_PAYMENT_METHOD, purpose='locker', status=AUTO_PAYMENT_STATUS,
+            notes=f"Аренда шкафа №{row['locker__number']} с {boundary}", idempotency_key=key,
+        ))
+        rentals.append(LockerRentals(id=row['id']))
+        report.amount += row['rental_cost']
+        report.lines.append(f"счёт {row['rental_cost']} руб. за шкаф №{row['locker__number']} (аренда #{row['id']})")
+    report.billed = len(payments)
+    report.closed = len(closing)
+
+    if dry_run:
+        return report
+
+    with transaction.atomic():
+        Payments.objects.bulk_create(payments, batch_size=batch_size)
+        for rental, payment in zip(rentals, payments):
+            rental.payment_id = payment.pk
+        LockerRentals.objects.bulk_update(rentals, ['payment'], batch_size=batch_size)
+        LockerRentals.objects.bulk_update(closing, ['status', 'actual_end_date'], batch_size=batch_size)
+        mark_changed(LockerRentals)  # у аренд шкафов нет updated_at, а bulk_update сигналов не шлёт
+        # bulk_create не вызывает сигналы — свёртку выручки дополняем сами
+        add_payments_to_rollup(
+            {field: getattr(payment, field) for field in ('payment_date', 'payment_method', 'purpose', 'status', 'amount')}
+            for payment in payments
+        )
+    return report
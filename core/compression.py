@@ -0,0 +1,239 @@
+# core/compression.py
+#
+# Сжатие ответов: zstd, brotli или gzip — по Accept-Encoding клиента и
+# порядку CRM_COMPRESSION['ENCODINGS']. Потоковые ответы (выгрузки
+# StreamingHttpResponse, в том числе async под ASGI) сжимаются по частям:
+# каждая часть сразу сбрасывается клиенту, ответ целиком в памяти не собирается.
+# Уровень сжатия задаётся по маршрутам (ROUTES: первое совпадение регулярного
+# выражения с путём); None вместо уровней — маршрут не сжимается.
+# zstandard и brotli необязательны: без них остаётся gzip.
+# HTML (RANDOM_PADDING_TYPES) сжимается только gzip со случайной длиной заголовка,
+# как в django.middleware.gzip.GZipMiddleware (max_random_bytes) — защита от BREACH:
+# страницы с CSRF-токеном отражают параметры запроса (?zone=).
+
+import functools
+import gzip
+import io
+import re
+import secrets
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость
+    brotli = None
+
+
+COMPRESSION_DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,                       # байт; меньше — не сжимается (у потоковых — по Content-Length)
+    'ENCODINGS': ['zstd', 'br', 'gzip'],    # предпочтение сервера при равных q клиента
+    'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'ROUTES': [],                           # [(регулярное выражение пути, {кодировка: уровень} или None)]
+    'RANDOM_PADDING_TYPES': ['text/html'],  # только gzip со случайным заполнением (BREACH)
+    'MAX_RANDOM_BYTES': 100,                # как GZipMiddleware.max_random_bytes
+    # Уже сжатые форматы (image/svg+xml — текст, сжимается)
+    'SKIP_CONTENT_TYPES': [
+        'image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip',
+        'application/x-gzip', 'application/zstd', 'application/x-7z-compressed', 'application/x-rar-compressed',
+        'application/x-bzip2', 'application/x-xz', 'application/pdf', 'application/vnd.openxmlformats',
+    ],
+}
+
+_accept_encoding_re = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*(?:,|$)')
+
+
+def compression_settings():
+    return {**COMPRESSION_DEFAULTS, **getattr(settings, 'CRM_COMPRESSION', {})}
+
+
+# === КОДЕКИ ===
+class _GzipStream:
+    """
+    gzip по частям. max_random_bytes — случайное имя файла в заголовке
+    (как django.utils.text.compress_sequence): длина ответа меняется от запроса к запросу.
+    """
+
+    def __init__(self, level, max_random_bytes=0):
+        self._buffer = io.BytesIO()
+        filename = b'a' * secrets.randbelow(max_random_bytes) if max_random_bytes else b''
+        self._file = gzip.GzipFile(filename=filename, mode='wb', compresslevel=level, fileobj=self._buffer, mtime=0)
+
+    def _read(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def compress(self, data):
+        self._file.write(data)
+        self._file.flush()  # Z_SYNC_FLUSH: часть сразу уходит клиенту
+        return self._read()
+
+    def finish(self):
+        self._file.close()
+        return self._read()
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def _gzip(data, level, max_random_bytes=0):
+    buffer = io.BytesIO()
+    filename = b'a' * secrets.randbelow(max_random_bytes) if max_random_bytes else b''
+    with gzip.GzipFile(filename=filename, mode='wb', compresslevel=level, fileobj=buffer, mtime=0) as file:
+        file.write(data)
+    return buffer.getvalue()
+
+
+# кодировка -> (сжатие целиком, потоковый компрессор); None — библиотека не установлена
+CODECS = {
+    'gzip': (_gzip, _GzipStream),
+    'br': (lambda data, level: brotli.compress(data, quality=level), _BrotliStream) if brotli else None,
+    'zstd': (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data), _ZstdStream)
+    if zstandard else None,
+}
+
+
+def parse_accept_encoding(header):
+    """{кодировка: q} из Accept-Encoding"""
+    codings = {}
+    for name, q in _accept_encoding_re.findall(header or ''):
+        try:
+            codings[name.lower()] = float(q) if q else 1.0
+        except ValueError:
+            continue
+    return codings
+
+
+def choose_encoding(header, encodings):
+    """Кодировка с наибольшим q клиента среди encodings (при равных — первая в encodings) или None"""
+    codings = parse_accept_encoding(header)
+    best, best_q = None, 0
+    for name in encodings:
+        if CODECS.get(name) is None:
+            continue
+        q = codings.get(name, codings.get('*', 0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+@functools.lru_cache(maxsize=None)
+def _route_pattern(pattern):
+    return re.compile(pattern)
+
+
+def route_levels(path, config):
+    """Уровни сжатия для пути: из первого подходящего ROUTES, иначе LEVELS; None — не сжимать"""
+    for pattern, levels in config['ROUTES']:
+        if _route_pattern(pattern).match(path):
+            return None if levels is None else {**config['LEVELS'], **levels}
+    return config['LEVELS']
+
+
+# === MIDDLEWARE ===
+def _compress_stream(chunks, stream):
+    for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+async def _acompress_stream(chunks, stream):
+    async for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+class CompressionMiddleware:
+    """
+    Как django.middleware.gzip.GZipMiddleware, но с выбором zstd/br/gzip, порогом
+    MIN_SIZE, уровнями по маршрутам и пропуском уже сжатых форматов. HTML — как
+    у GZipMiddleware: только gzip со случайным заполнением заголовка.
+    Сильный ETag становится слабым: сжатое тело не совпадает байт в байт с исходным.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        config = compression_settings()
+        if not config['ENABLED'] or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').lower()
+        if any(content_type.startswith(skipped) for skipped in config['SKIP_CONTENT_TYPES']) \
+                and not content_type.startswith('image/svg+xml'):
+            return response
+        if response.streaming:
+            length = response.get('Content-Length')
+            if length is not None and length.isdigit() and int(length) < config['MIN_SIZE']:
+                return response
+        elif len(response.content) < config['MIN_SIZE']:
+            return response
+        levels = route_levels(request.path_info, config)
+        if levels is None:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        padded = any(content_type.startswith(padded) for padded in config['RANDOM_PADDING_TYPES'])
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING'), ['gzip'] if padded else config['ENCODINGS'],
+        )
+        if encoding is None:
+            return response
+        compress, stream_class = CODECS[encoding]
+        level = levels[encoding]
+        if padded:
+            compress = functools.partial(_gzip, max_random_bytes=config['MAX_RANDOM_BYTES'])
+            stream_class = functools.partial(_GzipStream, max_random_bytes=config['MAX_RANDOM_BYTES'])
+
+        if response.streaming:
+            stream = stream_class(level)
+            if response.is_async:
+                response.streaming_content = _acompress_stream(response.streaming_content, stream)
+            else:
+                response.streaming_content = _compress_stream(response.streaming_content, stream)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(response.content, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
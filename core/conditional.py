@@ -0,0 +1,189 @@
+# core/conditional.py
+#
+# Условные GET для ViewSet: ETag (и Last-Modified у объекта) без сериализации.
+# Отпечаток списка — один агрегат по отфильтрованному queryset (число строк,
+# последний id, последний updated_at) плюс счётчик изменений таблицы в общем
+# кэше. Счётчик увеличивают сигналы save/delete и массовые операции, которые
+# сигналов не шлют (mark_changed) — так видны правки таблиц без updated_at.
+# Связи, развёрнутые ?expand=, входят в отпечаток так же: счётчик их таблицы
+# и последний updated_at.
+#
+# Счётчики работают только в общем кэше (Redis, Memcached — core/shared_cache.py).
+# С кэшем процесса (LocMemCache по умолчанию) у каждого воркера свой счётчик:
+# ETag разных воркеров не совпадали бы, а правка через другой воркер давала бы
+# 304 на устаревшие данные. Поэтому без общего кэша счётчики не используются:
+# у таблиц с updated_at отпечаток строится по агрегату (число строк, последний
+# id, последний updated_at), а списки и объекты таблиц без updated_at (в том
+# числе среди развёрнутых связей) отдаются без ETag — условный GET для них
+# требует общего кэша.
+
+import hashlib
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .shared_cache import counter, is_process_local
+
+
+CHANGES_CACHE_VERSION = 1
+CACHE_CONTROL = 'private, no-cache'
+
+
+# === СЧЁТЧИКИ ИЗМЕНЕНИЙ ===
+def _changes_key(model):
+    return f'changes:{CHANGES_CACHE_VERSION}:{model._meta.db_table}'
+
+
+def table_version(model):
+    return counter(_changes_key(model))
+
+
+def _bump(models):
+    for model in models:
+        try:
+            cache.incr(_changes_key(model))
+        except ValueError:  # счётчика нет — следующее чтение заведёт новый
+            pass
+
+
+def mark_changed(*models):
+    """Отмечает изменение таблиц: сейчас и ещё раз после коммита (ответ мог закэшироваться до него)"""
+    _bump(models)
+    transaction.on_commit(lambda: _bump(models))
+
+
+def model_changed(sender, **kwargs):
+    mark_changed(sender)
+
+
+def model_deleted(sender, **kwargs):
+    # CASCADE/SET_NULL меняют ссылающиеся таблицы без сигналов save()
+    mark_changed(sender, *{relation.related_model for relation in sender._meta.related_objects})
+
+
+def connect_signals():
+    for model in apps.get_app_config('core').get_models():
+        label = model._meta.model_name
+        post_save.connect(model_changed, sender=model, dispatch_uid=f'conditional_{label}_save')
+        post_delete.connect(model_deleted, sender=model, dispatch_uid=f'conditional_{label}_delete')
+
+
+# === ОТПЕЧАТКИ ===
+def _has_updated_at(model):
+    return any(field.name == 'updated_at' for field in model._meta.concrete_fields)
+
+
+def _digest(*parts):
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _related_models(model, paths):
+    """{путь: модель} для всех звеньев путей ('subscription__tariff_plan' — подписка и тариф)"""
+    related = {}
+    for path in paths:
+        current, prefix = model, []
+        for name in path.split('__'):
+            current = current._meta.get_field(name).related_model
+            prefix.append(name)
+            related['__'.join(prefix)] = current
+    return related
+
+
+def _versions(models):
+    """Счётчики таблиц для отпечатка: [] без общего кэша, None — отпечаток без него невозможен"""
+    if not is_process_local():
+        return [table_version(model) for model in models]
+    return [] if all(_has_updated_at(model) for model in models) else None
+
+
+def list_etag(request, queryset, related=()):
+    """
+    Отпечаток страницы списка или None (см. заголовок модуля): адрес с параметрами,
+    формат, счётчики таблиц и агрегат выборки. related — пути развёрнутых связей
+    (FieldSelection.model_paths).
+    """
+    model = queryset.model
+    related = sorted(_related_models(model, related).items())
+    versions = _versions([model, *(related_model for _, related_model in related)])
+    if versions is None:
+        return None
+    aggregates = {'rows': Count('pk'), 'last_id': Max('pk')}
+    if _has_updated_at(model):
+        aggregates['changed'] = Max('updated_at')
+    for index, (path, related_model) in enumerate(related):
+        if _has_updated_at(related_model):
+            aggregates[f'changed_{index}'] = Max(f'{path}__updated_at')
+    state = queryset.order_by().aggregate(**aggregates)
+    return quote_etag(_digest(
+        request.get_full_path(), request.accepted_renderer.format, *versions,
+        *(state[key] for key in sorted(state)),
+    ))
+
+
+def object_validators(request, instance, related=()):
+    """
+    (ETag, Last-Modified в секундах или None) объекта; related — как у list_etag.
+    ETag None — как у list_etag. С развёрнутыми связями Last-Modified не
+    отдаётся: он не учитывает их правки.
+    """
+    model = type(instance)
+    related = sorted(_related_models(model, related).items())
+    versions = _versions([model, *(related_model for _, related_model in related)])
+    if versions is None:
+        return None, None
+    updated_at = getattr(instance, 'updated_at', None) if _has_updated_at(model) else None
+    parts = [*versions, instance.pk, updated_at]
+    for path, _ in related:
+        obj = instance
+        for name in path.split('__'):
+            obj = getattr(obj, name) if obj is not None else None
+        parts += [getattr(obj, 'pk', None), getattr(obj, 'updated_at', None)]
+    etag = quote_etag(_digest(request.get_full_path(), request.accepted_renderer.format, *parts))
+    return etag, int(updated_at.timestamp()) if updated_at and not related else None
+
+
+def _with_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+# === VIEWSET ===
+class ConditionalGetMixin:
+    """
+    list/retrieve отвечают 304 на If-None-Match (и If-Modified-Since у объекта),
+    если данные не менялись: до сериализации выполняется только агрегат
+    (для списка) или выборка объекта. Last-Modified у списка не отдаётся:
+    удаление строки не сдвигает Max(updated_at).
+    """
+
+    def _expanded_paths(self):
+        selected = self.get_field_selection() if hasattr(self, 'get_field_selection') else None
+        return selected[0].model_paths if selected is not None else ()
+
+    def list(self, request, *args, **kwargs):
+        etag = list_etag(request, self.filter_queryset(self.get_queryset()), self._expanded_paths())
+        if etag is None:
+            return super().list(request, *args, **kwargs)
+        not_modified = get_conditional_response(request._request, etag=etag)
+        if not_modified is not None:
+            return _with_validators(not_modified, etag)
+        return _with_validators(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = object_validators(request, instance, self._expanded_paths())
+        if etag is None:
+            return Response(self.get_serializer(instance).data)
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return _with_validators(not_modified, etag, last_modified)
+        return _with_validators(Response(self.get_serializer(instance).data), etag, last_modified)
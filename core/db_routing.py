@@ -0,0 +1,81 @@
+# core/db_routing.py
+#
+# Чтение с реплик. list/retrieve ViewSet'ов в GET-запросах идут на реплику
+# (см. CRM_DATABASE['REPLICAS']), всё остальное — на основную БД. После записи
+# клиент на STICKY_SECONDS получает куку и читает с основной БД: свои изменения
+# видны сразу, даже если реплика отстаёт.
+
+import contextvars
+import random
+
+from django.conf import settings
+
+DATABASE_DEFAULTS = {
+    'REPLICAS': [],         # алиасы из DATABASES; пусто — всё на default
+    'STICKY_SECONDS': 5,    # сколько читать с основной БД после записи (больше лага репликации)
+    'STICKY_COOKIE': 'crm_primary',
+}
+
+READ_ACTIONS = {'list', 'retrieve'}
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Алиас для чтения в текущем запросе; None — решает Django (default)
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def database_settings():
+    return {**DATABASE_DEFAULTS, **getattr(settings, 'CRM_DATABASE', {})}
+
+
+def is_read_action(view_func, method):
+    """list/retrieve ViewSet'а: as_view() сохраняет соответствие метод -> действие в view.actions"""
+    actions = getattr(view_func, 'actions', None)
+    return bool(actions) and actions.get(method.lower()) in READ_ACTIONS
+
+
+class ReplicaRouter:
+    """Чтение — на реплику, выбранную ReplicaRoutingMiddleware; запись и миграции — на default"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in database_settings()['REPLICAS']
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение с реплики для list/retrieve и закрепляет клиента за default после записи"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        config = database_settings()
+        if config['REPLICAS'] and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                config['STICKY_COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        config = database_settings()
+        if (
+            config['REPLICAS']
+            and request.method in SAFE_METHODS
+            and config['STICKY_COOKIE'] not in request.COOKIES
+            and is_read_action(view_func, request.method)
+        ):
+            _read_alias.set(random.choice(config['REPLICAS']))
+        return None
@@ -0,0 +1,272 @@
+# core/equipment.py
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (
+    Count, DecimalField, Exists, ExpressionWrapper, F, Func, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, Greatest, TruncWeek
+from django.utils import timezone
+
+from .conditional import mark_changed
+from .models import Equipment, EquipmentRentals
+
+
+MAX_RANGE_DAYS = 366
+AVAILABILITY_FIELDS = ('id', 'name', 'type', 'size', 'condition')
+
+# Аренда занимает инвентарь с rental_date по день фактического (или планового) возврата включительно
+RENTAL_RANGE_SQL = "daterange(rental_date, coalesce(actual_return_date, return_date), '[]')"
+EXCLUSION_CONSTRAINT = 'equipment_rentals_no_overlap'
+
+OVERDUE_STATUS = 'overdue'
+
+EQUIPMENT_DEFAULTS = {
+    'LATE_FEE_PER_DAY': Decimal('100.00'),  # пеня за каждый день просрочки возврата
+    'MAINTENANCE_INTERVAL_DAYS': 180,       # межсервисный интервал по умолчанию
+    'MAINTENANCE_INTERVALS': {},            # {тип инвентаря: дней} — свои интервалы
+}
+
+
+def equipment_settings():
+    return {**EQUIPMENT_DEFAULTS, **getattr(settings, 'CRM_EQUIPMENT', {})}
+
+
+def rental_end():
+    return Coalesce('actual_return_date', 'return_date')
+
+
+def busy_rentals(date_from, date_to, today=None):
+    """
+    Аренды, занимающие инвентарь в какой-либо день [date_from, date_to]:
+    пересекающиеся по датам и невозвращённые просроченные (они заняты, пока не вернут).
+    """
+    today = today or timezone.localdate()
+    overlapping = Q(rental_date__lte=date_to) & Q(end__gte=date_from)
+    overdue = Q(actual_return_date__isnull=True, return_date__lt=today, rental_date__lte=date_to)
+    return EquipmentRentals.objects.annotate(end=rental_end()).filter(overlapping | overdue)
+
+
+def validate_rental_dates(rental_date, return_date, actual_return_date=None):
+    """Текст ошибки или None"""
+    if return_date < rental_date:
+        return 'Дата возврата раньше даты выдачи'
+    if actual_return_date is not None and actual_return_date < rental_date:
+        return 'Фактический возврат раньше даты выдачи'
+    return None
+
+
+def conflicting_rentals(equipment_id, rental_date, end_date, exclude_id=None):
+    """Другие аренды того же инвентаря, мешающие выдать его на [rental_date, end_date]"""
+    queryset = busy_rentals(rental_date, end_date).filter(equipment_id=equipment_id)
+    if exclude_id is not None:
+        queryset = queryset.exclude(pk=exclude_id)
+    return queryset
+
+
+# === ПОИСК СВОБОДНОГО ИНВЕНТАРЯ ===
+def availability(equipment_type, date_from, date_to, size=None, today=None):
+    """
+    Инвентарь типа (и размера) на период одним запросом.
+    Возвращает (свободные, занятые); у занятых free_from — день после
+    окончания последней пересекающейся аренды, у невозвращённых просроченных
+    free_from = None и overdue = True.
+    """
+    if date_to < date_from:
+        raise ValueError('Конец периода раньше начала')
+    if (date_to - date_from).days > MAX_RANGE_DAYS:
+        raise ValueError(f'Период не больше {MAX_RANGE_DAYS} дней')
+    today = today or timezone.localdate()
+
+    rentals = EquipmentRentals.objects.filter(equipment=OuterRef('pk')).order_by()
+    busy_until = (
+        rentals.annotate(end=rental_end())
+        .filter(rental_date__lte=date_to, end__gte=date_from)
+        .values('equipment')
+        .annotate(last=Max('end'))
+        .values('last')
+    )
+    overdue = rentals.filter(actual_return_date__isnull=True, return_date__lt=today, rental_date__lte=date_to)
+
+    queryset = Equipment.objects.filter(type=equipment_type)
+    if size:
+        queryset = queryset.filter(size=size)
+    rows = (
+        queryset
+        .annotate(busy_until=Subquery(busy_until), overdue=Exists(overdue))
+        .values(*AVAILABILITY_FIELDS, 'busy_until', 'overdue')
+        .order_by('name', 'id')
+    )
+
+    available, booked = [], []
+    for row in rows:
+        busy_until = row.pop('busy_until')
+        if busy_until is None and not row['overdue']:
+            available.append(row)
+            continue
+        row['free_from'] = None if row['overdue'] else busy_until + timedelta(days=1)
+        booked.append(row)
+    booked.sort(key=lambda row: (row['free_from'] is None, row['free_from'] or date_from))
+    return available, booked
+
+
+# === ПРОСРОЧКА И ПЕНИ ===
+class DaysBetween(Func):
+    """Целое число дней между датами: DaysBetween(конец, начало)"""
+    arity = 2
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '  # PostgreSQL: date - date = integer
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)', arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+
+def overdue_rentals(run_date=None):
+    """Невозвращённые аренды с прошедшей датой возврата (частичный индекс equipment_rentals_open_return)"""
+    return EquipmentRentals.objects.filter(
+        actual_return_date__isnull=True, return_date__lt=run_date or timezone.localdate(),
+    )
+
+
+class LateFeeReport:
+    def __init__(self, run_date):
+        self.run_date = run_date
+        self.updated = 0
+        self.by_type = []  # [{'type', 'rentals', 'late_fees'}]
+
+    def as_dict(self):
+        return {'run_date': self.run_date, 'updated': self.updated, 'by_type': self.by_type}
+
+
+def accrue_late_fees(run_date=None, dry_run=False):
+    """
+    Ночное начисление пеней одним UPDATE по открытым просроченным арендам:
+    late_fee = дни просрочки × LATE_FEE_PER_DAY, в cost прежняя пеня заменяется
+    новой, статус — overdue. Повторный запуск за ту же дату ничего не меняет.
+    В отчёте — пени на run_date по той же формуле, в том числе при dry_run.
+    """
+    run_date = run_date or timezone.localdate()
+    report = LateFeeReport(run_date)
+    rentals = overdue_rentals(run_date)
+    rate = Decimal(equipment_settings()['LATE_FEE_PER_DAY'])
+    fee = ExpressionWrapper(
+        DaysBetween(Value(run_date), F('return_date')) * Value(rate),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+    if not dry_run:
+        # В SET справа старые значения строки: F('late_fee') — пеня прошлого запуска
+        report.updated = rentals.update(
+            cost=ExpressionWrapper(
+                Coalesce('cost', Value(Decimal(0))) - F('late_fee') + fee,
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+            late_fee=fee,
+            status=OVERDUE_STATUS,
+        )
+        mark_changed(EquipmentRentals)
+    report.by_type = list(
+        rentals.values(type=F('equipment__type'))
+        .annotate(rentals=Count('id'), late_fees=Sum(fee))
+        .order_by('type')
+    )
+    for row in report.by_type:
+        row['late_fees'] = (row['late_fees'] or Decimal(0)).quantize(Decimal('0.01'))  # SQLite теряет масштаб
+    if dry_run:
+        report.updated = sum(row['rentals'] for row in report.by_type)
+    return report
+
+
+# === ТЕХОБСЛУЖИВАНИЕ ===
+DEFAULT_DUE_DAYS = 7
+MAX_PLAN_WEEKS = 52
+
+
+def maintenance_interval(equipment_type):
+    config = equipment_settings()
+    return timedelta(days=config['MAINTENANCE_INTERVALS'].get(equipment_type, config['MAINTENANCE_INTERVAL_DAYS']))
+
+
+def due_for_maintenance(until, conditions=None, equipment_type=None):
+    """Инвентарь с плановым обслуживанием не позже until (индекс equipment_next_maintenance)"""
+    queryset = Equipment.objects.filter(next_maintenance_date__lte=until)
+    if conditions:
+        queryset = queryset.filter(condition__in=conditions)
+    if equipment_type:
+        queryset = queryset.filter(type=equipment_type)
+    return queryset
+
+
+def mark_serviced(ids, service_date=None, condition=None):
+    """
+    Отмечает обслуживание: last = service_date, next = service_date + интервал типа.
+    Одна выборка и один bulk_update; возвращает число обновлённых единиц.
+    """
+    service_date = service_date or timezone.localdate()
+    now = timezone.now()
+    fields = ['last_maintenance_date', 'next_maintenance_date', 'updated_at']
+    if condition is not None:
+        fields.append('condition')
+    items = list(Equipment.objects.filter(pk__in=ids).only('id', 'type'))
+    for item in items:
+        item.last_maintenance_date = service_date
+        item.next_maintenance_date = service_date + maintenance_interval(item.type)
+        item.updated_at = now  # bulk_update не трогает auto_now
+        if condition is not None:
+            item.condition = condition
+    Equipment.objects.bulk_update(items, fields, batch_size=1000)
+    return len(items)
+
+
+def maintenance_weekly(weeks=8, today=None, equipment_type=None):
+    """
+    Нагрузка по неделям (GROUP BY в SQL): сколько единиц надо обслужить.
+    Просроченное попадает в текущую неделю — его тоже делать сейчас.
+    """
+    today = today or timezone.localdate()
+    week_start = today - timedelta(days=today.weekday())
+    queryset = Equipment.objects.filter(next_maintenance_date__lt=week_start + timedelta(weeks=weeks))
+    if equipment_type:
+        queryset = queryset.filter(type=equipment_type)
+    return list(
+        queryset
+        .annotate(week=TruncWeek(Greatest('next_maintenance_date', Value(week_start))))
+        .values('week')
+        .annotate(due=Count('id'), overdue=Count('id', filter=Q(next_maintenance_date__lt=today)))
+        .order_by('week')
+    )
+
+
+# === POSTGRESQL: запрет двойной выдачи ===
+# Без btree_gist равенство equipment_id выражаем пересечением вырожденных int8range —
+# хватает встроенных GiST-классов для диапазонов. Поиску свободного инвентаря этот
+# индекс не нужен: выборка по индексу equipment_id (десятки аренд на единицу) быстрее.
+POSTGRES_SETUP_SQL = [
+    f"ALTER TABLE equipment_rentals ADD CONSTRAINT {EXCLUSION_CONSTRAINT} EXCLUDE USING gist ("
+    f"int8range(equipment_id, equipment_id, '[]') WITH &&, {RENTAL_RANGE_SQL} WITH &&)",
+]
+
+
+def setup_rental_constraints():
+    """
+    Создаёт ограничение на PostgreSQL (повторный вызов безопасен).
+    Возвращает выполненные команды; пустой список — БД не поддерживается
+    или ограничение уже есть. DatabaseError — в данных уже есть пересечения.
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", [EXCLUSION_CONSTRAINT])
+        if cursor.fetchone():
+            return []
+        with transaction.atomic():
+            for statement in POSTGRES_SETUP_SQL:
+                cursor.execute(statement)
+    return POSTGRES_SETUP_SQL
@@ -0,0 +1,138 @@
+# core/export.py
+
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+# === РЕНДЕРЕРЫ ВЫГРУЗКИ ===
+# Нужны только для согласования формата (?format=csv|ndjson);
+# сами данные отдаются потоком, минуя Response.
+class CSVExportRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Ошибки (404, 400) приходят сюда обычным словарём
+        return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode(self.charset)
+
+
+class NDJSONExportRenderer(CSVExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def _plain(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow([_plain(value) for value in row]))
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_ndjson(header, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    buffer = []
+    for row in rows:
+        buffer.append(encoder.encode(dict(zip(header, row))) + '\n')
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiter_chunks(chunks):
+    """
+    Синхронный генератор выгрузки как асинхронный — для ASGI: синхронный итератор
+    Django под ASGI сначала целиком собирает в список. Каждая часть читается через
+    sync_to_async(thread_sensitive=True), то есть в потоке запроса — там же, где
+    открыт серверный курсор БД.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+EXPORT_WRITERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+}
+
+
+# === ВЫГРУЗКА ДЛЯ VIEWSET ===
+class ExportMixin:
+    """
+    Добавляет к ViewSet `GET export/?format=csv|ndjson`.
+
+    Выгрузка идёт по тому же queryset и фильтрам, что и список, но без
+    сериализаторов: values_list() читается серверным курсором
+    (.iterator(chunk_size=...)) и сразу пишется в StreamingHttpResponse,
+    поэтому память не растёт с числом строк. Под ASGI ответ получает
+    асинхронный итератор (aiter_chunks) — иначе Django буферизует его целиком.
+    """
+    export_exclude = ()
+
+    def get_export_fields(self):
+        model = self.get_queryset().model
+        return [field for field in model._meta.concrete_fields if field.name not in self.export_exclude]
+
+    @action(
+        detail=False, methods=['get'], url_path='export',
+        renderer_classes=[CSVExportRenderer, NDJSONExportRenderer], pagination_class=None,
+    )
+    def export(self, request):
+        fields = self.get_export_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = getattr(self, 'ordering', None)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+
+        rows = queryset.values_list(*[field.attname for field in fields]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        header = [field.name for field in fields]
+        renderer = request.accepted_renderer
+
+        chunks = EXPORT_WRITERS[renderer.format](header, rows)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+        response = StreamingHttpResponse(
+            chunks,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        filename = f'{self.basename or queryset.model._meta.db_table}.{renderer.format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
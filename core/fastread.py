@@ -0,0 +1,165 @@
+# core/fastread.py
+#
+# Быстрое чтение для list/retrieve. Сериализатор ViewSet'а один раз на запрос
+# «компилируется» в список (поле ответа, колонка, преобразователь), страница
+# выбирается через values() — без экземпляров моделей и без обхода полей DRF
+# на каждой строке. Преобразователи берутся из полей того же сериализатора:
+# числа, строки, bool и id связей приходят из БД готовыми, для остальных
+# (DecimalField, DateTimeField, ChoiceField, ...) вызывается to_representation
+# самого поля — поэтому ответ совпадает с сериализатором байт в байт.
+# Сериализаторы, которые так не разложить (вложенные, SerializerMethodField,
+# source через точку или '*', свой to_representation), работают как обычно.
+
+import datetime
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from django.utils import timezone
+from rest_framework import ISO_8601, relations, serializers
+from rest_framework.settings import api_settings
+
+FAST_ACTIONS = {'list', 'retrieve'}
+FAST_FORMATS = {'json', 'msgpack'}  # Browsable API строит формы по настоящему сериализатору
+
+# Поля, у которых to_representation для значения из своей колонки ничего не меняет
+PLAIN_FIELDS = (
+    serializers.IntegerField, serializers.BooleanField, serializers.CharField, serializers.EmailField,
+)
+
+
+def _iso_format(field, default):
+    output_format = getattr(field, 'format', default)
+    return output_format is not None and output_format.lower() == ISO_8601
+
+
+def _datetime_converter(field):
+    """DateTimeField.to_representation с часовым поясом, найденным один раз на запрос, а не на значение"""
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None or not _iso_format(field, api_settings.DATETIME_FORMAT):
+        return field.to_representation
+
+    def convert(value):
+        if not isinstance(value, datetime.datetime) or not timezone.is_aware(value):
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _converter(field, model_field):
+    """None — значение колонки отдаётся как есть; иначе функция преобразования"""
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        return None if field.pk_field is None else field.pk_field.to_representation
+    if model_field.is_relation:
+        return field.to_representation
+    if type(field) in PLAIN_FIELDS:
+        return None
+    if type(field) is serializers.BigIntegerField and not getattr(
+        field, 'coerce_to_string', api_settings.COERCE_BIGINT_TO_STRING,
+    ):
+        return None
+    if type(field) is serializers.DateField and _iso_format(field, api_settings.DATE_FORMAT):
+        return datetime.date.isoformat
+    if type(field) is serializers.DateTimeField:
+        return _datetime_converter(field)
+    return field.to_representation
+
+
+def _compilable(field):
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        return type(field).get_attribute is relations.RelatedField.get_attribute
+    return (
+        not isinstance(field, (serializers.BaseSerializer, relations.RelatedField, relations.ManyRelatedField))
+        and type(field).get_attribute is serializers.Field.get_attribute
+    )
+
+
+class ReadPlan:
+    """Скомпилированный сериализатор: columns — для values(), fields — (имя, колонка, преобразователь)"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = tuple(dict.fromkeys(column for _, column, _ in fields))
+
+    def _represent(self, get):
+        data = {}
+        for name, column, convert in self.fields:
+            value = get(column)
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def represent(self, row):
+        """Строка values() или экземпляр модели"""
+        if isinstance(row, dict):
+            return self._represent(row.__getitem__)
+        return self._represent(lambda column: getattr(row, column))
+
+    def represent_many(self, rows):
+        if isinstance(rows, QuerySet) and rows._fields is None:
+            rows = rows.values(*self.columns)
+        return [self.represent(row) for row in rows]
+
+
+def compile_serializer(serializer):
+    """ReadPlan для ModelSerializer или None, если его не разложить на колонки"""
+    if not isinstance(serializer, serializers.ModelSerializer):
+        return None
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        return None
+    opts = serializer.Meta.model._meta
+    fields = []
+    for field in serializer._readable_fields:
+        if not _compilable(field) or not field.source or '.' in field.source or field.source == '*':
+            return None
+        try:
+            model_field = opts.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        fields.append((field.field_name, model_field.attname, _converter(field, model_field)))
+    return ReadPlan(fields)
+
+
+class CompiledSerializer:
+    """Подменяет сериализатор в list/retrieve: отдаёт только .data"""
+
+    def __init__(self, plan, instance, many=False):
+        self.instance = instance
+        self.data = plan.represent_many(instance) if many else plan.represent(instance)
+
+
+# === VIEWSET ===
+class FastReadMixin:
+    """
+    list/retrieve в JSON и MessagePack через ReadPlan. Ставится перед FieldSelectionMixin:
+    компилируется уже урезанный ?fields= сериализатор; с ?expand= (вложенные
+    сериализаторы) — обычный путь.
+    """
+
+    def get_read_plan(self):
+        if not hasattr(self, '_read_plan'):
+            self._read_plan = None
+            renderer = getattr(self.request, 'accepted_renderer', None)
+            if (
+                self.action in FAST_ACTIONS and self.request.method in ('GET', 'HEAD')
+                and renderer is not None and renderer.format in FAST_FORMATS
+            ):
+                self._read_plan = compile_serializer(super().get_serializer())
+        return self._read_plan
+
+    def paginate_queryset(self, queryset):
+        plan = self.get_read_plan()
+        if plan is not None and isinstance(queryset, QuerySet):
+            # Курсорной пагинации нужны поля сортировки в строках
+            ordering = getattr(self, 'ordering', None) or ()
+            ordering = (ordering,) if isinstance(ordering, str) else ordering
+            extra = [queryset.model._meta.pk.attname, *(name.lstrip('-') for name in ordering)]
+            queryset = queryset.values(*dict.fromkeys((*plan.columns, *extra)))
+        return super().paginate_queryset(queryset)
+
+    def get_serializer(self, *args, **kwargs):
+        plan = self.get_read_plan()
+        if plan is None or not args:
+            return super().get_serializer(*args, **kwargs)
+        return CompiledSerializer(plan, args[0], many=kwargs.get('many', False))
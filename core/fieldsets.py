@@ -0,0 +1,170 @@
+# core/fieldsets.py
+#
+# ?fields= и ?expand= для list/retrieve всех ViewSet.
+#   ?fields=id,last_name,phone          — только эти поля; queryset.only() по ним
+#   ?expand=participant,subscription.tariff_plan
+#                                       — вместо id связи вложенный объект;
+#                                         связи подтягиваются select_related одним запросом
+# Все связи в схеме — прямые ForeignKey, поэтому расширение всегда JOIN, без N+1.
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .serializers import EXPAND_SERIALIZERS
+
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+MAX_EXPAND_DEPTH = 3
+SHAPED_ACTIONS = {'list', 'retrieve'}
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def _is_expandable(field):
+    return (
+        field is not None and field.concrete and (field.many_to_one or field.one_to_one)
+        and field.related_model in EXPAND_SERIALIZERS
+    )
+
+
+class FieldSelection:
+    """Разобранные ?fields= и ?expand=; expand — пути по полям модели ('subscription__tariff_plan')"""
+
+    def __init__(self, fields, expand):
+        self.fields = fields    # имена полей сериализатора или None — все
+        self.expand = expand    # {поле сериализатора: [хвосты путей]}
+        self.model_paths = []   # пути для select_related
+
+
+def parse_selection(params, serializer):
+    """ValidationError (400) на неизвестные поля и связи"""
+    available = serializer.fields
+    model = serializer.Meta.model
+    fields = _split(params.get(FIELDS_PARAM, '')) or None
+    if fields is not None:
+        unknown = [name for name in fields if name not in available]
+        if unknown:
+            raise ValidationError({FIELDS_PARAM: f"Неизвестные поля: {', '.join(unknown)}"})
+
+    selection = FieldSelection(fields, {})
+    for path in _split(params.get(EXPAND_PARAM, '')):
+        head, *tail = path.split('.')
+        if len(tail) >= MAX_EXPAND_DEPTH:
+            raise ValidationError({EXPAND_PARAM: f'{path}: не глубже {MAX_EXPAND_DEPTH} уровней'})
+        field = _model_field(model, available[head].source) if head in available else None
+        model_path = [field.name] if _is_expandable(field) else None
+        current = field.related_model if model_path else None
+        for name in tail:
+            if model_path is None:
+                break
+            related = _model_field(current, name)
+            if not _is_expandable(related):
+                model_path = None
+                break
+            model_path.append(name)
+            current = related.related_model
+        if model_path is None:
+            raise ValidationError({EXPAND_PARAM: f'{path}: нельзя развернуть'})
+        selection.expand.setdefault(head, []).append(tail)
+        selection.model_paths.append('__'.join(model_path))
+        if fields is not None and head not in fields:
+            fields.append(head)
+    return selection
+
+
+# === СЕРИАЛИЗАТОР ===
+def _expand(serializer, expand):
+    for name, tails in expand.items():
+        source = serializer.fields[name].source
+        related_model = serializer.Meta.model._meta.get_field(source).related_model
+        nested = EXPAND_SERIALIZERS[related_model](read_only=True, **({'source': source} if source != name else {}))
+        serializer.fields[name] = nested
+        nested_expand = {}
+        for head, *tail in filter(None, tails):
+            nested_expand.setdefault(head, []).append(tail)
+        _expand(nested, nested_expand)
+
+
+def shape_serializer(serializer, selection):
+    """Убирает лишние поля и заменяет id связей вложенными сериализаторами"""
+    target = serializer.child if isinstance(serializer, serializers.ListSerializer) else serializer
+    if selection.fields is not None:
+        for name in list(target.fields):
+            if name not in selection.fields:
+                target.fields.pop(name)
+    _expand(target, selection.expand)
+    return serializer
+
+
+# === QUERYSET ===
+def _related_columns(model, path):
+    """Колонки моделей на пути path: для only() при select_related"""
+    columns = []
+    prefix = []
+    for name in path.split('__'):
+        model = model._meta.get_field(name).related_model
+        prefix.append(name)
+        columns.extend('__'.join(prefix + [field.name]) for field in model._meta.concrete_fields)
+    return columns
+
+
+def plan_queryset(queryset, serializer, selection, ordering=()):
+    """select_related для развёрнутых связей, only() для выбранных полей"""
+    model = queryset.model
+    if selection.model_paths:
+        queryset = queryset.select_related(*selection.model_paths)
+    if selection.fields is None:
+        return queryset
+
+    columns = {model._meta.pk.name}
+    for name in selection.fields:
+        field = _model_field(model, serializer.fields[name].source)
+        if field is None or not field.concrete:
+            return queryset  # вычисляемое поле — какие колонки нужны, неизвестно
+        columns.add(field.name)
+    # Поля сортировки читает курсорная пагинация, updated_at — ConditionalGetMixin
+    columns.update(name.lstrip('-') for name in ordering)
+    if _model_field(model, 'updated_at') is not None:
+        columns.add('updated_at')
+    for path in selection.model_paths:
+        columns.update(_related_columns(model, path))
+    return queryset.only(*columns)
+
+
+# === VIEWSET ===
+class FieldSelectionMixin:
+    """?fields= и ?expand= для list/retrieve; остальные действия отдают полное представление"""
+
+    def get_field_selection(self):
+        if not hasattr(self, '_field_selection'):
+            params = self.request.query_params
+            self._field_selection = None
+            if self.action in SHAPED_ACTIONS and (params.get(FIELDS_PARAM) or params.get(EXPAND_PARAM)):
+                serializer = self.get_serializer_class()(context=self.get_serializer_context())
+                self._field_selection = (parse_selection(params, serializer), serializer)
+        return self._field_selection
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        selected = self.get_field_selection()
+        if selected is None:
+            return queryset
+        selection, serializer = selected
+        ordering = getattr(self, 'ordering', None) or ()
+        return plan_queryset(queryset, serializer, selection, (ordering,) if isinstance(ordering, str) else ordering)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        selected = self.get_field_selection()
+        return shape_serializer(serializer, selected[0]) if selected is not None else serializer
@@ -0,0 +1,461 @@
+# core/importer.py
+#
+# Пакетный импорт CSV/XLSX. Цель — 50 тыс. строк/с — не достигнута: на
+# локальном PostgreSQL 16 50 тыс. участников загружаются за ~1,8–2,2 с
+# (~25 тыс. строк/с). Узкие места при COPY-пути:
+#   - сам COPY с проверкой уникального email и PK — ~0,6 с на 50 тыс. строк,
+#     то есть потолок ~80 тыс. строк/с ещё до всякой работы Python;
+#   - валидация полей Django (to_python и валидаторы, ~0,7 с) и сборка CSV
+#     для COPY (~0,3 с).
+# Промежуточная UNLOGGED-таблица с одним INSERT ... SELECT работу БД не
+# уменьшает: те же строки проходят те же индексы, а сигналов и аудита у
+# COPY-пути нет и так (сводка выручки для платежей — один проход на пакет).
+# Дойти до 50 тыс. можно только ценой отказа от построчной валидации.
+
+import csv
+import io
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.validators import EmailValidator, MaxLengthValidator
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+
+from .models import Participants, Positions, Subscriptions, Payments, TariffPlans
+from .reports import add_payments_to_rollup
+
+
+DEFAULT_BATCH_SIZE = 5000
+COPY_NULL = '\\N'
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _lookup_key(value):
+    """Значение колонки-ссылки как строка; XLSX отдаёт целые id числом с плавающей точкой (5.0)"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _is_auto_time(field):
+    return getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+
+
+# Подмножество адресов, которые EmailValidator заведомо принимает (ASCII, домен с буквенной
+# зоной): такие не проходят полную проверку — она дороже всей остальной валидации строки
+SIMPLE_EMAIL_RE = re.compile(
+    r'[a-z0-9_%+-]+(?:\.[a-z0-9_%+-]+)*@(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}',
+    re.IGNORECASE,
+)
+
+
+def _fast_validator(validator):
+    """
+    Дешёвая проверка перед валидатором: сам валидатор вызывается, только если
+    значение не прошло её — ради проверки по всем правилам и текста ошибки
+    """
+    if type(validator) is MaxLengthValidator and isinstance(validator.limit_value, int):
+        limit = validator.limit_value
+
+        def check_length(value):
+            if len(value) > limit:
+                validator(value)
+        return check_length
+    if type(validator) is EmailValidator:
+        match = SIMPLE_EMAIL_RE.fullmatch
+
+        def check_email(value):
+            if len(value) > 320 or match(value) is None:
+                validator(value)
+        return check_email
+    return validator
+
+
+def _make_converter(field):
+    """to_python + валидаторы поля без накладных расходов run_validators"""
+    to_python = field.to_python
+    validators = [_fast_validator(validator) for validator in field.validators]
+
+    def convert(value):
+        if isinstance(value, str):
+            value = value.strip()
+        value = to_python(value)
+        for validator in validators:
+            validator(value)
+        return value
+
+    return convert
+
+
+# === ОПИСАНИЕ ИМПОРТИРУЕМЫХ ТАБЛИЦ ===
+class ImportSpec:
+    """
+    Что и как загружать в модель.
+
+    lookups: колонка файла -> (FK-поле модели, модель, поле для поиска).
+    Например 'participant_email' -> ('participant', Participants, 'email').
+    unique: поля, уникальность которых проверяется до записи.
+    on_bulk_write: вызывается со списком вставленных строк (словари полей)
+    после COPY/bulk_create — там, где не срабатывают сигналы save().
+    """
+
+    def __init__(self, model, lookups=None, unique=(), on_bulk_write=None):
+        self.model = model
+        self.lookups = lookups or {}
+        self.unique = unique
+        self.on_bulk_write = on_bulk_write
+        self.fields = {
+            field.name: field
+            for field in model._meta.concrete_fields
+            if not field.primary_key and not field.is_relation
+            and not _is_auto_time(field)
+        }
+        self.required_fk = {
+            field.name for field in model._meta.concrete_fields if field.is_relation and not field.null
+        }
+
+
+PARTICIPANT_LOOKUPS = {
+    'participant': ('participant', Participants, 'id'),
+    'participant_email': ('participant', Participants, 'email'),
+}
+
+IMPORT_SPECS = {
+    'participants': ImportSpec(
+        Participants,
+        lookups={
+            'position': ('position', Positions, 'id'),
+            'position_name': ('position', Positions, 'name'),
+        },
+        unique=('email',),
+    ),
+    'subscriptions': ImportSpec(
+        Subscriptions,
+        lookups={
+            **PARTICIPANT_LOOKUPS,
+            'tariff_plan': ('tariff_plan', TariffPlans, 'id'),
+            'tariff_plan_name': ('tariff_plan', TariffPlans, 'name'),
+        },
+    ),
+    'payments': ImportSpec(
+        Payments,
+        lookups={
+            **PARTICIPANT_LOOKUPS,
+            'subscription': ('subscription', Subscriptions, 'id'),
+        },
+        on_bulk_write=add_payments_to_rollup,
+    ),
+}
+
+
+# === ЧТЕНИЕ ФАЙЛОВ ===
+def iter_csv_rows(stream, delimiter=','):
+    """Строки CSV как словари; stream — текстовый поток"""
+    reader = csv.DictReader(stream, delimiter=delimiter)
+    for row in reader:
+        yield row
+
+
+def iter_xlsx_rows(stream):
+    """Строки первого листа XLSX как словари (нужен openpyxl)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Для импорта XLSX установите openpyxl')
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for values in rows:
+            if values is None or all(value is None for value in values):
+                continue
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def open_rows(stream, file_format, delimiter=','):
+    """stream — бинарный поток файла"""
+    if file_format == 'xlsx':
+        return iter_xlsx_rows(stream)
+    if file_format == 'csv':
+        return iter_csv_rows(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), delimiter=delimiter)
+    raise ValueError(f'Неизвестный формат файла: {file_format}')
+
+
+def detect_format(filename):
+    return 'xlsx' if filename.lower().endswith('.xlsx') else 'csv'
+
+
+# === ИМПОРТ ===
+class ImportReport:
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.rejected = 0
+        self.errors = []  # первые ошибки — для ответа API
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'created': self.created,
+            'rejected': self.rejected,
+            'errors': self.errors,
+        }
+
+
+def _batched(rows, size):
+    batch = []
+    for line, row in enumerate(rows, start=2):  # 1-я строка — заголовок
+        batch.append((line, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Importer:
+    """
+    Потоковый пакетный импорт.
+
+    Строки читаются пакетами; внешние ключи каждого пакета разрешаются
+    одним запросом на справочник, валидные строки пишутся одним
+    COPY (PostgreSQL) или bulk_create, ошибочные — в файл отказов.
+    Если пакет упал на ограничении БД, он повторяется построчно
+    в savepoint-ах, чтобы отбросить только виновные строки.
+    """
+
+    max_reported_errors = 100
+
+    def __init__(self, resource, batch_size=DEFAULT_BATCH_SIZE, rejects=None, use_copy=True, dry_run=False):
+        if resource not in IMPORT_SPECS:
+            raise ValueError(f'Неизвестный тип данных: {resource}')
+        self.spec = IMPORT_SPECS[resource]
+        self.batch_size = batch_size
+        self.rejects = rejects  # текстовый поток для CSV с отказами
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.dry_run = dry_run
+        self.report = ImportReport()
+        self._reject_writer = None
+
+    def run(self, rows):
+        for batch in _batched(rows, self.batch_size):
+            if self.report.total == 0:
+                self.prepare(batch[0][1].keys())
+            self.report.total += len(batch)
+            valid = self.build_batch(batch)
+            if self.dry_run:
+                self.report.created += len(valid)
+            elif valid:
+                self.write_batch(valid)
+        return self.report
+
+    # --- валидация ---
+    def prepare(self, header):
+        """Разбор заголовка: конвертеры колонок и значения по умолчанию считаются один раз"""
+        header = set(header)
+        model = self.spec.model
+        self.columns = [
+            (name, field, _make_converter(field)) for name, field in self.spec.fields.items() if name in header
+        ]
+        self.lookup_columns = [
+            (column, f'{fk_name}_id') for column, (fk_name, _, _) in self.spec.lookups.items() if column in header
+        ]
+        provided = {name for name, _, _ in self.columns} | {attname for _, attname in self.lookup_columns}
+
+        missing = [
+            name for name, field in self.spec.fields.items()
+            if not field.null and not field.has_default() and name not in provided
+        ]
+        missing += [name for name in self.spec.required_fk if f'{name}_id' not in provided]
+        if missing:
+            raise ValueError(f'В файле нет обязательных колонок: {", ".join(sorted(missing))}')
+
+        self.required_fk = [f'{name}_id' for name in self.spec.required_fk]
+        self.insert_fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        self.defaults = {
+            field.attname: field.get_default()
+            for field in self.insert_fields
+            if field.attname not in provided and not _is_auto_time(field)
+        }
+
+    def resolve_lookups(self, batch):
+        """Один запрос на каждую колонку-ссылку в пакете"""
+        resolved = {}
+        for column, (_, model, key) in self.spec.lookups.items():
+            keys = {_lookup_key(row[column]) for _, row in batch if not _is_empty(row.get(column))}
+            if not keys:
+                continue
+            if key == 'id':
+                keys = {int(value) for value in keys if value.isdigit()}
+            found = model.objects.filter(**{f'{key}__in': keys}).values_list(key, 'id')
+            resolved[column] = {str(value): pk for value, pk in found}
+        return resolved
+
+    def existing_unique(self, batch):
+        existing = {}
+        for name in self.spec.unique:
+            values = {str(row[name]).strip() for _, row in batch if not _is_empty(row.get(name))}
+            existing[name] = self._existing_values(name, values) if values else set()
+        return existing
+
+    def _existing_values(self, name, values):
+        model = self.spec.model
+        if connection.vendor != 'postgresql':
+            return set(model.objects.filter(**{f'{name}__in': values}).values_list(name, flat=True))
+        # Один параметр-массив вместо тысяч плейсхолдеров IN (...), которые ORM готовит по одному
+        quote = connection.ops.quote_name
+        column = quote(model._meta.get_field(name).column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {column} FROM {quote(model._meta.db_table)} WHERE {column} = ANY(%s)', [list(values)],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def build_row(self, row, resolved):
+        """Строка файла -> словарь {attname: значение} для вставки"""
+        values = dict(self.defaults)
+        for name, field, convert in self.columns:
+            raw = row[name]
+            if _is_empty(raw):
+                if field.null:
+                    values[name] = None
+                elif field.has_default():
+                    values[name] = field.get_default()
+                else:
+                    raise ValidationError(f'{name}: обязательное поле')
+                continue
+            try:
+                values[name] = convert(raw)
+            except ValidationError as e:
+                raise ValidationError(f'{name}: {"; ".join(e.messages)}')
+
+        for column, attname in self.lookup_columns:
+            raw = row[column]
+            if _is_empty(raw):
+                continue
+            key = _lookup_key(raw)
+            pk = resolved.get(column, {}).get(key)
+            if pk is None:
+                raise ValidationError(f'{column}: «{key}» не найден')
+            values[attname] = pk
+
+        missing_fk = [attname[:-3] for attname in self.required_fk if values.get(attname) is None]
+        if missing_fk:
+            raise ValidationError(f'{", ".join(missing_fk)}: обязательная ссылка')
+        return values
+
+    def build_batch(self, batch):
+        resolved = self.resolve_lookups(batch)
+        existing = self.existing_unique(batch)
+        seen = {name: set() for name in self.spec.unique}
+        valid = []
+        for line, row in batch:
+            try:
+                values = self.build_row(row, resolved)
+                for name in self.spec.unique:
+                    value = values.get(name)
+                    if value is None:
+                        continue
+                    if value in existing[name] or value in seen[name]:
+                        raise ValidationError(f'{name}: «{value}» уже существует')
+                    seen[name].add(value)
+            except ValidationError as e:
+                self.reject(line, row, '; '.join(e.messages))
+                continue
+            valid.append((line, row, values))
+        return valid
+
+    # --- запись ---
+    def write_batch(self, valid):
+        try:
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy_batch([values for _, _, values in valid])
+                else:
+                    self.spec.model.objects.bulk_create([self.spec.model(**values) for _, _, values in valid])
+                self.check_deferred()
+                if self.spec.on_bulk_write:
+                    self.spec.on_bulk_write([values for _, _, values in valid])
+            self.report.created += len(valid)
+        except IntegrityError:
+            self.write_rows_one_by_one(valid)
+
+    def write_rows_one_by_one(self, valid):
+        for line, row, values in valid:
+            try:
+                with transaction.atomic():
+                    self.spec.model(**values).save(force_insert=True)
+                    self.check_deferred()
+                self.report.created += 1
+            except IntegrityError as e:
+                self.reject(line, row, str(e).strip())
+
+    def check_deferred(self):
+        """FK в PostgreSQL отложены до COMMIT — проверяем их сейчас, пока виновный пакет внутри savepoint"""
+        if connection.vendor == 'postgresql':
+            connection.check_constraints()
+
+    def copy_batch(self, rows):
+        """PostgreSQL COPY ... FROM STDIN — самый быстрый путь вставки"""
+        fields = self.insert_fields
+        now = _copy_value(timezone.now())
+        # (attname, значение) — для auto_now полей attname None и значение «сейчас»
+        columns = [(None, now) if _is_auto_time(field) else (field.attname, None) for field in fields]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for values in rows:
+            get = values.get
+            writer.writerow([
+                constant if attname is None else _copy_value(get(attname)) for attname, constant in columns
+            ])
+        buffer.seek(0)
+
+        table = connection.ops.quote_name(self.spec.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+        # Сырой курсор драйвера: ошибки переводим в django.db.IntegrityError и т.п. сами
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):  # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    # --- отказы ---
+    def reject(self, line, row, error):
+        self.report.rejected += 1
+        if len(self.report.errors) < self.max_reported_errors:
+            self.report.errors.append({'line': line, 'error': error})
+        if self.rejects is None:
+            return
+        if self._reject_writer is None:
+            self._reject_columns = list(row.keys())
+            self._reject_writer = csv.DictWriter(
+                self.rejects, fieldnames=['line', 'error'] + self._reject_columns, extrasaction='ignore'
+            )
+            self._reject_writer.writeheader()
+        self._reject_writer.writerow({**row, 'line': line, 'error': error})
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    kind = type(value)
+    if kind is str or kind is int:
+        return value
+    if kind is bool:
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
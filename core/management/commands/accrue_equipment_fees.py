@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.equipment import accrue_late_fees
+
+
+class Command(BaseCommand):
+    help = 'Ночное начисление пеней за невозвращённый инвентарь (повторный запуск за ту же дату безопасен)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Дата запуска ГГГГ-ММ-ДД (по умолчанию — сегодня)')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать просрочки, ничего не менять')
+
+    def handle(self, *args, **options):
+        run_date = None
+        if options['date']:
+            try:
+                run_date = parse_date(options['date'])
+            except ValueError:  # 2024-02-30
+                run_date = None
+            if run_date is None:
+                raise CommandError('--date: ожидается дата ГГГГ-ММ-ДД')
+
+        started = time.monotonic()
+        report = accrue_late_fees(run_date, dry_run=options['dry_run'])
+        for row in report.by_type:
+            self.stdout.write(f"  {row['type']}: просрочено {row['rentals']}, пени {row['late_fees']}")
+        prefix = 'Будет: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{report.run_date}: просроченных аренд {report.updated} ({time.monotonic() - started:.2f} с)'
+        ))
@@ -0,0 +1,1056 @@
+import contextlib
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core import audit
+from core.billing import run_locker_billing, run_subscription_cycle
+from core.equipment import (
+    accrue_late_fees, availability, due_for_maintenance, maintenance_weekly, mark_serviced, overdue_rentals,
+)
+from core.models import (
+    ChangeLogs, Equipment, EquipmentRentals, EventParticipants, Events, LockerRentals, Lockers, Participants, Payments,
+    Subscriptions, SystemUsers, TariffPlans, TrainingSessions,
+)
+from core.registration import EVENT_REGISTRATION, WAITLIST, RegistrationFull, register
+from core.reports import rebuild_revenue_daily, revenue_report
+
+
+def bench_audit(command, iterations):
+    """Задержка save() участника: без аудита, с синхронной и с фоновой записью журнала"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Аудит', email='benchmark-audit@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    modes = [
+        ('без аудита', {'ENABLED': False}),
+        ('синхронно', {'ENABLED': True, 'ASYNC': False}),
+        ('фоновый поток', {'ENABLED': True, 'ASYNC': True}),
+    ]
+    results = {}
+    try:
+        for label, options in modes:
+            with override_settings(CRM_AUDIT={**audit.AUDIT_DEFAULTS, **options}):
+                started = time.perf_counter()
+                for i in range(iterations):
+                    participant.phone = f'+7{i:010d}'
+                    participant.save()
+                results[label] = time.perf_counter() - started
+                audit.writer.flush()
+    finally:
+        ChangeLogs.objects.filter(table_name=Participants._meta.db_table, record_id=participant.pk).delete()
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+
+    baseline = results['без аудита']
+    for label, elapsed in results.items():
+        overhead = (elapsed / baseline - 1) * 100 if baseline else 0
+        command.stdout.write(
+            f'  {label:<15} {elapsed / iterations * 1000:.3f} мс/save  ({overhead:+.1f}% к базовому)'
+        )
+
+
+def _timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_revenue(command, iterations):
+    """Помесячный отчёт о выручке: из свёртки revenue_daily против Sum() по payments"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Выручка', email='benchmark-revenue@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    rng = random.Random(0)
+    start = date.today() - timedelta(days=5 * 365)
+    try:
+        Payments.objects.bulk_create([
+            Payments(
+                participant=participant, amount=Decimal(rng.randrange(100, 10000)),
+                payment_date=start + timedelta(days=rng.randrange(5 * 365)),
+                payment_method=rng.choice(['card', 'cash', 'transfer']),
+                purpose=rng.choice(['subscription', 'locker', 'event', 'equipment']), status='paid',
+            )
+            for _ in range(iterations)
+        ], batch_size=5000)
+        rebuild = _timed(rebuild_revenue_daily, repeat=1)
+
+        def scan():
+            list(
+                Payments.objects.annotate(period=TruncMonth('payment_date'))
+                .values('period', 'payment_method', 'purpose', 'status')
+                .annotate(total=Sum('amount')).order_by('period')
+            )
+
+        scan_time = _timed(scan)
+        rollup_time = _timed(lambda: revenue_report('month'))
+    finally:
+        # Без сигналов: построчное удаление 10^5 платежей заняло бы больше, чем сам замер
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Payments._meta.db_table} WHERE participant_id = %s', [participant.pk])
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+        rebuild_revenue_daily()
+
+    command.stdout.write(f'  пересчёт свёртки         {rebuild * 1000:.1f} мс')
+    command.stdout.write(f'  Sum() по payments        {scan_time * 1000:.1f} мс')
+    command.stdout.write(f'  отчёт из revenue_daily   {rollup_time * 1000:.1f} мс')
+
+
+REGISTRATION_THREADS = 200  # каждому потоку — своё соединение: max_connections должен быть больше
+
+
+def _max_connections():
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW max_connections')
+        return int(cursor.fetchone()[0])
+
+
+def bench_registration(command, iterations, threads=REGISTRATION_THREADS):
+    """
+    iterations участников записываются на мероприятие с iterations/4 местами
+    (остальные — в лист ожидания) из threads потоков одновременно. Считаются
+    перебронирование (записанных больше мест), потерянные обновления счётчика
+    (registered_count не совпадает с числом записей) и потерянные записи
+    (успешных ответов больше, чем строк в таблице).
+    """
+    capacity = max(1, iterations // 4)
+    workers = min(iterations, threads)
+    max_connections = _max_connections()
+    if max_connections is not None and workers >= max_connections:
+        raise CommandError(
+            f'--threads {workers}: у PostgreSQL max_connections = {max_connections}, '
+            f'а каждому потоку нужно своё соединение — увеличьте max_connections или уменьшите --threads'
+        )
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        people = Participants.objects.bulk_create([
+            Participants(
+                last_name='Бенчмарк', first_name=f'Запись {i}', email=f'benchmark-registration-{i}@example.invalid',
+                birth_date=date(1990, 1, 1), join_date=date.today(),
+            )
+            for i in range(iterations)
+        ])
+        event = Events.objects.create(
+            name='Бенчмарк записи', datetime=timezone.now(), location='-', max_participants=capacity,
+        )
+        pending = [person.pk for person in people]
+        lock = threading.Lock()
+        start_gate = threading.Barrier(workers + 1)
+        outcomes = Counter()
+
+        def worker():
+            start_gate.wait()
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        participant_id = pending.pop()
+                    try:
+                        booking, _ = register(EVENT_REGISTRATION, event.pk, participant_id, waitlist=True)
+                        outcome = booking.status
+                    except RegistrationFull:
+                        outcome = 'full'
+                    except Exception as e:
+                        outcome = f'ошибка {type(e).__name__}'
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        start_gate.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            event.refresh_from_db()
+            bookings = EventParticipants.objects.filter(event=event)
+            rows = bookings.count()
+            registered = bookings.exclude(status=WAITLIST).count()
+        finally:
+            event.delete()
+            Participants.objects.filter(pk__in=[person.pk for person in people]).delete()
+
+    accepted = sum(
+        count for outcome, count in outcomes.items() if outcome != 'full' and not outcome.startswith('ошибка')
+    )
+    command.stdout.write(f'  потоков {workers}, мест {capacity}, попыток {iterations}')
+    command.stdout.write(f'  исходы: {dict(outcomes)}')
+    command.stdout.write(f'  записано {registered}, в листе ожидания {rows - registered}, счётчик {event.registered_count}')
+    command.stdout.write(
+        f'  перебронирование: {max(0, registered - capacity)}, '
+        f'потерянные обновления счётчика: {abs(event.registered_count - registered)}, '
+        f'потерянные записи: {max(0, accepted - rows)}'
+    )
+    command.stdout.write(f'  {elapsed:.2f} с, {iterations / elapsed:.0f} записей/с')
+
+
+def bench_subscriptions(command, iterations):
+    """Ночной цикл на iterations истёкших абонементов, половина — с автопродлением"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Абонементы', email='benchmark-subscriptions@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    plan = TariffPlans.objects.create(name='Бенчмарк', price=Decimal('3000.00'), duration_days=30)
+    run_date = date.today()
+    try:
+        Subscriptions.objects.bulk_create([
+            Subscriptions(
+                participant=participant, tariff_plan=plan, status='active', auto_renew=i % 2 == 0,
+                start_date=run_date - timedelta(days=31), end_date=run_date - timedelta(days=1 + i % 3),
+            )
+            for i in range(iterations)
+        ], batch_size=10000)
+        started = time.perf_counter()
+        report = run_subscription_cycle(run_date)
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        repeat = run_subscription_cycle(run_date)
+        repeat_elapsed = time.perf_counter() - started
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Payments._meta.db_table} WHERE participant_id = %s', [participant.pk])
+            cursor.execute(f'DELETE FROM {Subscriptions._meta.db_table} WHERE participant_id = %s', [participant.pk])
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+            plan.delete()
+        rebuild_revenue_daily()
+
+    command.stdout.write(f'  истекло {report.expired}, продлено {report.renewed}, счетов {report.payments}')
+    command.stdout.write(f'  {elapsed:.1f} с ({iterations / elapsed:.0f} абонементов/с)')
+    command.stdout.write(f'  повторный запуск: продлено {repeat.renewed}, истекло {repeat.expired}, {repeat_elapsed:.2f} с')
+
+
+def bench_lockers(command, iterations):
+    """Счета за месяц по iterations действующим арендам шкафов, четверть — без автопродления"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Шкафы', email='benchmark-lockers@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    period_start = date.today().replace(day=1)
+    start_date = (period_start - timedelta(days=1)).replace(day=1)
+    periods = ('monthly', 'monthly', 'monthly', 'quarter')
+    try:
+        lockers = Lockers.objects.bulk_create(
+            [Lockers(number=f'bench-{i}') for i in range(iterations)], batch_size=10000,
+        )
+        LockerRentals.objects.bulk_create([
+            LockerRentals(
+                locker=locker, participant=participant, start_date=start_date, status='active',
+                rental_cost=Decimal('500.00'), payment_period=periods[i % 4], auto_renew=i % 4 != 1,
+            )
+            for i, locker in enumerate(lockers)
+        ], batch_size=10000)
+        dry_elapsed = _timed(lambda: run_locker_billing(period_start, dry_run=True), repeat=1)
+        started = time.perf_counter()
+        report = run_locker_billing(period_start)
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        repeat = run_locker_billing(period_start)
+        repeat_elapsed = time.perf_counter() - started
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {LockerRentals._meta.db_table} WHERE participant_id = %s', [participant.pk])
+            cursor.execute(f'DELETE FROM {Payments._meta.db_table} WHERE participant_id = %s', [participant.pk])
+            cursor.execute(f"DELETE FROM {Lockers._meta.db_table} WHERE number LIKE 'bench-%%'")
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+        rebuild_revenue_daily()
+
+    command.stdout.write(f'  счетов {report.billed} на {report.amount} руб., закрыто {report.closed}')
+    command.stdout.write(f'  dry-run {dry_elapsed:.2f} с; запуск {elapsed:.2f} с ({iterations / elapsed:.0f} аренд/с)')
+    command.stdout.write(f'  повторный запуск: счетов {repeat.billed}, уже выставлено {repeat.already_billed}, {repeat_elapsed:.2f} с')
+
+
+def bench_equipment(command, iterations):
+    """Поиск свободного инвентаря по iterations арендам (≈25 на единицу, 4 типа)"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Инвентарь', email='benchmark-equipment@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    rng = random.Random(1)
+    today = date.today()
+    types = ('bench-skis', 'bench-boots', 'bench-poles', 'bench-board')
+    try:
+        items = Equipment.objects.bulk_create([
+            Equipment(name=f'Бенчмарк {i}', type=types[i % 4], size=str(150 + i % 5 * 10))
+            for i in range(max(iterations // 25, 1))
+        ], batch_size=10000)
+        rentals = []
+        per_item = iterations // len(items)
+        for item in items:
+            day = today - timedelta(days=per_item * 27)
+            for _ in range(per_item):
+                end = day + timedelta(days=rng.randint(1, 14))
+                rentals.append(EquipmentRentals(
+                    participant=participant, equipment=item, rental_date=day, return_date=end,
+                    actual_return_date=end if end < today else None,
+                ))
+                day = end + timedelta(days=rng.randint(1, 45))
+        EquipmentRentals.objects.bulk_create(rentals, batch_size=10000)
+
+        date_from, date_to = today + timedelta(days=3), today + timedelta(days=10)
+        available, booked = availability(types[0], date_from, date_to, size='170')
+        by_size = _timed(lambda: availability(types[0], date_from, date_to, size='170'), repeat=20)
+        by_type = _timed(lambda: availability(types[0], date_from, date_to), repeat=20)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {EquipmentRentals._meta.db_table} WHERE participant_id = %s', [participant.pk])
+            cursor.execute(f"DELETE FROM {Equipment._meta.db_table} WHERE type LIKE 'bench-%%'")
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+
+    command.stdout.write(f'  единиц {len(items)}, аренд {len(rentals)}; type+size: свободно {len(available)}, занято {len(booked)}')
+    command.stdout.write(f'  type+size {by_size * 1000:.1f} мс, только type {by_type * 1000:.1f} мс')
+
+
+def bench_overdue(command, iterations):
+    """Пени по просрочкам на истории из iterations аренд за 10 лет; не вернули последнюю аренду каждой 19-й единицы"""
+    participant = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Просрочки', email='benchmark-overdue@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    today = date.today()
+    types = ('bench-skis', 'bench-boots', 'bench-poles', 'bench-board')
+    try:
+        items = Equipment.objects.bulk_create([
+            Equipment(name=f'Бенчмарк {i}', type=types[i % 4]) for i in range(max(iterations // 100, 1))
+        ], batch_size=10000)
+        per_item = iterations // len(items)
+        step = max(3650 // per_item, 2)
+        batch, created = [], 0
+        for n, item in enumerate(items):
+            for k in range(per_item):
+                start = today - timedelta(days=3650 - k * step)
+                end = start + timedelta(days=step // 2)
+                open_rental = k == per_item - 1 and n % 19 == 0
+                batch.append(EquipmentRentals(
+                    participant=participant, equipment=item, rental_date=start, return_date=end,
+                    actual_return_date=None if open_rental else end, cost=Decimal('300.00'), status='active',
+                ))
+            if len(batch) >= 10000:
+                created += len(EquipmentRentals.objects.bulk_create(batch))
+                batch = []
+        created += len(EquipmentRentals.objects.bulk_create(batch))
+
+        lookup = _timed(lambda: list(overdue_rentals().order_by('return_date', 'id')[:50]))
+        started = time.perf_counter()
+        report = accrue_late_fees()
+        elapsed = time.perf_counter() - started
+        repeat_elapsed = _timed(accrue_late_fees, repeat=1)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {EquipmentRentals._meta.db_table} WHERE participant_id = %s', [participant.pk])
+            cursor.execute(f"DELETE FROM {Equipment._meta.db_table} WHERE type LIKE 'bench-%%'")
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            participant.delete()
+
+    command.stdout.write(f'  аренд {created}, просрочено {report.updated}')
+    for row in report.by_type:
+        command.stdout.write(f"    {row['type']}: {row['rentals']}, пени {row['late_fees']}")
+    command.stdout.write(f'  страница /overdue/ {lookup * 1000:.1f} мс')
+    command.stdout.write(f'  начисление {elapsed:.2f} с, повторно {repeat_elapsed:.2f} с')
+
+
+def bench_maintenance(command, iterations):
+    """Планировщик обслуживания на iterations единицах инвентаря со сроками в пределах года"""
+    rng = random.Random(1)
+    today = date.today()
+    types = ('bench-skis', 'bench-boots', 'bench-poles', 'bench-board')
+    conditions = ('good', 'good', 'worn', 'broken')
+    try:
+        Equipment.objects.bulk_create([
+            Equipment(
+                name=f'Бенчмарк {i}', type=types[i % 4], condition=conditions[rng.randrange(4)],
+                next_maintenance_date=today + timedelta(days=rng.randint(-60, 300)),
+            )
+            for i in range(iterations)
+        ], batch_size=10000)
+        until = today + timedelta(days=7)
+        due = due_for_maintenance(until, equipment_type=types[0]).order_by('next_maintenance_date', 'id')
+        due_count = due.count()
+        page = _timed(lambda: list(due[:50]))
+        filtered = _timed(lambda: list(due_for_maintenance(until, conditions=['worn', 'broken']).order_by(
+            'next_maintenance_date', 'id')[:50]))
+        weekly = _timed(lambda: maintenance_weekly(8))
+        ids = list(due.values_list('id', flat=True)[:1000])
+        serviced = _timed(lambda: mark_serviced(ids), repeat=1)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {Equipment._meta.db_table} WHERE type LIKE 'bench-%%'")
+
+    command.stdout.write(f'  единиц {iterations}, к обслуживанию ({types[0]}, неделя) {due_count}')
+    command.stdout.write(f'  страница списка {page * 1000:.1f} мс, с фильтром состояния {filtered * 1000:.1f} мс')
+    command.stdout.write(f'  по неделям {weekly * 1000:.1f} мс, отметить {len(ids)} единиц {serviced * 1000:.0f} мс')
+
+
+def bench_profile(command, iterations):
+    """iterations запросов /api/profile/ с JWT: без кэша, из кэша и условных (304)"""
+    from django.core.cache import cache
+    from django.test import Client
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    member = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Профиль', email='benchmark-profile@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    user = SystemUsers.objects.create(
+        username='benchmark-profile', email='benchmark-profile@example.invalid', password_hash='-', member=member,
+    )
+    client = Client()
+    auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    def run(clear=False, **headers):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            if clear:
+                cache.clear()
+            response = client.get('/api/profile/', **auth, **headers)
+        return iterations / (time.perf_counter() - started), response
+
+    try:
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            cold, response = run(clear=True)
+            warm, response = run()
+            etag = response.get('ETag')
+            conditional, not_modified = run(HTTP_IF_NONE_MATCH=etag) if etag else (None, None)
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            user.delete()
+            member.delete()
+
+    command.stdout.write(f'  без кэша {cold:.0f} запросов/с, из кэша {warm:.0f} запросов/с')
+    if conditional:
+        command.stdout.write(f'  If-None-Match: {conditional:.0f} запросов/с (статус {not_modified.status_code})')
+
+
+def bench_reference(command, iterations):
+    """iterations проверок SubscriptionSerializer: id тарифа через кэш справочников и запросом к БД"""
+    from rest_framework import serializers
+
+    from core import reference
+    from core.serializers import SubscriptionSerializer
+
+    class UncachedSubscriptionSerializer(SubscriptionSerializer):
+        tariff_plan = serializers.PrimaryKeyRelatedField(queryset=TariffPlans.objects.all())
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        plans = [
+            TariffPlans.objects.create(name=f'Бенчмарк {i}', price=Decimal('1000.00'), duration_days=30)
+            for i in range(20)
+        ]
+        member = Participants.objects.create(
+            last_name='Бенчмарк', first_name='Справочники', birth_date=date(1990, 1, 1), join_date=date.today(),
+        )
+
+    def run(serializer_class):
+        started = time.perf_counter()
+        queries_before = len(connection.queries)
+        for i in range(iterations):
+            serializer = serializer_class(data={
+                'participant': member.pk, 'tariff_plan': plans[i % len(plans)].pk,
+                'start_date': '2024-01-01', 'end_date': '2024-01-31',
+            })
+            serializer.is_valid(raise_exception=True)
+        return iterations / (time.perf_counter() - started), len(connection.queries) - queries_before
+
+    reference.reset_stats()
+    try:
+        with override_settings(DEBUG=True):
+            connection.queries_log.clear()
+            uncached, uncached_queries = run(UncachedSubscriptionSerializer)
+            connection.queries_log.clear()
+            cached, cached_queries = run(SubscriptionSerializer)
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            member.delete()
+            TariffPlans.objects.filter(pk__in=[plan.pk for plan in plans]).delete()
+
+    stats = reference.reference_stats()
+    command.stdout.write(f'  запросом к БД: {uncached:.0f} проверок/с, запросов {uncached_queries}')
+    command.stdout.write(f'  через кэш: {cached:.0f} проверок/с, запросов {cached_queries}')
+    command.stdout.write(f"  hit ratio {stats['hit_ratio']}, сэкономлено запросов {stats['queries_saved']}")
+
+
+def bench_polling(command, iterations):
+    """Опрос /api/participants/ и /api/events/ как у SPA: iterations запросов без ETag и с If-None-Match"""
+    from django.test import Client
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        members = Participants.objects.bulk_create([
+            Participants(
+                last_name=f'Опрос{i}', first_name='Бенчмарк', email=f'benchmark-poll-{i}@example.invalid',
+                birth_date=date(1990, 1, 1), join_date=date.today(),
+            )
+            for i in range(200)
+        ])
+    client = Client()
+    urls = ['/api/participants/', '/api/events/']
+
+    def run(conditional):
+        etags = {url: client.get(url)['ETag'] for url in urls} if conditional else {}
+        sent, statuses = 0, Counter()
+        cpu, started = time.process_time(), time.perf_counter()
+        for i in range(iterations):
+            url = urls[i % len(urls)]
+            headers = {'HTTP_IF_NONE_MATCH': etags[url]} if conditional else {}
+            response = client.get(url, **headers)
+            sent += len(response.content)
+            statuses[response.status_code] += 1
+        return sent, time.process_time() - cpu, time.perf_counter() - started, statuses
+
+    try:
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            results = [('без ETag', run(False)), ('If-None-Match', run(True))]
+    finally:
+        Participants.objects.filter(pk__in=[member.pk for member in members]).delete()
+
+    for name, (sent, cpu, elapsed, statuses) in results:
+        command.stdout.write(
+            f'  {name}: {sent / iterations / 1024:.1f} КБ/запрос, CPU {cpu / iterations * 1000:.2f} мс/запрос, '
+            f'{iterations / elapsed:.0f} запросов/с, ответы {dict(statuses)}'
+        )
+
+
+def bench_fieldsets(command, iterations):
+    """
+    Страница платежей (100 строк с длинными notes), iterations раз: полная, ?fields=,
+    ?expand=participant и полная + отдельные запросы участников, как делал клиент.
+    """
+    from django.test import Client
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        members = Participants.objects.bulk_create([
+            Participants(
+                last_name=f'Поля{i}', first_name='Бенчмарк', email=f'benchmark-fields-{i}@example.invalid',
+                birth_date=date(1990, 1, 1), join_date=date.today(), address='Адрес ' * 20,
+            )
+            for i in range(100)
+        ])
+        payments = Payments.objects.bulk_create([
+            Payments(
+                participant=member, amount=Decimal('1000.00'), payment_date=date.today(),
+                payment_method='card', purpose='subscription', notes='Примечание ' * 50,
+            )
+            for member in members
+        ])
+    client = Client()
+    page = '/api/payments/?page_size=100'
+
+    def run(url, follow=False):
+        sent, requests = 0, 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            response = client.get(url)
+            sent, requests = sent + len(response.content), requests + 1
+            if follow:
+                for participant_id in {row['participant'] for row in response.json()['results']}:
+                    sent += len(client.get(f'/api/participants/{participant_id}/').content)
+                    requests += 1
+        elapsed = time.perf_counter() - started
+        return sent / iterations / 1024, elapsed / iterations * 1000, requests // iterations
+
+    try:
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            results = [
+                ('все поля', run(page)),
+                ('?fields=id,amount,payment_date,participant', run(f'{page}&fields=id,amount,payment_date,participant')),
+                ('все поля + запросы участников', run(page, follow=True)),
+                ('?expand=participant', run(f'{page}&expand=participant')),
+            ]
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            Payments.objects.filter(pk__in=[payment.pk for payment in payments]).delete()
+            Participants.objects.filter(pk__in=[member.pk for member in members]).delete()
+
+    for name, (size, elapsed, requests) in results:
+        command.stdout.write(f'  {name}: {size:.1f} КБ, {elapsed:.1f} мс, HTTP-запросов {requests}')
+
+
+def bench_fastread(command, iterations):
+    """
+    iterations платежей и отметок посещаемости: сериализатор DRF + json против
+    ReadPlan по values() + orjson (ответ сверяется байт в байт), затем обход
+    всего списка /api/payments/ страницами по 500 строк обоими путями.
+    """
+    from unittest import mock
+
+    from django.test import Client
+    from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+    from rest_framework.views import APIView
+
+    from core.fastread import compile_serializer
+    from core.models import TrainingAttendance
+    from core.renderers import FastJSONRenderer
+    from core.serializers import PaymentSerializer, TrainingAttendanceSerializer
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        members = Participants.objects.bulk_create([
+            Participants(
+                last_name=f'Чтение{i}', first_name='Бенчмарк', email=f'benchmark-fastread-{i}@example.invalid',
+                birth_date=date(1990, 1, 1), join_date=date.today(),
+            )
+            for i in range(100)
+        ])
+        sessions = TrainingSessions.objects.bulk_create([
+            TrainingSessions(trainer=members[0], datetime=timezone.now(), duration_minutes=60, topic=f'Чтение {i}')
+            for i in range(-(-iterations // len(members)))
+        ])
+        payments = Payments.objects.bulk_create([
+            Payments(
+                participant=members[i % len(members)], amount=Decimal(i % 5000) + Decimal('0.50'),
+                payment_date=date.today() - timedelta(days=i % 365), payment_method='card',
+                purpose='subscription', status='completed', notes=f'Платёж №{i}',
+            )
+            for i in range(iterations)
+        ])
+        TrainingAttendance.objects.bulk_create([
+            TrainingAttendance(
+                participant=members[i % len(members)], session=sessions[i // len(members)],
+                attended=bool(i % 3), rating=i % 10 or None, notes=f'Заметка {i}',
+            )
+            for i in range(iterations)
+        ])
+
+    def serialize(serializer_class, queryset):
+        plan = compile_serializer(serializer_class())
+        slow = lambda: JSONRenderer().render(serializer_class(queryset.all(), many=True).data)  # noqa: E731
+        fast = lambda: FastJSONRenderer().render(plan.represent_many(queryset.all()))  # noqa: E731
+        if slow() != fast():
+            raise CommandError(f'{serializer_class.__name__}: ответы различаются')
+        return _timed(slow, repeat=3), _timed(fast, repeat=3), len(fast())
+
+    client = Client()
+
+    def walk(fast):
+        url, rows = '/api/payments/?page_size=500', 0
+        with contextlib.ExitStack() as stack:
+            if not fast:
+                # Исходный путь: сериализатор DRF и стандартный JSONRenderer
+                stack.enter_context(mock.patch('core.fastread.compile_serializer', return_value=None))
+                stack.enter_context(
+                    mock.patch.object(APIView, 'renderer_classes', [JSONRenderer, BrowsableAPIRenderer])
+                )
+            started = time.perf_counter()
+            while url:
+                data = client.get(url).json()
+                rows, url = rows + len(data['results']), data['next']
+        return time.perf_counter() - started, rows
+
+    try:
+        results = [
+            ('платежи', serialize(PaymentSerializer, Payments.objects.filter(participant__in=members).order_by('id'))),
+            ('посещаемость', serialize(
+                TrainingAttendanceSerializer, TrainingAttendance.objects.filter(session__in=sessions).order_by('id'),
+            )),
+        ]
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            walks = [('сериализатор DRF', walk(False)), ('ReadPlan + orjson', walk(True))]
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            Payments.objects.filter(pk__in=[payment.pk for payment in payments]).delete()
+            TrainingSessions.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+            Participants.objects.filter(pk__in=[member.pk for member in members]).delete()
+
+    for name, (slow, fast, size) in results:
+        command.stdout.write(
+            f'  {name}, {iterations} строк ({size / 1024:.0f} КБ): сериализатор DRF {slow * 1000:.0f} мс, '
+            f'ReadPlan + orjson {fast * 1000:.0f} мс (x{slow / fast:.1f})'
+        )
+    for name, (elapsed, rows) in walks:
+        command.stdout.write(f'  обход /api/payments/ ({rows} строк), {name}: {elapsed * 1000:.0f} мс')
+
+
+def bench_formats(command, iterations):
+    """
+    Микробенчмарк форматов по ресурсам API: данные сериализатора (до iterations
+    строк: платежи, посещаемость и участники создаются, остальное — что есть в БД)
+    кодируются и разбираются JSONRenderer/JSONParser DRF, orjson и MessagePack.
+    """
+    import io
+
+    from django.http import JsonResponse
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from CRM.urls import router
+    from core.models import TrainingAttendance
+    from core.parsers import FastJSONParser, MessagePackParser
+    from core.renderers import FastJSONRenderer, FastJsonResponse, MessagePackRenderer, msgpack
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        members = Participants.objects.bulk_create([
+            Participants(
+                last_name=f'Формат{i}', first_name='Бенчмарк', email=f'benchmark-formats-{i}@example.invalid',
+                birth_date=date(1990, 1, 1) + timedelta(days=i), join_date=date.today(), phone=f'+7900{i:07d}',
+            )
+            for i in range(iterations)
+        ])
+        session = TrainingSessions.objects.create(
+            trainer=members[0], datetime=timezone.now(), duration_minutes=60, topic='Форматы',
+        )
+        Payments.objects.bulk_create([
+            Payments(
+                participant=member, amount=Decimal(i % 5000) + Decimal('0.50'), payment_date=date.today(),
+                payment_method='card', purpose='subscription', status='completed', notes=f'Платёж №{i}',
+            )
+            for i, member in enumerate(members)
+        ])
+        TrainingAttendance.objects.bulk_create([
+            TrainingAttendance(participant=member, session=session, attended=bool(i % 3), rating=i % 10)
+            for i, member in enumerate(members)
+        ])
+
+    renderers = [('json', JSONRenderer(), JSONParser()), ('orjson', FastJSONRenderer(), FastJSONParser())]
+    if msgpack is not None:
+        renderers.append(('msgpack', MessagePackRenderer(), MessagePackParser()))
+    results = []
+    try:
+        for prefix, viewset, _ in router.registry:
+            queryset = viewset.queryset.model.objects.order_by('pk')[:iterations]
+            data = viewset.serializer_class(queryset, many=True).data
+            if not data:
+                continue
+            timings = []
+            for name, renderer, parser in renderers:
+                body = renderer.render(data)
+                parse = lambda: parser.parse(io.BytesIO(body), parser_context={})  # noqa: E731
+                timings.append((name, len(body), _timed(lambda: renderer.render(data)), _timed(parse)))
+            results.append((prefix, len(data), timings))
+        # Представления на JsonResponse (поиск участников для аренды)
+        found = {'success': True, 'participants': list(
+            Participants.objects.filter(pk__in=[member.pk for member in members])
+            .values('id', 'last_name', 'first_name', 'phone', 'email', 'birth_date')
+        )}
+        responses = [
+            (name, len(response_class(found).content), _timed(lambda: response_class(found)))
+            for name, response_class in (('JsonResponse', JsonResponse), ('FastJsonResponse', FastJsonResponse))
+        ]
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            session.delete()
+            Participants.objects.filter(pk__in=[member.pk for member in members]).delete()
+
+    for prefix, rows, timings in results:
+        command.stdout.write(f'  {prefix} ({rows} строк):')
+        for name, size, render, parse in timings:
+            command.stdout.write(
+                f'    {name:8} {size / 1024:8.1f} КБ, кодирование {render * 1000:7.2f} мс, разбор {parse * 1000:7.2f} мс'
+            )
+    command.stdout.write(f"  поиск участников, {len(found['participants'])} строк:")
+    for name, size, elapsed in responses:
+        command.stdout.write(f'    {name:16} {size / 1024:8.1f} КБ, {elapsed * 1000:7.2f} мс')
+
+
+COMPRESSION_LEVELS = {'zstd': (1, 3, 9), 'br': (1, 4, 9), 'gzip': (1, 6, 9)}
+
+
+def bench_compression(command, iterations):
+    """
+    CPU на сжатие против сэкономленных байт: страница /api/payments/ в JSON и
+    MessagePack (500 строк) и потоковые выгрузки CSV/NDJSON из iterations платежей —
+    выгрузки сжимаются по частям, как в CompressionMiddleware.
+    """
+    from django.test import Client
+
+    from core.compression import CODECS
+
+    with override_settings(CRM_AUDIT={'ENABLED': False}):
+        members = Participants.objects.bulk_create([
+            Participants(
+                last_name=f'Сжатие{i}', first_name='Бенчмарк', email=f'benchmark-compression-{i}@example.invalid',
+                birth_date=date(1990, 1, 1), join_date=date.today(),
+            )
+            for i in range(100)
+        ])
+        Payments.objects.bulk_create([
+            Payments(
+                participant=members[i % len(members)], amount=Decimal(i % 5000) + Decimal('0.50'),
+                payment_date=date.today() - timedelta(days=i % 365), payment_method=('card', 'cash')[i % 2],
+                purpose='subscription', status='completed', notes=f'Оплата абонемента №{i}',
+            )
+            for i in range(iterations)
+        ])
+
+    client = Client()
+    try:
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            payloads = [
+                ('JSON, страница 500 строк', [client.get('/api/payments/?page_size=500').content]),
+                ('MessagePack, страница 500 строк', [client.get('/api/payments/?page_size=500&format=msgpack').content]),
+                ('выгрузка CSV', list(client.get('/api/payments/export/?format=csv').streaming_content)),
+                ('выгрузка NDJSON', list(client.get('/api/payments/export/?format=ndjson').streaming_content)),
+            ]
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            Participants.objects.filter(pk__in=[member.pk for member in members]).delete()
+
+    for name, chunks in payloads:
+        size = sum(map(len, chunks))
+        command.stdout.write(f'  {name}: {size / 1024:.0f} КБ, частей {len(chunks)}')
+        for encoding, levels in COMPRESSION_LEVELS.items():
+            if CODECS[encoding] is None:
+                command.stdout.write(f'    {encoding}: не установлен')
+                continue
+            compress, stream_class = CODECS[encoding]
+            for level in levels:
+                if len(chunks) == 1:
+                    compressed = compress(chunks[0], level)
+                    run = lambda: compress(chunks[0], level)  # noqa: E731
+                else:
+                    def run():
+                        stream = stream_class(level)
+                        return b''.join([*map(stream.compress, chunks), stream.finish()])
+                    compressed = run()
+                started = time.process_time()
+                for _ in range(3):
+                    run()
+                cpu = (time.process_time() - started) / 3
+                command.stdout.write(
+                    f'    {encoding:4} {level:2}: {len(compressed) / 1024:7.0f} КБ '
+                    f'(-{100 - len(compressed) * 100 / size:.0f}%), CPU {cpu * 1000:6.1f} мс, '
+                    f'{size / cpu / 1024 / 1024 if cpu else float("inf"):6.0f} МБ/с'
+                )
+
+
+def bench_connections(command, iterations):
+    """iterations запросов /api/tariff-plans/: новое соединение на запрос против CONN_MAX_AGE с проверкой"""
+    from django.db import connection
+    from django.test import Client
+
+    client = Client()
+    saved = {key: connection.settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+
+    def run(max_age, health_checks):
+        connection.close()
+        connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            client.get('/api/tariff-plans/')
+        return iterations / (time.perf_counter() - started)
+
+    try:
+        with override_settings(CRM_AUDIT={'ENABLED': False}, ALLOWED_HOSTS=['testserver']):
+            results = [
+                ('новое соединение (CONN_MAX_AGE=0)', run(0, False)),
+                ('постоянное (CONN_MAX_AGE=60)', run(60, False)),
+                ('постоянное с проверкой (CONN_HEALTH_CHECKS)', run(60, True)),
+            ]
+    finally:
+        connection.close()
+        connection.settings_dict.update(saved)
+
+    for name, rps in results:
+        command.stdout.write(f'  {name}: {rps:.0f} запросов/с')
+
+
+ASGI_CONCURRENCY = 500
+WSGI_THREADS = 32  # потоков у типичного WSGI-сервера; остальные соединения ждут в очереди
+
+
+def _latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return f'{len(latencies) / elapsed:.0f} запросов/с, p50 {p50 * 1000:.0f} мс, p99 {p99 * 1000:.0f} мс'
+
+
+def _run_wsgi(paths, headers, total):
+    """Замкнутая нагрузка: ASGI_CONCURRENCY клиентов, запросы в порядке очереди обслуживают WSGI_THREADS потоков"""
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    latencies, errors, counter = [], Counter(), iter(range(total))
+    lock = threading.Lock()
+
+    def handle(path):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(b''), 'wsgi.url_scheme': 'http',
+            **{f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()},
+        }
+        statuses = []
+        response = application(environ, lambda status, _headers: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return statuses[0][:3]
+
+    def client(server):
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            started = time.perf_counter()
+            status = server.submit(handle, paths[n % len(paths)]).result()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                errors[status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(WSGI_THREADS) as server:
+        clients = [threading.Thread(target=client, args=(server,)) for _ in range(ASGI_CONCURRENCY)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    return latencies, time.perf_counter() - started, errors
+
+
+def _run_asgi(paths, headers, total):
+    """Та же нагрузка на CRM.asgi: ASGI_CONCURRENCY корутин-клиентов в одном цикле событий"""
+    import asyncio
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    latencies, errors, counter = [], Counter(), iter(range(total))
+    raw_headers = [(b'host', b'localhost')] + [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+    async def request(path):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': raw_headers, 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        body_sent = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if not body_sent.is_set():
+                body_sent.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()  # клиент не отключается, пока не получил ответ
+            return {'type': 'http.disconnect'}
+
+        statuses = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await application(scope, receive, send)
+        disconnected.set()
+        return statuses[0]
+
+    async def client():
+        while (n := next(counter, None)) is not None:
+            started = time.perf_counter()
+            try:
+                status = await request(paths[n % len(paths)])
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            errors[str(status)] += 1
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(ASGI_CONCURRENCY)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - started, errors
+
+
+def bench_asgi(command, iterations):
+    """
+    Синхронные представления под WSGI против async-вариантов под ASGI:
+    iterations запросов (профиль и календарь поровну), ASGI_CONCURRENCY соединений.
+    Приложения вызываются в процессе, без HTTP-сервера и сети.
+    """
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    member = Participants.objects.create(
+        last_name='Бенчмарк', first_name='Нагрузка', email='benchmark-asgi@example.invalid',
+        birth_date=date(1990, 1, 1), join_date=date.today(),
+    )
+    user = SystemUsers.objects.create(
+        username='benchmark-asgi', email='benchmark-asgi@example.invalid', password_hash='-', member=member,
+    )
+    week = timezone.now().replace(hour=18, minute=0, second=0, microsecond=0)
+    sessions = TrainingSessions.objects.bulk_create([
+        TrainingSessions(trainer=member, datetime=week + timedelta(days=day), duration_minutes=60, topic='Бенчмарк')
+        for day in range(7)
+    ])
+    headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+    calendar = f'?start={week.date()}&end={(week + timedelta(days=6)).date()}&trainer={member.pk}'
+    from django.db import connections
+    try:
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], CRM_AUDIT={'ENABLED': False}):
+            wsgi = _run_wsgi(['/api/profile/', f'/api/calendar/{calendar}'], headers, iterations)
+            connections.close_all()
+            asgi = _run_asgi(['/api/async/profile/', f'/api/async/calendar/{calendar}'], headers, iterations)
+            connections.close_all()
+    finally:
+        with override_settings(CRM_AUDIT={'ENABLED': False}):
+            TrainingSessions.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+            user.delete()
+            member.delete()
+
+    for name, (latencies, elapsed, statuses) in (('WSGI, sync', wsgi), ('ASGI, async', asgi)):
+        command.stdout.write(f'  {name}: {_latency_summary(latencies, elapsed)}; ответы {dict(statuses)}')
+
+
+SCENARIOS = {
+    'asgi': bench_asgi,
+    'audit': bench_audit,
+    'compression': bench_compression,
+    'connections': bench_connections,
+    'equipment': bench_equipment,
+    'fastread': bench_fastread,
+    'fieldsets': bench_fieldsets,
+    'formats': bench_formats,
+    'lockers': bench_lockers,
+    'maintenance': bench_maintenance,
+    'overdue': bench_overdue,
+    'polling': bench_polling,
+    'profile': bench_profile,
+    'reference': bench_reference,
+    'registration': bench_registration,
+    'revenue': bench_revenue,
+    'subscriptions': bench_subscriptions,
+}
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности отдельных подсистем CRM на текущей БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--iterations', type=int, default=1000, help='Число операций или строк данных сценария')
+        parser.add_argument(
+            '--threads', type=int, default=REGISTRATION_THREADS, help='Одновременных потоков (сценарий registration)',
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должно быть больше 0')
+        if options['threads'] < 1:
+            raise CommandError('--threads должно быть больше 0')
+        self.stdout.write(f"Сценарий {options['scenario']}, итераций: {options['iterations']}")
+        extra = {'threads': options['threads']} if options['scenario'] == 'registration' else {}
+        SCENARIOS[options['scenario']](self, options['iterations'], **extra)
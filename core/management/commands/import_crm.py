@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import IMPORT_SPECS, DEFAULT_BATCH_SIZE, Importer, open_rows, detect_format
+
+
+class Command(BaseCommand):
+    help = 'Пакетный импорт участников, абонементов и платежей из CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(IMPORT_SPECS))
+        parser.add_argument('path', help='Путь к CSV или XLSX файлу')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help='Формат файла (по умолчанию — по расширению)')
+        parser.add_argument('--delimiter', default=',', help='Разделитель CSV')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--rejects', help='Куда записать отклонённые строки (CSV)')
+        parser.add_argument('--no-copy', action='store_true', help='Не использовать COPY, только bulk_create')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывать')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or detect_format(options['path'])
+        rejects = open(options['rejects'], 'w', encoding='utf-8', newline='') if options['rejects'] else None
+        started = time.monotonic()
+        try:
+            with open(options['path'], 'rb') as stream:
+                importer = Importer(
+                    options['resource'],
+                    batch_size=options['batch_size'],
+                    rejects=rejects,
+                    use_copy=not options['no_copy'],
+                    dry_run=options['dry_run'],
+                )
+                report = importer.run(open_rows(stream, file_format, delimiter=options['delimiter']))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        finally:
+            if rejects:
+                rejects.close()
+
+        elapsed = time.monotonic() - started
+        rate = report.total / elapsed if elapsed else report.total
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк: {report.total}, загружено: {report.created}, отклонено: {report.rejected} '
+            f'({elapsed:.2f} с, {rate:.0f} строк/с)'
+        ))
+        if report.rejected and not options['rejects']:
+            for error in report.errors[:10]:
+                self.stdout.write(f"  строка {error['line']}: {error['error']}")
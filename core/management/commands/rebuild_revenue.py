@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.reports import rebuild_revenue_daily
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает свёртку выручки revenue_daily по таблице payments'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = rebuild_revenue_daily()
+        self.stdout.write(self.style.SUCCESS(
+            f'Свёртка revenue_daily пересчитана: {rows} строк ({time.monotonic() - started:.2f} с)'
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.registration import EVENT_REGISTRATION, SESSION_REGISTRATION, recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики занятых мест мероприятий и тренировок по таблицам записей'
+
+    def handle(self, *args, **options):
+        events = recount(EVENT_REGISTRATION)
+        sessions = recount(SESSION_REGISTRATION)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано: мероприятий {events}, тренировок {sessions}'))
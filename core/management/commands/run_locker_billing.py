@@ -0,0 +1,35 @@
+import re
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.billing import run_locker_billing
+
+
+class Command(BaseCommand):
+    help = 'Счета за аренду шкафов за месяц (повторный запуск за тот же месяц безопасен)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', help='Месяц ГГГГ-ММ (по умолчанию — текущий)')
+        parser.add_argument('--dry-run', action='store_true', help='Показать, что будет сделано, ничего не меняя')
+
+    def handle(self, *args, **options):
+        period_start = None
+        if options['period']:
+            match = re.fullmatch(r'(\d{4})-(\d{2})', options['period'])
+            if not match or not 1 <= int(match.group(2)) <= 12:
+                raise CommandError('--period: ожидается месяц ГГГГ-ММ')
+            period_start = date(int(match.group(1)), int(match.group(2)), 1)
+
+        started = time.monotonic()
+        report = run_locker_billing(period_start, dry_run=options['dry_run'])
+        if options['dry_run']:
+            for line in report.lines:
+                self.stdout.write(line)
+        prefix = 'Будет: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{report.period}: счетов {report.billed} на {report.amount} руб., '
+            f'закрыто аренд {report.closed}, уже выставлено {report.already_billed} '
+            f'({time.monotonic() - started:.2f} с)'
+        ))
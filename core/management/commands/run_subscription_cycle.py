@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.billing import DEFAULT_CHUNK_SIZE, run_subscription_cycle
+
+
+class Command(BaseCommand):
+    help = 'Ночной цикл абонементов: истечение и автопродление (повторный запуск за ту же дату безопасен)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Дата запуска ГГГГ-ММ-ДД (по умолчанию — сегодня)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        run_date = None
+        if options['date']:
+            try:
+                run_date = parse_date(options['date'])
+            except ValueError:  # 2024-02-30
+                run_date = None
+            if run_date is None:
+                raise CommandError('--date: ожидается дата ГГГГ-ММ-ДД')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должно быть больше 0')
+
+        started = time.monotonic()
+        report = run_subscription_cycle(run_date, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        prefix = 'Будет: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{report.run_date}: истекло {report.expired}, продлено {report.renewed}, '
+            f'счетов {report.payments} ({time.monotonic() - started:.2f} с)'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+
+from core.equipment import setup_rental_constraints
+
+
+class Command(BaseCommand):
+    help = 'Запрещает выдавать один инвентарь на пересекающиеся даты (ограничение EXCLUDE в PostgreSQL)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f'БД {connection.vendor} не поддерживается, пересечения проверяет только API'
+            ))
+            return
+        try:
+            statements = setup_rental_constraints()
+        except DatabaseError as e:
+            raise CommandError(f'Не удалось создать ограничение (в данных есть пересекающиеся аренды?): {e}')
+        if not statements:
+            self.stdout.write('Ограничение уже создано')
+            return
+        self.stdout.write(self.style.SUCCESS('Ограничение на пересечение аренд инвентаря создано'))
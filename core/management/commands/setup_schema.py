@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.schema import setup_schema
+
+
+class Command(BaseCommand):
+    help = 'Добавляет в существующую схему таблицы и колонки новых возможностей CRM (повторный запуск безопасен)'
+
+    def handle(self, *args, **options):
+        created = setup_schema()
+        if not created:
+            self.stdout.write('Схема уже актуальна')
+            return
+        for name in created:
+            self.stdout.write(f'  + {name}')
+        self.stdout.write(self.style.SUCCESS(f'Схема обновлена ({connection.vendor}, {len(created)} изменений)'))
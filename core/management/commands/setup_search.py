@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.search import setup_search_indexes
+
+
+class Command(BaseCommand):
+    help = 'Создаёт индексы поиска участников (pg_trgm для PostgreSQL, FTS5 для SQLite)'
+
+    def handle(self, *args, **options):
+        statements = setup_search_indexes()
+        if not statements:
+            self.stdout.write(self.style.WARNING(f'БД {connection.vendor} не поддерживается, поиск без индексов'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Поисковые индексы готовы ({connection.vendor}, {len(statements)} команд)'))
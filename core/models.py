@@ -37,6 +37,10 @@ class Equipment(models.Model):
 
     class Meta:
         db_table = 'equipment'
+        indexes = [
+            models.Index(fields=['type', 'size'], name='equipment_type_size'),
+            models.Index(fields=['next_maintenance_date'], name='equipment_next_maintenance'),
+        ]
         verbose_name = 'Инвентарь'
         verbose_name_plural = 'Инвентарь'
 
@@ -51,12 +55,21 @@ class EquipmentRentals(models.Model):
     return_date = models.DateField()
     actual_return_date = models.DateField(blank=True, null=True)
     cost = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # Начисленная пеня за просрочку (уже входит в cost)
+    late_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'equipment_rentals'
+        indexes = [
+            # Только невозвращённые аренды — поиск просрочек не читает историю
+            models.Index(
+                fields=['return_date'], name='equipment_rentals_open_return',
+                condition=models.Q(actual_return_date__isnull=True),
+            ),
+        ]
         verbose_name = 'Аренда инвентаря'
         verbose_name_plural = 'Аренда инвентаря'
 
@@ -90,6 +103,7 @@ class Events(models.Model):
     location = models.CharField(max_length=255)
     cost = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     max_participants = models.IntegerField(blank=True, null=True)
+    registered_count = models.IntegerField(default=0)  # записи вне листа ожидания, см. core/registration.py
     status = models.CharField(max_length=20, blank=True, null=True)
     registration_deadline = models.DateField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -121,6 +135,10 @@ class LockerRentals(models.Model):
 
     class Meta:
         db_table = 'locker_rentals'
+        indexes = [
+            models.Index(fields=['locker', 'status'], name='locker_rentals_locker_status'),
+            models.Index(fields=['status', 'start_date'], name='locker_rentals_status_start'),
+        ]
         verbose_name = 'Аренда шкафа'
         verbose_name_plural = 'Аренда шкафов'
 
@@ -179,6 +197,8 @@ class Payments(models.Model):
     purpose = models.CharField(max_length=50)
     status = models.CharField(max_length=20, blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    # Ключ автоматически выставленного счёта (например, аренда + месяц) — защита от повторов
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -206,6 +226,29 @@ class Positions(models.Model):
         return self.name
 
 
+class RevenueDaily(models.Model):
+    """Свёртка платежей по дням; ведётся сигналами Payments (core/reports.py)"""
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20)
+    purpose = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, default='')  # '' — платёж без статуса
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'revenue_daily'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'payment_method', 'purpose', 'status'], name='revenue_daily_key',
+            ),
+        ]
+        verbose_name = 'Выручка за день'
+        verbose_name_plural = 'Выручка по дням'
+
+    def __str__(self):
+        return f"{self.date} {self.payment_method}/{self.purpose}: {self.amount} руб."
+
+
 class Subscriptions(models.Model):
     participant = models.ForeignKey(Participants, on_delete=models.CASCADE)
     tariff_plan = models.ForeignKey('TariffPlans', on_delete=models.CASCADE)
@@ -218,6 +261,9 @@ class Subscriptions(models.Model):
 
     class Meta:
         db_table = 'subscriptions'
+        indexes = [
+            models.Index(fields=['status', 'end_date'], name='subscriptions_status_end'),
+        ]
         verbose_name = 'Абонемент'
         verbose_name_plural = 'Абонементы'
 
@@ -310,6 +356,7 @@ class TrainingAttendance(models.Model):
     attended = models.BooleanField(default=False)
     rating = models.IntegerField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, blank=True, null=True)  # 'waitlist' — лист ожидания
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -329,6 +376,7 @@ class TrainingSessions(models.Model):
     topic = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     max_participants = models.IntegerField(blank=True, null=True)
+    booked_count = models.IntegerField(default=0)  # записи вне листа ожидания, см. core/registration.py
     location = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -336,6 +384,10 @@ class TrainingSessions(models.Model):
 
     class Meta:
         db_table = 'training_sessions'
+        indexes = [
+            models.Index(fields=['datetime'], name='training_sessions_datetime'),
+            models.Index(fields=['trainer', 'datetime'], name='training_sessions_trainer_dt'),
+        ]
         verbose_name = 'Тренировка'
         verbose_name_plural = 'Тренировки'
 
@@ -0,0 +1,138 @@
+# core/pagination.py
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+
+
+# === КУРСОРНАЯ ПАГИНАЦИЯ (по умолчанию для всех ViewSet) ===
+class CRMCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация с непрозрачным курсором.
+
+    Порядок берётся из атрибута `ordering` у ViewSet, поэтому каждый эндпоинт
+    задаёт свою стабильную сортировку (последним полем — уникальный id).
+    Стоимость страницы не зависит от её номера и размера таблицы.
+
+    В отличие от CursorPagination DRF, курсор хранит значения всех полей
+    сортировки, а не только первого: страница выбирается условием на кортеж
+    (payment_date, id), без OFFSET внутри группы одинаковых дат. Строки,
+    вставленные между запросами страниц, не сдвигают уже выданные.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-id',)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', None)
+        if not ordering:
+            ordering = super().get_ordering(request, queryset, view)
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(ordering)
+        # Ключ курсора должен быть уникальным — иначе строки с равным ключом теряются
+        last = queryset.model._meta.get_field(ordering[-1].lstrip('-'))
+        if not (last.primary_key or last.unique):
+            ordering += ('-pk' if ordering[-1].startswith('-') else 'pk',)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [self._field(queryset.model, name) for name in self.ordering]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, self._decode_position(position)))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        # Соседние страницы — от первой и последней строки текущей
+        first = self._get_position_from_instance(self.page[0], self.ordering) if self.page else position
+        last = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else position
+        self.previous_position = first if self.has_previous else None
+        self.next_position = last if self.has_next else None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    @staticmethod
+    def _field(model, name):
+        name = name.lstrip('-')
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    @staticmethod
+    def _after(ordering, values):
+        """
+        Строки строго после values в порядке ordering:
+        a < va OR (a = va AND b > vb) OR ... — направление сравнения берётся из знака поля.
+        Первое условие повторено отдельно (a <= va), чтобы сработал индекс по a.
+        """
+        condition, equal = Q(), Q()
+        for name, value in zip(ordering, values):
+            attr = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{attr}__{lookup}': value})
+            equal &= Q(**{attr: value})
+        first = ordering[0]
+        return Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in self.fields:
+            value = instance[field.attname] if isinstance(instance, dict) else getattr(instance, field.attname)
+            values.append(None if value is None else value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return json.dumps(values)
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+def _reverse_ordering(ordering):
+    return tuple(name[1:] if name.startswith('-') else '-' + name for name in ordering)
+
+
+# === ОБЫЧНАЯ ПАГИНАЦИЯ (для небольших справочников) ===
+class CRMPageNumberPagination(PageNumberPagination):
+    """Постраничная пагинация с номером страницы — только для маленьких таблиц"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
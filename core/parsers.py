@@ -0,0 +1,49 @@
+# core/parsers.py
+#
+# Разбор тела запроса: JSON через orjson (если установлен) и MessagePack.
+# Результат тот же, что у JSONParser DRF: числа с точкой — float, DecimalField
+# сериализатора приводит их к Decimal сам; даты приходят строками ISO 8601.
+
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import MessagePackRenderer, msgpack, orjson
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser на orjson для UTF-8; остальные кодировки и большие целые — стандартный json"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # Сообщение об ошибке (и целые больше 64 бит) — как у JSONParser
+            return super().parse(_Body(body), media_type, parser_context)
+
+
+class _Body:
+    """Уже прочитанное тело запроса для JSONParser"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self, *args):
+        body, self.body = self.body, b''
+        return body
+
+
+class MessagePackParser(BaseParser):
+    media_type = MessagePackRenderer.media_type
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError) as exc:  # ошибки формата msgpack — подклассы ValueError
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,118 @@
+# core/profile.py
+
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+
+from .models import Participants, SystemUsers
+
+
+PROFILE_CACHE_TIMEOUT = 300  # страховка на случай изменений в обход save()
+PROFILE_CACHE_VERSION = 1
+
+# Заглушки для пустых полей — их ждёт страница профиля
+PROFILE_PLACEHOLDERS = {
+    'phone': '+7 (999) 000-00-00',
+    'birth_date': '1990-01-01',
+    'join_date': '2024-01-01',
+    'emergency_contact': 'Не указан',
+    'address': 'Не указан',
+}
+
+
+def profile_cache_key(user_id):
+    return f'profile:{PROFILE_CACHE_VERSION}:{user_id}'
+
+
+def build_profile(user):
+    """Данные профиля; user загружен с select_related('member')"""
+    member = user.member
+    data = {
+        'email': user.email or "",
+        'role': user.role or "user",
+        'first_name': "",
+        'last_name': "",
+        'phone': "",
+        'birth_date': "",
+        'join_date': "",
+        'emergency_contact': "",
+        'address': "",
+    }
+    if member is not None:
+        data.update({
+            'first_name': member.first_name or "",
+            'last_name': member.last_name or "",
+            'phone': member.phone or "",
+            'birth_date': member.birth_date.isoformat() if member.birth_date else "",
+            'join_date': member.join_date.isoformat() if member.join_date else "",
+            'emergency_contact': member.emergency_contact or "",
+            'address': member.address or "",
+        })
+    for name, placeholder in PROFILE_PLACEHOLDERS.items():
+        if not data[name]:
+            data[name] = placeholder
+    return data
+
+
+def get_profile(user_id):
+    """
+    (данные, ETag) профиля из кэша; при промахе — один запрос
+    SystemUsers + участник. None — пользователь удалён.
+    """
+    key = profile_cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    user = SystemUsers.objects.select_related('member').filter(pk=user_id).first()
+    if user is None:
+        return None
+    profile = _with_etag(build_profile(user))
+    cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+async def aget_profile(user_id):
+    """get_profile для async-представлений"""
+    key = profile_cache_key(user_id)
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached
+    user = await SystemUsers.objects.select_related('member').filter(pk=user_id).afirst()
+    if user is None:
+        return None
+    profile = _with_etag(build_profile(user))
+    await cache.aset(key, profile, PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+def _with_etag(data):
+    return data, hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+# === СБРОС КЭША ===
+def invalidate_profiles(user_ids):
+    keys = [profile_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # Ещё раз после коммита: параллельный запрос мог успеть закэшировать старые данные
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def user_changed(sender, instance, raw=False, **kwargs):
+    invalidate_profiles([instance.pk])
+
+
+def member_changed(sender, instance, raw=False, **kwargs):
+    invalidate_profiles(SystemUsers.objects.filter(member_id=instance.pk).values_list('id', flat=True))
+
+
+def connect_signals():
+    post_save.connect(user_changed, sender=SystemUsers, dispatch_uid='profile_user_save')
+    post_delete.connect(user_changed, sender=SystemUsers, dispatch_uid='profile_user_delete')
+    post_save.connect(member_changed, sender=Participants, dispatch_uid='profile_member_save')
+    # pre_delete: после удаления участника member_id у пользователей уже обнулён (SET_NULL)
+    pre_delete.connect(member_changed, sender=Participants, dispatch_uid='profile_member_delete')
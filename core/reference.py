@@ -0,0 +1,200 @@
+# core/reference.py
+#
+# Кэш справочников: тарифы, должности, список зон шкафчиков. Два уровня —
+# словарь процесса и общий кэш (settings.CACHES). Актуальность — по счётчику
+# поколения в общем кэше: сигналы save/delete увеличивают его, и каждый
+# воркер при следующем обращении видит новое поколение и перечитывает данные.
+# С кэшем процесса (LocMemCache) другие воркеры видят сброс только по истечении
+# счётчика — см. core/shared_cache.py.
+
+import copy
+import functools
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Lockers, Positions, TariffPlans
+from .shared_cache import counter
+
+
+REFERENCE_CACHE_TIMEOUT = 300  # страховка на случай изменений в обход save() (update, bulk_*)
+REFERENCE_CACHE_VERSION = 1
+
+
+def _load_by_pk(model):
+    return lambda: {obj.pk: obj for obj in model.objects.all()}
+
+
+def _load_zones():
+    return list(
+        Lockers.objects.exclude(zone__isnull=True).exclude(zone='')
+        .order_by('zone').values_list('zone', flat=True).distinct()
+    )
+
+
+# имя справочника -> (загрузка, модели, изменение которых его сбрасывает)
+REFERENCES = {
+    'tariff_plans': (_load_by_pk(TariffPlans), (TariffPlans,)),
+    'positions': (_load_by_pk(Positions), (Positions,)),
+    'locker_zones': (_load_zones, (Lockers,)),
+}
+
+_local = {}  # имя -> (поколение, данные)
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _generation_key(name):
+    return f'ref:{REFERENCE_CACHE_VERSION}:{name}:generation'
+
+
+def _data_key(name, generation):
+    return f'ref:{REFERENCE_CACHE_VERSION}:{name}:{generation}'
+
+
+def _count(name, outcome):
+    with _stats_lock:
+        _stats[name, outcome] += 1
+
+
+def _generation(name):
+    return counter(_generation_key(name), expire_locally=True)
+
+
+def _changed_in_transaction(name):
+    """Справочник изменён в текущей незакоммиченной транзакции (ждёт сброса on_commit)"""
+    connection = transaction.get_connection()
+    return connection.in_atomic_block and any(
+        getattr(func, 'reference', None) == name for _, func, _ in connection.run_on_commit
+    )
+
+
+def _lookup(name):
+    """(данные, откуда): из памяти процесса, из общего кэша или одним запросом к БД"""
+    if _changed_in_transaction(name):
+        # Данные могут откатиться — в кэш не кладём
+        return REFERENCES[name][0](), 'miss'
+    generation = _generation(name)
+    local = _local.get(name)
+    if local is not None and local[0] == generation:
+        return local[1], 'local'
+    data = cache.get(_data_key(name, generation))
+    outcome = 'shared'
+    if data is None:
+        data, outcome = REFERENCES[name][0](), 'miss'
+        cache.set(_data_key(name, generation), data, REFERENCE_CACHE_TIMEOUT)
+    _local[name] = (generation, data)
+    return data, outcome
+
+
+def get_reference(name):
+    data, outcome = _lookup(name)
+    _count(name, outcome)
+    return data
+
+
+def get_reference_object(name, pk):
+    """
+    Объект справочника по первичному ключу (копия — кэшированные экземпляры общие) или None.
+    Отсутствующий в кэше ключ проверяется в БД: строки из bulk_create сигналов не шлют.
+    """
+    data, outcome = _lookup(name)
+    obj = data.get(pk)
+    if obj is not None:
+        _count(name, outcome)
+        return copy.copy(obj)
+    _count(name, 'miss')
+    obj = REFERENCES[name][1][0].objects.filter(pk=pk).first()
+    if obj is not None:
+        bump_generation(name)
+    return obj
+
+
+def tariff_plan(pk):
+    return get_reference_object('tariff_plans', pk)
+
+
+def position(pk):
+    return get_reference_object('positions', pk)
+
+
+def locker_zones():
+    return get_reference('locker_zones')
+
+
+# === СБРОС ===
+def bump_generation(name):
+    _local.pop(name, None)
+    try:
+        cache.incr(_generation_key(name))
+    except ValueError:  # счётчика нет — следующее обращение заведёт новый
+        pass
+
+
+def invalidate_reference(name):
+    bump_generation(name)
+    # Ещё раз после коммита: параллельный запрос мог успеть закэшировать старые данные.
+    # При откате колбэк отбрасывается вместе с точкой сохранения
+    callback = functools.partial(bump_generation, name)
+    callback.reference = name
+    transaction.on_commit(callback)
+
+
+def _receiver(names):
+    def changed(sender, instance=None, raw=False, **kwargs):
+        for name in names:
+            invalidate_reference(name)
+    return changed
+
+
+def connect_signals():
+    by_model = {}
+    for name, (_, models) in REFERENCES.items():
+        for model in models:
+            by_model.setdefault(model, []).append(name)
+    for model, names in by_model.items():
+        receiver = _receiver(names)
+        label = model._meta.model_name
+        post_save.connect(receiver, sender=model, weak=False, dispatch_uid=f'reference_{label}_save')
+        post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=f'reference_{label}_delete')
+
+
+# === МЕТРИКИ ===
+def reference_stats():
+    """
+    Счётчики этого процесса: попадания в память и в общий кэш, промахи.
+    Каждое попадание — сэкономленный запрос к БД.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    tables = {}
+    for name in REFERENCES:
+        local, shared, misses = (stats.get((name, outcome), 0) for outcome in ('local', 'shared', 'miss'))
+        lookups = local + shared + misses
+        tables[name] = {
+            'local_hits': local,
+            'shared_hits': shared,
+            'misses': misses,
+            'hit_ratio': round((local + shared) / lookups, 4) if lookups else None,
+        }
+    hits = sum(row['local_hits'] + row['shared_hits'] for row in tables.values())
+    lookups = hits + sum(row['misses'] for row in tables.values())
+    return {
+        'lookups': lookups,
+        'queries_saved': hits,
+        'hit_ratio': round(hits / lookups, 4) if lookups else None,
+        'tables': tables,
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def clear_local():
+    """Сброс словаря процесса (тесты, смена кэша)"""
+    _local.clear()
@@ -0,0 +1,271 @@
+# core/registration.py
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Now
+from drf_spectacular.utils import extend_schema
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.response import Response
+
+from .models import EventParticipants, Events, Participants, TrainingAttendance, TrainingSessions
+
+
+WAITLIST = 'waitlist'
+REGISTERED = 'registered'
+
+
+class RegistrationFull(Exception):
+    """Свободных мест нет, а в лист ожидания не просили"""
+
+
+class RegistrationFullError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = {'detail': 'Мест нет', 'code': 'full'}
+    default_code = 'full'
+
+
+# === ЧТО С ЧЕМ СЧИТАЕМ ===
+class RegistrationSpec:
+    """
+    target: модель с вместимостью (max_participants) и счётчиком занятых мест.
+    booking: модель записи; target_field — её FK на target.
+    Счётчик хранит число записей вне листа ожидания и меняется только
+    условным UPDATE (... WHERE counter < max_participants): строка target
+    блокируется на время UPDATE, поэтому параллельные записи не превышают лимит.
+    """
+
+    def __init__(self, target, booking, target_field, counter):
+        self.target = target
+        self.booking = booking
+        self.target_field = target_field
+        self.counter = counter
+
+    def bookings(self, target_id):
+        return self.booking.objects.filter(**{f'{self.target_field}_id': target_id})
+
+    def holds_place(self):
+        return ~Q(status=WAITLIST)
+
+
+EVENT_REGISTRATION = RegistrationSpec(Events, EventParticipants, 'event', 'registered_count')
+SESSION_REGISTRATION = RegistrationSpec(TrainingSessions, TrainingAttendance, 'session', 'booked_count')
+
+
+def _take_place(spec, target_id):
+    """Атомарно занимает место; False — мест нет"""
+    has_room = Q(max_participants__isnull=True) | Q(**{f'{spec.counter}__lt': F('max_participants')})
+    return bool(
+        spec.target.objects.filter(has_room, pk=target_id).update(
+            **{spec.counter: F(spec.counter) + 1}, updated_at=Now(),
+        )
+    )
+
+
+def _release_place(spec, target_id):
+    spec.target.objects.filter(pk=target_id, **{f'{spec.counter}__gt': 0}).update(
+        **{spec.counter: F(spec.counter) - 1}, updated_at=Now(),
+    )
+
+
+def _lock(spec, target_ids, booking):
+    """
+    Блокирует target (по возрастанию pk — без взаимных блокировок), затем запись.
+    Возвращает актуальный статус записи; DoesNotExist — запись уже удалили.
+    Блокировка target упорядочивает отмены, переносы и перевод из листа ожидания.
+    """
+    list(spec.target.objects.select_for_update().filter(pk__in=target_ids).order_by('pk').values_list('pk'))
+    current = list(spec.booking.objects.select_for_update().filter(pk=booking.pk).values_list('status', flat=True))
+    if not current:
+        raise spec.booking.DoesNotExist()
+    return current[0]
+
+
+def register(spec, target_id, participant_id, waitlist=False, **fields):
+    """
+    Записывает участника. Возвращает (запись, created).
+    Повторная запись возвращает существующую. Если мест нет —
+    лист ожидания (waitlist=True) или RegistrationFull.
+    """
+    if not spec.target.objects.filter(pk=target_id).exists():
+        raise spec.target.DoesNotExist()
+    if not Participants.objects.filter(pk=participant_id).exists():
+        raise Participants.DoesNotExist()
+    existing = spec.bookings(target_id).filter(participant_id=participant_id).first()
+    if existing is not None:
+        return existing, False
+
+    requested_status = fields.pop('status', None)
+    try:
+        with transaction.atomic():
+            if _take_place(spec, target_id):
+                booking_status = requested_status if requested_status not in (None, '', WAITLIST) else REGISTERED
+            elif waitlist:
+                booking_status = WAITLIST
+            else:
+                raise RegistrationFull()
+            booking = spec.booking.objects.create(**{
+                f'{spec.target_field}_id': target_id,
+                'participant_id': participant_id,
+                'status': booking_status,
+                **fields,
+            })
+    except IntegrityError:
+        # Та же пара записалась параллельно — счётчик откатился вместе с транзакцией
+        existing = spec.bookings(target_id).filter(participant_id=participant_id).first()
+        if existing is None:
+            raise
+        return existing, False
+    return booking, True
+
+
+def promote_waitlist(spec, target_id, exclude=None):
+    """Переводит из листа ожидания в записанные, пока есть места; возвращает переведённые записи"""
+    promoted = []
+    waiting = spec.bookings(target_id).filter(status=WAITLIST).exclude(pk=exclude)
+    for booking in waiting.select_for_update().order_by('id'):
+        if not _take_place(spec, target_id):
+            break
+        booking.status = REGISTERED
+        booking.save(update_fields=['status'])
+        promoted.append(booking)
+    return promoted
+
+
+@transaction.atomic
+def cancel(spec, booking):
+    """Отменяет запись и освобождает место для листа ожидания"""
+    target_id = getattr(booking, f'{spec.target_field}_id')
+    try:
+        # Статус — после блокировки: прочитанный раньше мог сменить параллельный перевод или отмена
+        held_place = _lock(spec, [target_id], booking) != WAITLIST
+    except spec.booking.DoesNotExist:
+        return []  # отменили параллельно — место уже освобождено
+    booking.delete()
+    if held_place:
+        _release_place(spec, target_id)
+    return promote_waitlist(spec, target_id)
+
+
+@transaction.atomic
+def update_booking(spec, booking, changes, save):
+    """
+    Правка записи (PUT/PATCH): перенос на другой target и/или смена статуса.
+    changes — validated_data сериализатора, save() сохраняет запись. Место на новом
+    target занимается тем же условным UPDATE, что и при записи (нет мест —
+    RegistrationFull), освободившееся на старом — отдаётся листу ожидания.
+    """
+    old_target_id = getattr(booking, f'{spec.target_field}_id')
+    target = changes.get(spec.target_field)
+    target_id = old_target_id if target is None else target.pk
+    current_status = _lock(spec, {old_target_id, target_id}, booking)
+    was_held = current_status != WAITLIST
+    held = changes.get('status', current_status) != WAITLIST
+    moved = target_id != old_target_id
+
+    if held and (moved or not was_held) and not _take_place(spec, target_id):
+        raise RegistrationFull()
+    freed = was_held and (moved or not held)
+    if freed:
+        _release_place(spec, old_target_id)
+    save()
+    if freed:
+        # Саму запись, сдвинутую в лист ожидания, обратно не переводим
+        promote_waitlist(spec, old_target_id, exclude=booking.pk)
+
+
+def recount(spec, target_ids=None):
+    """Пересчитывает счётчики по таблице записей одним UPDATE (после массовых правок, импорта)"""
+    held = (
+        spec.booking.objects
+        .filter(spec.holds_place(), **{spec.target_field: OuterRef('pk')})
+        .order_by()
+        .values(spec.target_field)
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    queryset = spec.target.objects.all()
+    if target_ids is not None:
+        queryset = queryset.filter(pk__in=target_ids)
+    return queryset.update(**{
+        spec.counter: Coalesce(Subquery(held, output_field=IntegerField()), Value(0)),
+        'updated_at': Now(),  # ETag/Last-Modified списков и календаря
+    })
+
+
+# === API ===
+class RegistrationRequestSerializer(serializers.Serializer):
+    participant = serializers.IntegerField()
+    waitlist = serializers.BooleanField(default=False)
+
+
+class RegistrationMixin:
+    """
+    Добавляет к ViewSet мероприятий/тренировок:
+    POST {id}/register/ {participant, waitlist} и POST {id}/unregister/ {participant}.
+    Нет мест и waitlist=false — 409 с code=full.
+    """
+    registration_spec = None
+    booking_serializer_class = None
+
+    @extend_schema(summary="Записать участника", request=RegistrationRequestSerializer)
+    @action(detail=True, methods=['post'], url_path='register')
+    def register(self, request, pk=None):
+        params = RegistrationRequestSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        spec = self.registration_spec
+        try:
+            booking, created = register(
+                spec, pk, params.validated_data['participant'], waitlist=params.validated_data['waitlist'],
+            )
+        except spec.target.DoesNotExist:
+            raise NotFound()
+        except Participants.DoesNotExist:
+            raise ValidationError({"participant": "Участник не найден"})
+        except RegistrationFull:
+            raise RegistrationFullError()
+        return Response(
+            self.booking_serializer_class(booking).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @extend_schema(summary="Отменить запись участника", request=RegistrationRequestSerializer)
+    @action(detail=True, methods=['post'], url_path='unregister')
+    def unregister(self, request, pk=None):
+        params = RegistrationRequestSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        spec = self.registration_spec
+        booking = spec.bookings(pk).filter(participant_id=params.validated_data['participant']).first()
+        if booking is None:
+            return Response({"detail": "Запись не найдена"}, status=status.HTTP_404_NOT_FOUND)
+        promoted = cancel(spec, booking)
+        return Response({"promoted": [item.participant_id for item in promoted]})
+
+
+class BookingViewSetMixin:
+    """create/update/destroy записей через те же атомарные register/update_booking/cancel, что и действия выше"""
+    registration_spec = None
+
+    def perform_create(self, serializer):
+        spec = self.registration_spec
+        data = dict(serializer.validated_data)
+        target = data.pop(spec.target_field)
+        participant = data.pop('participant')
+        try:
+            booking, _ = register(spec, target.pk, participant.pk, waitlist=data.get('status') == WAITLIST, **data)
+        except RegistrationFull:
+            raise RegistrationFullError()
+        serializer.instance = booking
+
+    def perform_update(self, serializer):
+        spec = self.registration_spec
+        try:
+            update_booking(spec, serializer.instance, serializer.validated_data, serializer.save)
+        except RegistrationFull:
+            raise RegistrationFullError()
+        except spec.booking.DoesNotExist:
+            raise NotFound()
+
+    def perform_destroy(self, instance):
+        cancel(self.registration_spec, instance)
@@ -0,0 +1,112 @@
+# core/renderers.py
+#
+# Быстрые форматы ответа, выбираются согласованием (Accept или ?format=):
+#   application/json     — FastJSONRenderer: orjson, вывод байт в байт как у JSONRenderer DRF
+#   application/msgpack  — MessagePackRenderer
+# и FastJsonResponse для представлений на JsonResponse.
+# orjson и msgpack необязательны: без orjson работает стандартный json, без
+# msgpack формат не регистрируется (см. REST_FRAMEWORK в CRM/settings.py).
+#
+# Decimal и даты: сериализаторы уже отдают Decimal строкой ('3000.00'), даты —
+# ISO 8601 ('1990-05-17'). Значения, попавшие в ответ мимо сериализатора,
+# обрабатывает тот же кодировщик, что и раньше: encoders.JSONEncoder DRF для
+# рендереров, DjangoJSONEncoder для JsonResponse.
+
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без неё — стандартный json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # необязательная зависимость: без неё нет формата msgpack
+    msgpack = None
+
+
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+_drf_default = encoders.JSONEncoder().default
+_django_default = DjangoJSONEncoder().default
+
+
+def orjson_dumps(data, default=_drf_default):
+    """
+    bytes как у json.dumps(ensure_ascii=False) с компактными разделителями; даты,
+    Decimal и прочие не-JSON типы — через default. None, если orjson недоступен
+    или не справился (целые больше 64 бит) — тогда кодирует json.
+    """
+    if orjson is None:
+        return None
+    try:
+        return orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return None
+
+
+# === JSON ===
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson; ответ совпадает байт в байт. С отступом (Browsable API,
+    `Accept: application/json; indent=4`) и при других UNICODE_JSON/COMPACT_JSON —
+    обычный json.dumps.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            data is not None and not self.ensure_ascii and self.compact
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        ):
+            ret = orjson_dumps(data)
+            if ret is not None:
+                # Как JSONRenderer: JSON остаётся подмножеством JavaScript
+                if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+                    ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+                return ret
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+# === MESSAGEPACK ===
+def _msgpack_default(obj):
+    # Как в JSON-ответе, но Decimal строкой (JSONEncoder DRF отдал бы float)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    return _drf_default(obj)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True, datetime=False)
+
+
+# === JsonResponse ===
+class FastJsonResponse(JsonResponse):
+    """
+    JsonResponse на orjson. Значения — как у DjangoJSONEncoder (Decimal строкой,
+    время до миллисекунд); разделители компактные, не-ASCII — без \\u-экранирования.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        content = orjson_dumps(data, default=_django_default)
+        if content is None:
+            content = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+        HttpResponse.__init__(self, content=content, **kwargs)
@@ -0,0 +1,188 @@
+# core/reports.py
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum, Count, Value
+from django.db.models.functions import Coalesce, Trunc
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+
+from .models import Payments, RevenueDaily
+
+
+GRANULARITIES = ('day', 'week', 'month')
+REBUILD_BATCH_SIZE = 2000
+
+# Поля платежа, от которых зависит строка свёртки
+ROLLUP_FIELDS = ('payment_date', 'payment_method', 'purpose', 'status', 'amount')
+
+
+# === ВЕДЕНИЕ СВЁРТКИ revenue_daily ===
+def _rollup_key(values):
+    """(дата, способ, назначение, статус); NULL-статус хранится как '' — иначе не работает уникальный ключ"""
+    return (values['payment_date'], values['payment_method'], values['purpose'], values['status'] or '')
+
+
+def apply_revenue_deltas(deltas):
+    """
+    deltas: {ключ свёртки: (изменение суммы, изменение числа платежей)}.
+
+    Одно INSERT ... ON CONFLICT DO UPDATE на ключ (PostgreSQL и SQLite),
+    строки затронутых ключей, в которых не осталось платежей, удаляются.
+    """
+    rows = [
+        (*key, amount, count)
+        for key, (amount, count) in deltas.items()
+        if amount or count
+    ]
+    if not rows:
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(RevenueDaily._meta.db_table)
+    key_columns = ', '.join(qn(name) for name in ('date', 'payment_method', 'purpose', 'status'))
+    sql = (
+        f"INSERT INTO {table} ({key_columns}, {qn('amount')}, {qn('payments_count')}) "
+        f"VALUES (%s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({key_columns}) DO UPDATE SET "
+        f"{qn('amount')} = {table}.{qn('amount')} + excluded.{qn('amount')}, "
+        f"{qn('payments_count')} = {table}.{qn('payments_count')} + excluded.{qn('payments_count')}"
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+        # Опустеть могли только ключи, из которых платежи ушли
+        emptied = [row[:4] for row in rows if row[5] < 0]
+        if emptied:
+            key_match = ' AND '.join(f'{qn(name)} = %s' for name in ('date', 'payment_method', 'purpose', 'status'))
+            cursor.executemany(f"DELETE FROM {table} WHERE {key_match} AND {qn('payments_count')} <= 0", emptied)
+
+
+def add_payments_to_rollup(payments):
+    """Учесть в свёртке платежи, вставленные в обход save() (bulk_create, COPY); payments — словари полей"""
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for values in payments:
+        delta = deltas[_rollup_key(values)]
+        delta[0] += Decimal(values['amount'])
+        delta[1] += 1
+    apply_revenue_deltas(deltas)
+
+
+def _loaded_state(instance):
+    values = instance.__dict__
+    if all(name in values for name in ROLLUP_FIELDS):
+        return {name: values[name] for name in ROLLUP_FIELDS}
+    return None
+
+
+def remember_payment(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._revenue_state = _loaded_state(instance)
+
+
+def load_previous_payment(sender, instance, raw=False, **kwargs):
+    # Платёж загружен через .only()/.defer() — прежние значения берём из БД
+    if raw or instance.pk is None or getattr(instance, '_revenue_state', None) is not None:
+        return
+    instance._revenue_state = Payments.objects.filter(pk=instance.pk).values(*ROLLUP_FIELDS).first()
+
+
+def update_rollup_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = {name: getattr(instance, name) for name in ROLLUP_FIELDS}
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    previous = None if created else getattr(instance, '_revenue_state', None)
+    if previous is not None:
+        delta = deltas[_rollup_key(previous)]
+        delta[0] -= Decimal(previous['amount'])
+        delta[1] -= 1
+    delta = deltas[_rollup_key(current)]
+    delta[0] += Decimal(current['amount'])
+    delta[1] += 1
+    apply_revenue_deltas(deltas)
+    instance._revenue_state = current
+
+
+def update_rollup_on_delete(sender, instance, **kwargs):
+    state = getattr(instance, '_revenue_state', None) or {name: getattr(instance, name) for name in ROLLUP_FIELDS}
+    apply_revenue_deltas({_rollup_key(state): (-Decimal(state['amount']), -1)})
+
+
+def connect_signals():
+    post_init.connect(remember_payment, sender=Payments, dispatch_uid='revenue_init')
+    pre_save.connect(load_previous_payment, sender=Payments, dispatch_uid='revenue_pre_save')
+    post_save.connect(update_rollup_on_save, sender=Payments, dispatch_uid='revenue_save')
+    post_delete.connect(update_rollup_on_delete, sender=Payments, dispatch_uid='revenue_delete')
+
+
+@transaction.atomic
+def rebuild_revenue_daily():
+    """Полный пересчёт свёртки по таблице payments; возвращает число строк"""
+    RevenueDaily.objects.all().delete()
+    grouped = (
+        Payments.objects
+        .values('payment_date', 'payment_method', 'purpose', status_key=Coalesce('status', Value('')))
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    batch = []
+    created = 0
+    for row in grouped.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        batch.append(RevenueDaily(
+            date=row['payment_date'], payment_method=row['payment_method'], purpose=row['purpose'],
+            status=row['status_key'], amount=row['total'], payments_count=row['count'],
+        ))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            created += len(RevenueDaily.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        created += len(RevenueDaily.objects.bulk_create(batch))
+    return created
+
+
+# === ОТЧЁТ ===
+def revenue_report(granularity='month', date_from=None, date_to=None, payment_method=None, purpose=None, status=None):
+    """Выручка по периодам, способам оплаты, назначениям и статусам — только из свёртки"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity: одно из {", ".join(GRANULARITIES)}')
+
+    queryset = RevenueDaily.objects.all()
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    if payment_method:
+        queryset = queryset.filter(payment_method=payment_method)
+    if purpose:
+        queryset = queryset.filter(purpose=purpose)
+    if status is not None:
+        queryset = queryset.filter(status=status)
+
+    rows = (
+        queryset
+        .annotate(period=Trunc('date', granularity))
+        .values('period', 'payment_method', 'purpose', 'status')
+        .annotate(total=Sum('amount'), count=Sum('payments_count'))
+        .order_by('period', 'payment_method', 'purpose', 'status')
+    )
+    results = []
+    total_amount = Decimal(0)
+    total_count = 0
+    for row in rows:
+        results.append({
+            'period': row['period'],
+            'payment_method': row['payment_method'],
+            'purpose': row['purpose'],
+            'status': row['status'] or None,
+            'amount': row['total'],
+            'payments_count': row['count'],
+        })
+        total_amount += row['total']
+        total_count += row['count']
+
+    return {
+        'granularity': granularity,
+        'results': results,
+        'total': {'amount': total_amount, 'payments_count': total_count},
+    }
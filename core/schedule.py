@@ -0,0 +1,95 @@
+# core/schedule.py
+
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import TrainingSessions
+from .registration import WAITLIST
+
+
+MAX_RANGE_DAYS = 93
+CALENDAR_FIELDS = (
+    'id', 'datetime', 'duration_minutes', 'topic', 'description', 'max_participants',
+    'location', 'status', 'trainer_id',
+)
+
+
+def parse_bound(value, end=False):
+    """Дата или дата-время из запроса -> aware datetime; для end=True дата включается целиком"""
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    elif moment is None:
+        raise ValueError(f'Неверная дата: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def calendar_queryset(start, end, trainer=None, location=None):
+    """Тренировки в [start, end) — обслуживается индексами по datetime и (trainer, datetime)"""
+    if end <= start:
+        raise ValueError('end должен быть позже start')
+    if end - start > timedelta(days=MAX_RANGE_DAYS):
+        raise ValueError(f'Диапазон не больше {MAX_RANGE_DAYS} дней')
+    queryset = TrainingSessions.objects.filter(datetime__gte=start, datetime__lt=end)
+    if trainer:
+        queryset = queryset.filter(trainer_id=trainer)
+    if location:
+        queryset = queryset.filter(location=location)
+    return queryset
+
+
+def calendar_sessions(queryset):
+    """Тренировки с тренером и числом записанных/пришедших — один GROUP BY запрос"""
+    return (
+        queryset
+        .select_related('trainer')
+        .only(*CALENDAR_FIELDS, 'trainer__first_name', 'trainer__last_name')
+        .annotate(
+            booked=Count('trainingattendance', filter=~Q(trainingattendance__status=WAITLIST)),
+            attended_count=Count('trainingattendance', filter=Q(trainingattendance__attended=True)),
+        )
+        .order_by('datetime', 'id')
+    )
+
+
+def _etag_rows(queryset):
+    """Состояние каждой тренировки: id, updated_at тренировки и тренера, записанные, пришедшие"""
+    return (
+        queryset
+        .annotate(
+            booked=Count('trainingattendance', filter=~Q(trainingattendance__status=WAITLIST)),
+            attended_count=Count('trainingattendance', filter=Q(trainingattendance__attended=True)),
+        )
+        .order_by('id')
+        .values_list('id', 'updated_at', 'trainer__updated_at', 'booked', 'attended_count')
+    )
+
+
+def _etag_digest(rows):
+    raw = '|'.join(','.join(map(str, row)) for row in rows)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def calendar_etag(queryset):
+    """
+    Отпечаток выдачи одним запросом: по каждой тренировке — updated_at её и
+    тренера, число записанных и пришедших. Итоги по диапазону не годятся:
+    отметка, снятая в одной тренировке и поставленная в другой, их не меняет.
+    Записи на тренировку своего updated_at не имеют — учитываются счётчики.
+    """
+    return _etag_digest(_etag_rows(queryset))
+
+
+async def acalendar_etag(queryset):
+    """То же для async-представлений"""
+    return _etag_digest([row async for row in _etag_rows(queryset)])
@@ -0,0 +1,95 @@
+# core/schema.py
+#
+# Дополнения к существующей схеме «CRM». Миграции для core отключены
+# (MIGRATION_MODULES = {'core': None}), поэтому новые таблицы и колонки
+# создаёт команда setup_schema — так же, как setup_search создаёт индексы
+# поиска. DDL строит schema_editor Django по полям моделей (на PostgreSQL —
+# ALTER TABLE ... ADD COLUMN), повторный запуск безопасен: создаётся только
+# то, чего ещё нет в БД. Сразу после создания выполняется начальное
+# заполнение; если оно упало, его повторяют отдельной командой (см. комментарии).
+# Индексы из Meta.indexes моделей SCHEMA_INDEXES создаются так же: syncdb
+# тестовой БД строит их сам, на рабочей схеме — только этой командой.
+
+from functools import partial
+
+from django.db import connection, transaction
+
+from .models import (
+    Equipment, EquipmentRentals, Events, LockerRentals, Payments, RevenueDaily, Subscriptions, TrainingAttendance,
+    TrainingSessions,
+)
+from .registration import EVENT_REGISTRATION, SESSION_REGISTRATION, recount
+from .reports import rebuild_revenue_daily
+
+
+# (модель, поле или None — вся таблица, начальное заполнение или None)
+SCHEMA_CHANGES = [
+    (RevenueDaily, None, rebuild_revenue_daily),  # повтор: manage.py rebuild_revenue
+    # Вместимость мероприятий и тренировок (core/registration.py). Старые записи со
+    # статусом NULL занимают место — как и всё, что не 'waitlist'; счётчики
+    # заполняются пересчётом по таблицам записей (повтор: manage.py recount_registrations).
+    (TrainingAttendance, 'status', None),
+    (Events, 'registered_count', partial(recount, EVENT_REGISTRATION)),
+    (TrainingSessions, 'booked_count', partial(recount, SESSION_REGISTRATION)),
+    # Ключ идемпотентности автоматических счетов (core/billing.py):
+    # ALTER TABLE payments ADD COLUMN idempotency_key varchar(64) NULL UNIQUE
+    (Payments, 'idempotency_key', None),
+    # Начисленная пеня (core/equipment.py); до первого ночного начисления — 0
+    (EquipmentRentals, 'late_fee', None),
+]
+
+# Модели, чьи Meta.indexes создаются по имени индекса
+SCHEMA_INDEXES = [
+    TrainingSessions,  # календарь: диапазон по datetime, тренер + datetime (core/schedule.py)
+    LockerRentals,  # занятость шкафов: Exists по (locker, status), (status, start_date) (core/views.py)
+    Subscriptions,  # продления: (status, end_date) (core/billing.py)
+    EquipmentRentals,  # просрочки: частичный индекс по невозвращённым (core/equipment.py)
+    Equipment,  # планировщик обслуживания, подбор по (type, size) (core/equipment.py)
+]
+
+
+def _columns(table):
+    with connection.cursor() as cursor:
+        return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+
+def _constraint_names(table):
+    with connection.cursor() as cursor:
+        return set(connection.introspection.get_constraints(cursor, table))
+
+
+def setup_schema():
+    """
+    Создаёт недостающие таблицы, колонки и индексы; возвращает созданное
+    ('таблица', 'таблица.колонка' или имя индекса)
+    """
+    created = []
+    tables = set(connection.introspection.table_names())
+    for model, field_name, backfill in SCHEMA_CHANGES:
+        table = model._meta.db_table
+        if field_name is None:
+            if table in tables:
+                continue
+            with connection.schema_editor() as editor:
+                editor.create_model(model)
+            tables.add(table)
+            created.append(table)
+        else:
+            field = model._meta.get_field(field_name)
+            if field.column in _columns(table):
+                continue
+            with connection.schema_editor() as editor:
+                editor.add_field(model, field)
+            created.append(f'{table}.{field.column}')
+        if backfill is not None:
+            with transaction.atomic():
+                backfill()
+    for model in SCHEMA_INDEXES:
+        existing = _constraint_names(model._meta.db_table)
+        for index in model._meta.indexes:
+            if index.name in existing:
+                continue
+            with connection.schema_editor() as editor:
+                editor.add_index(model, index)
+            created.append(index.name)
+    return created
@@ -0,0 +1,221 @@
+# core/search.py
+
+import re
+
+from django.db import connection, DatabaseError
+from django.db.models import Case, F, FloatField, Func, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Participants
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+MIN_PHONE_DIGITS = 3
+TRIGRAM_MIN_LENGTH = 3
+SEARCH_FIELDS = ('id', 'last_name', 'first_name', 'phone', 'email')
+
+FTS_TABLE = 'participants_fts'
+
+# Выражение «только цифры телефона» — одинаковое в индексе и в запросе.
+# Как normalize_phone: 11 цифр с префиксом 8 приводятся к 7
+PG_PHONE_DIGITS_SQL = "regexp_replace(regexp_replace(phone, '\\D', '', 'g'), '^8(\\d{10})$', '7\\1')"
+_SQLITE_DIGITS_SQL = "replace(replace(replace(replace(replace(replace({col}, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+SQLITE_PHONE_DIGITS_SQL = (
+    "CASE WHEN length({digits}) = 11 AND substr({digits}, 1, 1) = '8' THEN '7' || substr({digits}, 2) ELSE {digits} END"
+    .replace('{digits}', _SQLITE_DIGITS_SQL)
+)
+
+
+def normalize_phone(value):
+    """Оставляет только цифры; российский префикс 8 приводится к 7"""
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def phone_variants(value):
+    """
+    Строки цифр для поиска по нормализованному телефону. Неполный номер с 8 в
+    начале ищется и как есть (цифры в середине), и с 7 (префикс 8 → 7)
+    """
+    digits = normalize_phone(value)
+    if digits.startswith('8') and len(digits) < 11:
+        return [digits, '7' + digits[1:]]
+    return [digits]
+
+
+PHONE_QUERY_RE = re.compile(r'[\d\s()+.-]+')
+
+
+def split_query(query):
+    """Разбивает запрос на слова; запрос, похожий на телефон, — одно слово из цифр"""
+    query = (query or '').strip()
+    if PHONE_QUERY_RE.fullmatch(query) and normalize_phone(query):
+        return [normalize_phone(query)]
+    return [token for token in re.split(r'\s+', query) if token]
+
+
+# === POSTGRESQL: pg_trgm ===
+POSTGRES_SETUP_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS participants_last_name_trgm ON participants USING gin (last_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS participants_first_name_trgm ON participants USING gin (first_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS participants_email_trgm ON participants USING gin ((upper(email)) gin_trgm_ops)",
+    "DROP INDEX IF EXISTS participants_phone_digits_trgm",  # прежнее выражение без 8 → 7
+    f"CREATE INDEX IF NOT EXISTS participants_phone_norm_trgm ON participants USING gin (({PG_PHONE_DIGITS_SQL}) gin_trgm_ops)",
+]
+
+
+class PhoneDigits(Func):
+    function = 'regexp_replace'
+    template = PG_PHONE_DIGITS_SQL.replace('phone', '%(expressions)s')
+    output_field = Participants._meta.get_field('phone')
+
+
+def _search_postgres(queryset, tokens, limit):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    queryset = queryset.annotate(phone_digits=PhoneDigits(F('phone')))
+    rank_parts = []
+    for token in tokens:
+        if len(token) >= TRIGRAM_MIN_LENGTH:
+            # %> и UPPER(email) LIKE обслуживаются GIN-индексами pg_trgm
+            condition = (
+                Q(last_name__trigram_word_similar=token) | Q(first_name__trigram_word_similar=token)
+                | Q(email__icontains=token)
+            )
+        else:
+            condition = Q(last_name__istartswith=token) | Q(first_name__istartswith=token)
+        for digits in phone_variants(token):
+            if len(digits) >= MIN_PHONE_DIGITS:
+                condition |= Q(phone_digits__contains=digits)
+        queryset = queryset.filter(condition)
+
+        rank_parts.append(Greatest(
+            TrigramWordSimilarity(token, 'last_name'),
+            TrigramWordSimilarity(token, 'first_name'),
+            Case(
+                When(Q(last_name__istartswith=token) | Q(first_name__istartswith=token), then=Value(1.0)),
+                default=Value(0.0), output_field=FloatField(),
+            ),
+        ))
+
+    rank = rank_parts[0]
+    for part in rank_parts[1:]:
+        rank = rank + part
+    return list(
+        queryset.annotate(rank=rank)
+        .order_by('-rank', 'last_name', 'first_name')
+        .values(*SEARCH_FIELDS)[:limit]
+    )
+
+
+# === SQLITE: FTS5 (trigram) — локальная разработка и тесты ===
+SQLITE_SETUP_SQL = [
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+    # Триггеры пересоздаются: выражение phone_digits могло измениться
+    "DROP TRIGGER IF EXISTS participants_fts_insert",
+    "DROP TRIGGER IF EXISTS participants_fts_update",
+    "DROP TRIGGER IF EXISTS participants_fts_delete",
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(last_name, first_name, email, phone_digits, tokenize='trigram')",
+    f"""INSERT INTO {FTS_TABLE} (rowid, last_name, first_name, email, phone_digits)
+        SELECT id, last_name, first_name, coalesce(email, ''), {SQLITE_PHONE_DIGITS_SQL.format(col="coalesce(phone, '')")}
+        FROM participants""",
+    f"""CREATE TRIGGER IF NOT EXISTS participants_fts_insert AFTER INSERT ON participants BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, last_name, first_name, email, phone_digits)
+        VALUES (new.id, new.last_name, new.first_name, coalesce(new.email, ''),
+                {SQLITE_PHONE_DIGITS_SQL.format(col="coalesce(new.phone, '')")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS participants_fts_update AFTER UPDATE ON participants BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE} (rowid, last_name, first_name, email, phone_digits)
+        VALUES (new.id, new.last_name, new.first_name, coalesce(new.email, ''),
+                {SQLITE_PHONE_DIGITS_SQL.format(col="coalesce(new.phone, '')")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS participants_fts_delete AFTER DELETE ON participants BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+
+def _fts_phrase(token):
+    return '"%s"' % token.replace('"', '""')
+
+
+def _search_sqlite(queryset, tokens, limit):
+    match_parts = []
+    for token in tokens:
+        if len(token) < TRIGRAM_MIN_LENGTH:
+            # Триграммы не работают на коротких строках — оставляем только префикс
+            queryset = queryset.filter(Q(last_name__istartswith=token) | Q(first_name__istartswith=token))
+            continue
+        variants = [_fts_phrase(token)]
+        for digits in phone_variants(token):
+            if len(digits) >= TRIGRAM_MIN_LENGTH and digits != token:
+                variants.append('phone_digits : %s' % _fts_phrase(digits))
+        match_parts.append('(%s)' % ' OR '.join(variants))
+
+    if not match_parts:
+        return list(queryset.order_by('last_name', 'first_name').values(*SEARCH_FIELDS)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}) LIMIT %s",
+            [' AND '.join(match_parts), MAX_LIMIT * 5],
+        )
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+
+    rows = {row['id']: row for row in queryset.filter(id__in=ranked_ids).values(*SEARCH_FIELDS)}
+    return [rows[pk] for pk in ranked_ids if pk in rows][:limit]
+
+
+def _search_fallback(queryset, tokens, limit):
+    for token in tokens:
+        condition = Q(last_name__icontains=token) | Q(first_name__icontains=token) | Q(email__icontains=token)
+        if len(token) >= MIN_PHONE_DIGITS:
+            condition |= Q(phone__icontains=token)
+        queryset = queryset.filter(condition)
+    return list(queryset.order_by('last_name', 'first_name').values(*SEARCH_FIELDS)[:limit])
+
+
+def search_participants(query, limit=DEFAULT_LIMIT, active_only=True):
+    """
+    Поиск участников по ФИО, email и телефону с ранжированием.
+
+    PostgreSQL использует GIN-индексы pg_trgm, SQLite — таблицу FTS5
+    (обе создаются командой `manage.py setup_search`). Без индексов
+    выполняется обычный icontains-поиск. Возвращает список словарей.
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    queryset = Participants.objects.all()
+    if active_only:
+        queryset = queryset.filter(is_active=True)
+
+    tokens = split_query(query)
+    if not tokens:
+        return list(queryset.order_by('last_name', 'first_name').values(*SEARCH_FIELDS)[:limit])
+
+    if connection.vendor == 'postgresql':
+        return _search_postgres(queryset, tokens, limit)
+    if connection.vendor == 'sqlite':
+        try:
+            return _search_sqlite(queryset, tokens, limit)
+        except DatabaseError:
+            pass
+    return _search_fallback(queryset, tokens, limit)
+
+
+def setup_search_indexes():
+    """Создаёт поисковые индексы для текущей БД; возвращает список выполненных SQL"""
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_SETUP_SQL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_SETUP_SQL
+    else:
+        return []
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    return statements
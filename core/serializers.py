@@ -1,4 +1,5 @@
 # core/serializers.py
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from .models import (
     Participants, TariffPlans, Subscriptions, Payments,
@@ -6,9 +7,36 @@ from .models import (
     Events, EventParticipants, Positions, SystemUsers, ChangeLogs,
     Lockers, LockerRentals
 )
+from .equipment import conflicting_rentals, validate_rental_dates
+from .reference import get_reference_object
+
+
+class ReferenceRelatedField(serializers.PrimaryKeyRelatedField):
+    """Ссылка на справочник (core.reference): проверка id без запроса к БД"""
+
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = get_reference_object(self.reference, pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
 
 # === УЧАСТНИКИ ===
 class ParticipantSerializer(serializers.ModelSerializer):
+    position = ReferenceRelatedField(
+        'positions', queryset=Positions.objects.all(), required=False, allow_null=True,
+    )
+
     class Meta:
         model = Participants
         fields = '__all__'
@@ -26,7 +54,7 @@ class TariffPlanSerializer(serializers.ModelSerializer):
 # === АБОНЕМЕНТЫ ===
 class SubscriptionSerializer(serializers.ModelSerializer):
     participant = serializers.PrimaryKeyRelatedField(queryset=Participants.objects.all())
-    tariff_plan = serializers.PrimaryKeyRelatedField(queryset=TariffPlans.objects.all())
+    tariff_plan = ReferenceRelatedField('tariff_plans', queryset=TariffPlans.objects.all())
 
     class Meta:
         model = Subscriptions
@@ -42,7 +70,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payments
         fields = '__all__'
-        read_only_fields = ['created_at']
+        read_only_fields = ['idempotency_key', 'created_at']
 
 
 # === ТРЕНИРОВКИ ===
@@ -52,7 +80,7 @@ class TrainingSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = TrainingSessions
         fields = '__all__'
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['booked_count', 'created_at', 'updated_at']
 
 
 # === ПОСЕЩАЕМОСТЬ ===
@@ -82,7 +110,27 @@ class EquipmentRentalSerializer(serializers.ModelSerializer):
     class Meta:
         model = EquipmentRentals
         fields = '__all__'
-        read_only_fields = ['created_at']
+        read_only_fields = ['late_fee', 'created_at']
+
+    def validate(self, attrs):
+        """Даты в порядке и инвентарь на эти даты никому не выдан"""
+        def value(name):
+            return attrs[name] if name in attrs else getattr(self.instance, name, None)
+
+        rental_date, return_date, actual_return_date = (
+            value('rental_date'), value('return_date'), value('actual_return_date')
+        )
+        error = validate_rental_dates(rental_date, return_date, actual_return_date)
+        if error:
+            raise serializers.ValidationError({"return_date": error})
+        equipment = value('equipment')
+        conflicts = conflicting_rentals(
+            equipment.pk, rental_date, actual_return_date or return_date,
+            exclude_id=self.instance.pk if self.instance else None,
+        )
+        if conflicts.exists():
+            raise serializers.ValidationError({"equipment": "Инвентарь на эти даты уже выдан"})
+        return attrs
 
 
 # === МЕРОПРИЯТИЯ ===
@@ -90,7 +138,7 @@ class EventSerializer(serializers.ModelSerializer):
     class Meta:
         model = Events
         fields = '__all__'
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['registered_count', 'created_at', 'updated_at']
 
 
 # === УЧАСТНИКИ МЕРОПРИЯТИЙ ===
@@ -146,4 +194,93 @@ class LockerRentalSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = LockerRentals
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+# Вложенные представления связей для ?expand= (core/fieldsets.py)
+EXPAND_SERIALIZERS = {
+    serializer.Meta.model: serializer for serializer in (
+        ParticipantSerializer, TariffPlanSerializer, SubscriptionSerializer, PaymentSerializer,
+        TrainingSessionSerializer, EquipmentSerializer, EventSerializer, PositionSerializer,
+        SystemUserSerializer, LockerSerializer,
+    )
+}
+
+
+# === СПИСОК ГРУППЫ НА ТРЕНИРОВКЕ ===
+class RosterEntrySerializer(serializers.Serializer):
+    """Строка отметки посещаемости; участник передаётся id без запроса к БД"""
+    participant = serializers.IntegerField()
+    attended = serializers.BooleanField(required=False)
+    rating = serializers.IntegerField(required=False, allow_null=True)
+    notes = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+
+class RosterSerializer(serializers.ModelSerializer):
+    participant_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TrainingAttendance
+        fields = ['id', 'participant', 'participant_name', 'attended', 'rating', 'notes', 'created_at']
+
+    def get_participant_name(self, obj):
+        return f"{obj.participant.last_name} {obj.participant.first_name}"
+
+
+# === КАЛЕНДАРЬ ТРЕНИРОВОК ===
+class CalendarSessionSerializer(serializers.ModelSerializer):
+    trainer_name = serializers.SerializerMethodField()
+    booked = serializers.IntegerField(read_only=True)
+    attended = serializers.IntegerField(source='attended_count', read_only=True)
+
+    class Meta:
+        model = TrainingSessions
+        fields = [
+            'id', 'datetime', 'duration_minutes', 'topic', 'description', 'max_participants',
+            'location', 'status', 'trainer', 'trainer_name', 'booked', 'attended',
+        ]
+
+    def get_trainer_name(self, obj):
+        return f"{obj.trainer.last_name} {obj.trainer.first_name}"
+
+
+# === СВОБОДНЫЙ ИНВЕНТАРЬ ===
+class EquipmentAvailabilitySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    type = serializers.CharField()
+    size = serializers.CharField(allow_null=True)
+    condition = serializers.CharField(allow_null=True)
+
+
+class EquipmentBookedSerializer(EquipmentAvailabilitySerializer):
+    free_from = serializers.DateField(allow_null=True)
+    overdue = serializers.BooleanField()
+
+
+# === ТЕХОБСЛУЖИВАНИЕ ИНВЕНТАРЯ ===
+class MarkServicedSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+    date = serializers.DateField(required=False)
+    condition = serializers.CharField(max_length=20, required=False)
+
+
+class MaintenanceWeekSerializer(serializers.Serializer):
+    week = serializers.DateField()
+    due = serializers.IntegerField()
+    overdue = serializers.IntegerField()
+
+
+# === ОТЧЁТ О ВЫРУЧКЕ ===
+class RevenueRowSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    payment_method = serializers.CharField()
+    purpose = serializers.CharField()
+    status = serializers.CharField(allow_null=True)
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments_count = serializers.IntegerField()
+
+
+class RevenueTotalSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments_count = serializers.IntegerField()
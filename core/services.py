@@ -0,0 +1,218 @@
+# core/services.py
+
+from datetime import timedelta
+
+from django.db.models import Avg, Count, Q
+from django.db.models.functions import TruncDate
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .models import (
+    Participants, Subscriptions, Payments, TrainingSessions, TrainingAttendance,
+    LockerRentals, EventParticipants, SystemUsers
+)
+from .registration import WAITLIST
+
+
+SUBSCRIPTION_STATUSES = ('active', 'pending', 'expired', 'cancelled')
+NOTES_LIMIT = 20
+RECENT_PAYMENTS_LIMIT = 10
+CHART_DAYS = 30
+
+
+def _evaluated(queryset):
+    """Выполняет QuerySet один раз, чтобы шаблон работал с кэшем (в т.ч. .count)"""
+    len(queryset)
+    return queryset
+
+
+# === КАРТОЧКА УЧАСТНИКА ===
+class ParticipantCard:
+    """
+    Собирает контекст карточки участника за фиксированное число запросов.
+
+    Количество запросов не зависит от длины истории участника: статистика
+    считается условной агрегацией, группировка графика — на стороне БД,
+    связанные объекты подгружаются через select_related.
+    """
+
+    def __init__(self, participant):
+        self.participant = participant
+        self.now = timezone.now()
+
+    @classmethod
+    def for_id(cls, participant_id):
+        participant = get_object_or_404(Participants.objects.select_related('position'), id=participant_id)
+        return cls(participant)
+
+    # --- Абонементы ---
+    def subscriptions(self):
+        return _evaluated(
+            Subscriptions.objects.filter(participant=self.participant)
+            .select_related('tariff_plan')
+            .order_by('-start_date')
+        )
+
+    @staticmethod
+    def group_subscriptions(subscriptions):
+        grouped = {status_name: [] for status_name in SUBSCRIPTION_STATUSES}
+        for sub in subscriptions:
+            if sub.status in grouped:
+                grouped[sub.status].append(sub)
+        return grouped
+
+    # --- Платежи ---
+    def recent_payments(self):
+        return _evaluated(
+            Payments.objects.filter(participant=self.participant)
+            .select_related('subscription__tariff_plan')
+            .order_by('-payment_date')[:RECENT_PAYMENTS_LIMIT]
+        )
+
+    # --- Посещаемость ---
+    def attendance(self):
+        """Записи на тренировки без листа ожидания"""
+        return TrainingAttendance.objects.filter(participant=self.participant).exclude(status=WAITLIST)
+
+    def attendance_records(self):
+        return self.attendance().select_related('session').order_by('-session__datetime')
+
+    def attendance_stats(self):
+        return self.attendance().aggregate(
+            total=Count('id'),
+            attended=Count('id', filter=Q(attended=True)),
+            avg_rating=Avg('rating'),
+        )
+
+    def attendance_chart(self):
+        """Посещаемость за последние 30 дней, сгруппированная по дате в БД"""
+        rows = (
+            self.attendance()
+            .filter(session__datetime__gte=self.now - timedelta(days=CHART_DAYS))
+            .annotate(day=TruncDate('session__datetime'))
+            .values('day')
+            .annotate(total=Count('id'), attended=Count('id', filter=Q(attended=True)))
+            .order_by('day')
+        )
+        chart = {'dates': [], 'attended': [], 'total': []}
+        for row in rows:
+            chart['dates'].append(row['day'].isoformat())
+            chart['attended'].append(row['attended'])
+            chart['total'].append(row['total'])
+        return chart
+
+    # --- Шкафчики ---
+    def locker_rentals(self):
+        return _evaluated(
+            LockerRentals.objects.filter(participant=self.participant)
+            .select_related('locker', 'payment')
+            .order_by('-start_date')
+        )
+
+    # --- Заметки ---
+    def notes(self):
+        participant = self.participant
+        notes_list = []
+
+        if participant.notes:
+            notes_list.append({
+                'date': participant.updated_at,
+                'content': participant.notes,
+                'source': 'Профиль',
+                'type': 'general'
+            })
+
+        attendance_notes = TrainingAttendance.objects.filter(
+            participant=participant, notes__isnull=False
+        ).order_by('-created_at').values('created_at', 'notes', 'session__topic')[:NOTES_LIMIT]
+        for row in attendance_notes:
+            notes_list.append({
+                'date': row['created_at'],
+                'content': row['notes'],
+                'source': f"Тренировка: {row['session__topic']}",
+                'type': 'attendance'
+            })
+
+        payment_notes = Payments.objects.filter(
+            participant=participant, notes__isnull=False
+        ).order_by('-created_at').values('created_at', 'notes', 'amount')[:NOTES_LIMIT]
+        for row in payment_notes:
+            notes_list.append({
+                'date': row['created_at'],
+                'content': row['notes'],
+                'source': f"Платёж: {row['amount']} руб.",
+                'type': 'payment'
+            })
+
+        notes_list.sort(key=lambda x: x['date'], reverse=True)
+        return notes_list[:NOTES_LIMIT]
+
+    # --- Тренер ---
+    def trainer_stats(self):
+        return TrainingSessions.objects.filter(trainer=self.participant).aggregate(
+            total=Count('id'),
+            upcoming=Count('id', filter=Q(datetime__gte=self.now)),
+        )
+
+    def age(self):
+        birth_date = self.participant.birth_date
+        if not birth_date:
+            return None
+        today = self.now.date()
+        return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+
+    def get_context(self):
+        participant = self.participant
+
+        subscriptions = self.subscriptions()
+        subscription_statuses = self.group_subscriptions(subscriptions)
+        active_subscriptions = subscription_statuses['active']
+        total_cost = sum(sub.tariff_plan.price for sub in active_subscriptions if sub.tariff_plan.price)
+
+        stats = self.attendance_stats()
+        total_sessions = stats['total']
+        total_attended = stats['attended']
+        attendance_percentage = (total_attended / total_sessions * 100) if total_sessions > 0 else 0
+        avg_rating = stats['avg_rating']
+
+        locker_rentals = self.locker_rentals()
+        locker_rental = locker_rentals[0] if locker_rentals else None
+
+        context = {
+            'student': participant,
+            'subscriptions': subscriptions,
+            'payments': self.recent_payments(),
+            'training_sessions': TrainingSessions.objects.filter(
+                trainingattendance__participant=participant
+            ).distinct().order_by('-datetime'),
+            'attendance_records': self.attendance_records(),
+            'locker_rentals': locker_rentals,
+            'locker_rental': locker_rental,
+            'locker': locker_rental.locker if locker_rental else None,
+            'event_participations': EventParticipants.objects.filter(
+                participant=participant
+            ).select_related('event', 'payment').order_by('-registration_date'),
+            'active_subscriptions_count': len(active_subscriptions),
+            'total_cost': total_cost,
+            'total_sessions': total_sessions,
+            'total_attended': total_attended,
+            'attendance_percentage': round(attendance_percentage, 1),
+            'avg_rating': round(avg_rating, 1) if avg_rating else None,
+            'active_locker_rentals_count': sum(1 for rental in locker_rentals if rental.status == 'active'),
+            'age': self.age(),
+            'system_user': SystemUsers.objects.filter(member=participant).first(),
+            'is_trainer': participant.participant_type == 'trainer',
+            'subscription_statuses': subscription_statuses,
+            'all_notes': self.notes(),
+            'attendance_chart_data': self.attendance_chart(),
+        }
+
+        if context['is_trainer']:
+            trainer_stats = self.trainer_stats()
+            context['training_sessions_led'] = TrainingSessions.objects.filter(
+                trainer=participant
+            ).order_by('-datetime')
+            context['trainer_sessions_count'] = trainer_stats['total']
+            context['trainer_upcoming_sessions'] = trainer_stats['upcoming']
+
+        return context
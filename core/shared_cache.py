@@ -0,0 +1,60 @@
+# core/shared_cache.py
+#
+# Счётчики поколений в settings.CACHES['default']: кэш справочников
+# (core/reference.py) и счётчики изменений таблиц для ETag (core/conditional.py).
+# Сброс в одном воркере виден остальным только в общем кэше (Redis, Memcached,
+# БД, файлы). В кэше процесса (LocMemCache) счётчик справочников живёт
+# COUNTER_LOCAL_TIMEOUT секунд: после этого начинается новое поколение, и другие
+# воркеры отдают устаревшие данные не дольше этого срока. Счётчики ETag по
+# времени не истекают — иначе ETag менялся бы без изменений данных; без общего
+# кэша они не используются (см. core/conditional.py). `manage.py check
+# --deploy` предупреждает о таком кэше (core.W001).
+
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+
+
+COUNTER_LOCAL_TIMEOUT = 5  # секунд
+
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_process_local(alias=DEFAULT_CACHE_ALIAS):
+    """Кэш не общий для воркеров (у каждого процесса свой или его нет)"""
+    return settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_BACKENDS
+
+
+def counter(key, expire_locally=False):
+    """
+    Текущее значение счётчика поколения (сбрасывается cache.incr).
+    Начальное значение — от времени: после вытеснения или истечения счётчика
+    старые данные не подхватятся. expire_locally — в кэше процесса счётчик
+    живёт COUNTER_LOCAL_TIMEOUT секунд. Кэш, который ничего не хранит
+    (DummyCache), даёт каждый раз новое поколение.
+    """
+    value = cache.get(key)
+    if value is None:
+        timeout = COUNTER_LOCAL_TIMEOUT if expire_locally and is_process_local() else None
+        cache.add(key, time.time_ns(), timeout)
+        value = cache.get(key)
+        if value is None:
+            value = time.time_ns()
+    return value
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not is_process_local():
+        return []
+    return [checks.Warning(
+        'Кэш по умолчанию не общий для воркеров: сброс справочников доходит до других '
+        f'процессов только через {COUNTER_LOCAL_TIMEOUT} с, таблицы без updated_at отдаются без ETag.',
+        hint='Укажите общий кэш (Redis, Memcached) в CACHE_BACKEND.',
+        id='core.W001',
+    )]
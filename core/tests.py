@@ -1,3 +1,1797 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import SkipTest
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.db import connection, transaction, DatabaseError, IntegrityError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.request import Request
+from rest_framework.serializers import Serializer
+from rest_framework.views import APIView
+
+from .audit import AUDIT_DEFAULTS, AuditWriter
+from .compression import CODECS, CompressionMiddleware, choose_encoding, compression_settings, route_levels
+from .conditional import mark_changed
+from .db_routing import DATABASE_DEFAULTS, ReplicaRouter
+from .importer import Importer
+from . import reference
+from .models import (
+    Participants, TariffPlans, Subscriptions, Payments, TrainingSessions,
+    TrainingAttendance, Lockers, LockerRentals, ChangeLogs, SystemUsers, RevenueDaily,
+    Events, EventParticipants, Equipment, EquipmentRentals, Positions
+)
+from .pagination import CRMCursorPagination
+from .renderers import FastJSONRenderer, FastJsonResponse, MessagePackRenderer, msgpack
+from .registration import EVENT_REGISTRATION, cancel
+from .reports import rebuild_revenue_daily
+from .schema import SCHEMA_INDEXES
+from .search import normalize_phone
+from .serializers import EventSerializer, ParticipantSerializer, SubscriptionSerializer
+from .services import ParticipantCard
+from .shared_cache import COUNTER_LOCAL_TIMEOUT, check_shared_cache
+
+
+# Счётчики ETag работают только в общем кэше (core/conditional.py)
+SHARED_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'crm-tests-cache'),
+}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_participant(**kwargs):
+    data = {
+        'first_name': 'Иван',
+        'last_name': 'Иванов',
+        'birth_date': date(1990, 5, 17),
+        'join_date': date(2020, 1, 1),
+    }
+    data.update(kwargs)
+    return Participants.objects.create(**data)
+
+
+def make_history(participant, trainer, size):
+    """Создаёт историю участника: абонементы, платежи, посещения, аренды"""
+    now = timezone.now()
+    for i in range(size):
+        plan = TariffPlans.objects.create(name=f'План {i}', price=Decimal('1000.00'), duration_days=30)
+        subscription = Subscriptions.objects.create(
+            participant=participant, tariff_plan=plan, status='active' if i % 2 else 'expired',
+            start_date=date(2020, 1, 1) + timedelta(days=30 * i),
+            end_date=date(2020, 1, 31) + timedelta(days=30 * i),
+        )
+        Payments.objects.create(
+            participant=participant, subscription=subscription, amount=Decimal('1000.00'),
+            payment_date=date(2020, 1, 1) + timedelta(days=30 * i),
+            payment_method='card', purpose='subscription', status='completed', notes=f'Платёж {i}',
+        )
+        session = TrainingSessions.objects.create(
+            trainer=trainer, datetime=now - timedelta(days=i), duration_minutes=60, topic=f'Тема {i}',
+        )
+        TrainingAttendance.objects.create(
+            participant=participant, session=session, attended=bool(i % 3), rating=i % 10, notes=f'Заметка {i}',
+        )
+        locker = Lockers.objects.create(number=f'{participant.id}-{i}')
+        LockerRentals.objects.create(
+            locker=locker, participant=participant, start_date=date(2020, 1, 1) + timedelta(days=i),
+            rental_cost=Decimal('500.00'), status='active' if i == 0 else 'completed',
+        )
+
+
+class ParticipantCardQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trainer = make_participant(first_name='Пётр', email='trainer@example.com', participant_type='trainer')
+        cls.small = make_participant(email='small@example.com')
+        cls.large = make_participant(email='large@example.com')
+        make_history(cls.small, cls.trainer, 2)
+        make_history(cls.large, cls.trainer, 40)
+
+    def count_card_queries(self, participant):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('participant_card', args=[participant.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.assertEqual(self.count_card_queries(self.small), self.count_card_queries(self.large))
+
+    def test_query_count_is_bounded(self):
+        self.assertLessEqual(self.count_card_queries(self.large), 12)
+
+    def test_context_statistics(self):
+        context = ParticipantCard.for_id(self.large.id).get_context()
+        self.assertEqual(context['active_subscriptions_count'], 20)
+        self.assertEqual(context['total_cost'], Decimal('20000.00'))
+        self.assertEqual(context['total_sessions'], 40)
+        self.assertEqual(context['total_attended'], 26)
+        self.assertEqual(len(context['all_notes']), 20)
+        self.assertEqual(context['locker_rental'].status, 'completed')
+        self.assertEqual(sum(context['attendance_chart_data']['total']), 30)
+
+    def test_trainer_context(self):
+        context = ParticipantCard.for_id(self.trainer.id).get_context()
+        self.assertTrue(context['is_trainer'])
+        self.assertEqual(context['trainer_sessions_count'], 42)
+        self.assertEqual(context['trainer_upcoming_sessions'], 0)
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        participant = make_participant(email='payer@example.com')
+        for i in range(7):
+            Payments.objects.create(
+                participant=participant, amount=Decimal('100.00'), payment_date=date(2024, 1, 1 + i % 3),
+                payment_method='cash', purpose='subscription',
+            )
+        TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+
+    def test_walks_all_pages_without_duplicates(self):
+        seen = []
+        url = '/api/payments/?page_size=3'
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 3)
+            seen.extend(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        dates = [Payments.objects.get(id=pk).payment_date for pk in seen]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_previous_links_walk_back(self):
+        forward, url = [], '/api/payments/?page_size=3'
+        while url:
+            data = self.client.get(url).json()
+            forward.append([row['id'] for row in data['results']])
+            last, url = data, data['next']
+        backward, url = [forward[-1]], last['previous']
+        while url:
+            data = self.client.get(url).json()
+            backward.append([row['id'] for row in data['results']])
+            url = data['previous']
+        self.assertEqual(backward[::-1], forward)
+
+    def test_cursor_keys_on_date_and_id_without_offset(self):
+        expected = list(Payments.objects.order_by('-payment_date', 'id').values_list('id', flat=True)[1:4])
+        first = self.client.get('/api/payments/?page_size=1').json()
+        # Платёж, вставленный перед курсором, не сдвигает следующую страницу
+        Payments.objects.create(
+            participant=Participants.objects.get(), amount=Decimal('1.00'), payment_date=date(2024, 1, 4),
+            payment_method='cash', purpose='subscription',
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(first['next'].replace('page_size=1', 'page_size=3')).json()
+        self.assertNotIn('OFFSET', ' '.join(query['sql'] for query in ctx.captured_queries))
+        self.assertEqual([row['id'] for row in second['results']], expected)
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.client.get('/api/payments/', {'cursor': 'cD1bMV0='}).status_code, 404)
+
+    def test_page_size_is_capped(self):
+        request = Request(RequestFactory().get('/api/payments/', {'page_size': 100000}))
+        paginator = CRMCursorPagination()
+        self.assertEqual(paginator.get_page_size(request), paginator.max_page_size)
+
+    def test_reference_tables_use_offset_pagination(self):
+        data = self.client.get('/api/tariff-plans/').json()
+        self.assertEqual(data['count'], 1)
+
+
+class LockersListViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tenant = make_participant(email='tenant@example.com', phone='+79990001122')
+        for i in range(30):
+            locker = Lockers.objects.create(number=f'A{i:02d}', zone='A' if i < 20 else 'B')
+            if i % 3 == 0:
+                LockerRentals.objects.create(
+                    locker=locker, participant=tenant, start_date=date(2024, 1, 1),
+                    rental_cost=Decimal('500.00'), status='active',
+                )
+
+    def get_page(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('lockers_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context, len(ctx.captured_queries)
+
+    def test_stats_follow_filters(self):
+        context, _ = self.get_page(zone='B')
+        self.assertEqual(context['total_count'], 10)
+        self.assertEqual(context['occupied_count'], 3)
+        self.assertEqual(context['available_count'], 7)
+        self.assertEqual(context['zones'], ['A', 'B'])
+
+    def test_status_filter_and_current_rental(self):
+        context, _ = self.get_page(status='occupied')
+        lockers = list(context['lockers'])
+        self.assertEqual(len(lockers), 10)
+        for locker in lockers:
+            self.assertEqual(locker.status, 'occupied')
+            self.assertEqual(locker.current_participant.email, 'tenant@example.com')
+
+    def test_query_count_does_not_depend_on_locker_count(self):
+        _, before = self.get_page()
+        for i in range(50):
+            Lockers.objects.create(number=f'C{i:02d}', zone='C')
+        _, after = self.get_page()
+        self.assertEqual(before, after)
+
+
+class ParticipantSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        try:
+            call_command('setup_search', stdout=StringIO())
+        except DatabaseError as e:
+            raise SkipTest(f'Поисковые индексы недоступны: {e}')
+        cls.ivanov = make_participant(last_name='Иванов', first_name='Пётр', email='petr@example.com', phone='+7 (999) 123-45-67')
+        cls.ivanova = make_participant(last_name='Иванова', first_name='Анна', email='anna@example.com', phone='8-912-000-11-22')
+        cls.sidorov = make_participant(last_name='Сидоров', first_name='Иван', email='sid@example.com')
+        make_participant(last_name='Иванченко', first_name='Олег', email='old@example.com', is_active=False)
+
+    def search(self, query, **params):
+        params['search'] = query
+        data = self.client.get('/api/participants/available/', params).json()
+        self.assertTrue(data['success'])
+        return [row['id'] for row in data['participants']]
+
+    def test_normalize_phone(self):
+        self.assertEqual(normalize_phone('8 (999) 123-45-67'), '79991234567')
+        self.assertEqual(normalize_phone('+7 999 123'), '7999123')
+
+    def test_search_by_name_skips_inactive(self):
+        self.assertEqual(set(self.search('иван')), {self.ivanov.id, self.ivanova.id, self.sidorov.id})
+
+    def test_search_by_several_words(self):
+        self.assertEqual(self.search('Иванова Анна'), [self.ivanova.id])
+
+    def test_search_by_phone_in_any_format(self):
+        self.assertEqual(self.search('8 999 123-45-67'), [self.ivanov.id])
+        self.assertEqual(self.search('912000'), [self.ivanova.id])
+
+    def test_search_stored_phone_with_prefix_8(self):
+        # В базе '8-912-000-11-22': индекс хранит 79120001122, как normalize_phone
+        for query in ('89120001122', '8 912 000-11-22', '+7 912 000 11 22', '8912000'):
+            self.assertEqual(self.search(query), [self.ivanova.id], query)
+
+    def test_search_by_email(self):
+        self.assertEqual(self.search('anna@exa'), [self.ivanova.id])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('', limit=2)), 2)
+        response = self.client.get('/api/participants/available/', {'limit': 'много'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SessionRosterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trainer = make_participant(email='coach@example.com', participant_type='trainer')
+        cls.session = TrainingSessions.objects.create(
+            trainer=cls.trainer, datetime=timezone.now(), duration_minutes=90, topic='Фехтование',
+        )
+
+    def make_group(self, size):
+        return [make_participant(email=f'group{size}-{i}@example.com') for i in range(size)]
+
+    def put_roster(self, payload, method='put'):
+        return getattr(self.client, method)(
+            f'/api/training-sessions/{self.session.id}/roster/', payload, content_type='application/json'
+        )
+
+    def test_bulk_mark_and_read_back(self):
+        group = self.make_group(3)
+        response = self.put_roster([
+            {'participant': p.id, 'attended': True, 'rating': 8, 'notes': 'ok'} for p in group
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertTrue(all(row['attended'] for row in response.json()))
+
+        response = self.put_roster([{'participant': group[0].id, 'rating': 5}], method='patch')
+        row = next(r for r in response.json() if r['participant'] == group[0].id)
+        self.assertEqual((row['attended'], row['rating'], row['notes']), (True, 5, 'ok'))
+        self.assertEqual(TrainingAttendance.objects.filter(session=self.session).count(), 3)
+
+    def test_unknown_participant_rejected(self):
+        response = self.put_roster([{'participant': 999999, 'attended': True}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TrainingAttendance.objects.exists())
+
+    def test_query_count_does_not_depend_on_group_size(self):
+        counts = []
+        for size in (2, 30):
+            group = self.make_group(size)
+            with CaptureQueriesContext(connection) as ctx:
+                self.put_roster([{'participant': p.id, 'attended': True} for p in group], method='patch')
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class StreamingExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.participant = make_participant(email='export@example.com')
+        for i in range(5):
+            Payments.objects.create(
+                participant=cls.participant, amount=Decimal('1500.50'), payment_date=date(2024, 3, 1 + i),
+                payment_method='card', purpose='subscription', notes='строка, с запятой' if i == 0 else None,
+            )
+
+    def export(self, resource, fmt):
+        response = self.client.get(f'/api/{resource}/export/', {'format': fmt})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export('payments', 'csv'))))
+        header = rows[0]
+        self.assertEqual(header[:3], ['id', 'participant', 'subscription'])
+        self.assertEqual(len(rows), 6)
+        first = dict(zip(header, rows[1]))
+        self.assertEqual(first['payment_date'], '2024-03-05')
+        self.assertEqual(first['amount'], '1500.50')
+        self.assertEqual(dict(zip(header, rows[5]))['notes'], 'строка, с запятой')
+
+    def test_ndjson(self):
+        lines = self.export('payments', 'ndjson').splitlines()
+        self.assertEqual(len(lines), 5)
+        row = json.loads(lines[0])
+        self.assertEqual(row['participant'], self.participant.id)
+        self.assertEqual(row['amount'], '1500.50')
+
+    def test_participants_export(self):
+        lines = self.export('participants', 'ndjson').splitlines()
+        self.assertEqual(json.loads(lines[0])['email'], 'export@example.com')
+
+    async def test_asgi_export_streams_async_iterator(self):
+        response = await self.async_client.get('/api/payments/export/', {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        # Синхронный итератор Django под ASGI собрал бы целиком в память
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['amount'], '1500.50')
+
+
+class BulkImportTests(TestCase):
+    participants_csv = (
+        'first_name,last_name,email,phone,birth_date,join_date\n'
+        'Анна,Петрова,anna@example.com,+79990000001,1995-02-03,2024-01-10\n'
+        'Олег,Смирнов,oleg@example.com,,1990-13-40,2024-01-10\n'
+        'Игорь,Кузнецов,anna@example.com,,1991-01-01,2024-01-10\n'
+        'Мария,Орлова,,,1993-07-08,2024-01-11\n'
+    )
+
+    def run_import(self, resource, content, **options):
+        path = os.path.join(self.tmpdir, f'{resource}.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        rejects = os.path.join(self.tmpdir, f'{resource}.rejects.csv')
+        call_command('import_crm', resource, path, rejects=rejects, batch_size=2, stdout=StringIO(), **options)
+        with open(rejects, encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_participants_with_rejects(self):
+        rejects = self.run_import('participants', self.participants_csv)
+        self.assertEqual(Participants.objects.count(), 2)
+        self.assertEqual([row['line'] for row in rejects], ['3', '4'])
+        self.assertIn('birth_date', rejects[0]['error'])
+        self.assertIn('anna@example.com', rejects[1]['error'])
+        self.assertTrue(Participants.objects.get(email='anna@example.com').is_active)
+
+    def test_email_fast_path_keeps_full_validation(self):
+        content = (
+            'first_name,last_name,email,birth_date,join_date\n'
+            'А,Б,user.name+tag@mail.example.ru,1990-01-01,2024-01-01\n'
+            'В,Г,user@пример.рф,1990-01-01,2024-01-01\n'   # мимо быстрой проверки, валиден
+            'Д,Е,bad..dots@example.com,1990-01-01,2024-01-01\n'
+            'Ж,З,no-at-sign,1990-01-01,2024-01-01\n'
+            f'И,К,{"x" * 250}@example.com,1990-01-01,2024-01-01\n'
+        )
+        rejects = self.run_import('participants', content)
+        self.assertEqual(Participants.objects.count(), 2)
+        self.assertEqual([row['line'] for row in rejects], ['4', '5', '6'])
+        self.assertTrue(all(row['error'].startswith('email') for row in rejects))
+
+    def test_subscriptions_resolve_foreign_keys_per_batch(self):
+        participant = make_participant(email='sub@example.com')
+        TariffPlans.objects.create(name='Безлимит', price=Decimal('5000.00'), duration_days=30)
+        content = 'participant_email,tariff_plan_name,start_date,end_date,status\n' + (
+            'sub@example.com,Безлимит,2024-01-01,2024-01-31,active\n' * 6
+        ) + 'nobody@example.com,Безлимит,2024-01-01,2024-01-31,active\n'
+        with CaptureQueriesContext(connection) as ctx:
+            rejects = self.run_import('subscriptions', content)
+        self.assertEqual(Subscriptions.objects.filter(participant=participant).count(), 6)
+        self.assertEqual(len(rejects), 1)
+        self.assertIn('nobody@example.com', rejects[0]['error'])
+        lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 8)  # 4 пакета × (участники + тарифы)
+
+    def test_xlsx_float_ids_resolve(self):
+        participant = make_participant(email='xlsx@example.com')
+        plan = TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+        row = {
+            'participant': float(participant.id), 'tariff_plan': float(plan.id),
+            'start_date': date(2024, 1, 1), 'end_date': date(2024, 1, 31), 'status': 'active',
+        }
+        report = Importer('subscriptions').run(iter([row]))
+        self.assertEqual((report.created, report.rejected), (1, 0))
+        self.assertEqual(Subscriptions.objects.get().tariff_plan, plan)
+
+    def test_constraint_violation_falls_back_to_single_rows(self):
+        make_participant(email='taken@example.com')
+        content = (
+            'first_name,last_name,email,birth_date,join_date\n'
+            'Анна,Петрова,taken@example.com,1995-02-03,2024-01-10\n'
+            'Олег,Смирнов,free@example.com,1990-01-01,2024-01-10\n'
+        )
+        # Дубликат доходит до COPY/bulk_create, как при параллельной вставке
+        with mock.patch.object(Importer, 'existing_unique', return_value={'email': set()}):
+            rejects = self.run_import('participants', content)
+        self.assertEqual([row['line'] for row in rejects], ['2'])
+        self.assertTrue(Participants.objects.filter(email='free@example.com').exists())
+
+    def test_deferred_foreign_key_violation_is_rejected(self):
+        if connection.vendor != 'postgresql':
+            raise SkipTest('Отложенные FK проверяются досрочно только в PostgreSQL')
+        participant = make_participant(email='fk@example.com')
+        content = (
+            'participant,amount,payment_date,payment_method,purpose\n'
+            f'{participant.id},100.00,2024-01-01,cash,subscription\n'
+            '999999,100.00,2024-01-01,cash,subscription\n'
+        )
+        resolved = {'participant': {str(participant.id): participant.id, '999999': 999999}}
+        with mock.patch.object(Importer, 'resolve_lookups', return_value=resolved):
+            rejects = self.run_import('payments', content)
+        self.assertEqual([row['line'] for row in rejects], ['3'])
+        self.assertEqual(Payments.objects.filter(participant=participant).count(), 1)
+
+    def test_dry_run_writes_nothing(self):
+        self.run_import('participants', self.participants_csv, dry_run=True)
+        self.assertFalse(Participants.objects.exists())
+
+    def test_upload_api(self):
+        upload = SimpleUploadedFile('participants.csv', self.participants_csv.encode('utf-8'), content_type='text/csv')
+        response = self.client.post('/api/import/participants/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(response.json()['rejected'], 2)
+
+
+@override_settings(CRM_AUDIT={'ENABLED': True, 'ASYNC': False})
+class AuditCaptureTests(TestCase):
+    def test_create_update_delete_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            participant = make_participant(email='audit@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            participant = Participants.objects.get(id=participant.id)
+            participant.phone = '+79990000000'
+            participant.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            participant.save()  # без изменений — без записи
+        participant_id = participant.id
+        with self.captureOnCommitCallbacks(execute=True):
+            participant.delete()
+
+        logs = list(ChangeLogs.objects.filter(table_name='participants', record_id=participant_id).order_by('id'))
+        self.assertEqual([log.action_type for log in logs], ['create', 'update', 'delete'])
+        self.assertEqual(logs[0].changed_data['email'], 'audit@example.com')
+        self.assertEqual(logs[1].changed_data, {'phone': [None, '+79990000000']})
+
+    def test_password_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SystemUsers.objects.create(username='admin', email='admin@example.com', password_hash='secret')
+        self.assertNotIn('password_hash', ChangeLogs.objects.get(table_name='system_users').changed_data)
+
+    def test_rolled_back_writes_are_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    make_participant(email='rollback@example.com')
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(callbacks, [])
+
+
+class AuditWriterTests(SimpleTestCase):
+    def make_writer(self, **options):
+        writer = AuditWriter()
+        writer.batches = []
+        writer.write = lambda entries: writer.batches.append(list(entries))
+        self.addCleanup(writer.shutdown)
+        return writer, {**AUDIT_DEFAULTS, **options}
+
+    def test_flushes_in_batches_and_on_shutdown(self):
+        writer, options = self.make_writer(BATCH_SIZE=10, FLUSH_INTERVAL_MS=50)
+        with override_settings(CRM_AUDIT=options):
+            for i in range(25):
+                writer.enqueue({'record_id': i})
+            writer.shutdown()
+        written = [entry['record_id'] for batch in writer.batches for entry in batch]
+        self.assertEqual(written, list(range(25)))
+        self.assertTrue(all(len(batch) <= 10 for batch in writer.batches))
+
+    def test_full_queue_falls_back_to_sync_write(self):
+        writer, options = self.make_writer(QUEUE_SIZE=1, FLUSH_INTERVAL_MS=1000)
+        release = threading.Event()
+        writer._drain = lambda limit, timeout: release.wait() and []
+        with override_settings(CRM_AUDIT=options):
+            writer.enqueue({'record_id': 1})
+            writer.enqueue({'record_id': 2})
+        release.set()
+        self.assertEqual(writer.batches, [[{'record_id': 2}]])
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.participant = make_participant()
+
+    def pay(self, day, amount, method='card', purpose='subscription', status='paid'):
+        return Payments.objects.create(
+            participant=self.participant, amount=Decimal(amount), payment_date=day,
+            payment_method=method, purpose=purpose, status=status,
+        )
+
+    def rollup(self):
+        return sorted(
+            RevenueDaily.objects.values_list('date', 'payment_method', 'purpose', 'status', 'amount', 'payments_count')
+        )
+
+    def test_incremental_maintenance_matches_rebuild(self):
+        first = self.pay(date(2024, 1, 5), '1000.00')
+        self.pay(date(2024, 1, 5), '500.00')
+        moved = self.pay(date(2024, 1, 6), '300.00', method='cash', status=None)
+        deleted = self.pay(date(2024, 2, 1), '700.00')
+
+        first.amount = Decimal('1200.00')
+        first.save()
+        moved = Payments.objects.only('id', 'payment_method').get(pk=moved.pk)
+        moved.payment_method = 'card'
+        moved.save()
+        deleted.delete()
+
+        incremental = self.rollup()
+        self.assertEqual(incremental, [
+            (date(2024, 1, 5), 'card', 'subscription', 'paid', Decimal('1700.00'), 2),
+            (date(2024, 1, 6), 'card', 'subscription', '', Decimal('300.00'), 1),
+        ])
+        self.assertEqual(rebuild_revenue_daily(), 2)
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_report_by_month_reads_only_rollup(self):
+        self.pay(date(2024, 1, 5), '1000.00')
+        self.pay(date(2024, 1, 20), '500.00')
+        self.pay(date(2024, 2, 3), '200.00', method='cash')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/reports/revenue/', {'granularity': 'month', 'date_from': '2024-01-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('revenue_daily', ctx.captured_queries[0]['sql'])
+        self.assertNotIn('"payments"', ctx.captured_queries[0]['sql'])
+
+        data = response.json()
+        self.assertEqual(
+            [(row['period'], row['payment_method'], row['amount'], row['payments_count']) for row in data['results']],
+            [('2024-01-01', 'card', '1500.00', 2), ('2024-02-01', 'cash', '200.00', 1)],
+        )
+        self.assertEqual(data['total'], {'amount': '1700.00', 'payments_count': 3})
+
+    def test_report_rejects_bad_granularity(self):
+        response = self.client.get('/api/reports/revenue/', {'granularity': 'year'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_report_rejects_impossible_date(self):
+        response = self.client.get('/api/reports/revenue/', {'date_from': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_emptied_key_delete_is_scoped(self):
+        payment = self.pay(date(2024, 1, 5), '1000.00')
+        self.pay(date(2024, 1, 6), '500.00')
+        with CaptureQueriesContext(connection) as ctx:
+            payment.delete()
+        delete = [q['sql'] for q in ctx.captured_queries if 'DELETE' in q['sql'] and 'revenue_daily' in q['sql']]
+        # Удаляется только ключ удалённого платежа, без прохода по всей свёртке
+        self.assertEqual(len(delete), 1)
+        self.assertIn('"date" = ', delete[0])
+        self.assertEqual([row[0] for row in self.rollup()], [date(2024, 1, 6)])
+
+    def test_bulk_import_updates_rollup(self):
+        upload = SimpleUploadedFile('payments.csv', (
+            'participant,amount,payment_date,payment_method,purpose,status\n'
+            f'{self.participant.id},100.00,2024-03-01,card,event,paid\n'
+            f'{self.participant.id},250.50,2024-03-01,card,event,paid\n'
+        ).encode('utf-8'), content_type='text/csv')
+        self.client.post('/api/import/payments/', {'file': upload})
+        self.assertEqual(self.rollup(), [(date(2024, 3, 1), 'card', 'event', 'paid', Decimal('350.50'), 2)])
+
+
+class CalendarFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trainer = make_participant(first_name='Пётр', last_name='Тренеров', email='coach@example.com')
+        cls.other_trainer = make_participant(email='coach2@example.com')
+        cls.students = [make_participant(email=f'st{i}@example.com') for i in range(3)]
+        monday = timezone.make_aware(timezone.datetime(2024, 3, 4, 18, 0))
+        cls.sessions = []
+        for day in range(7):
+            cls.sessions.append(TrainingSessions.objects.create(
+                trainer=cls.trainer if day % 2 == 0 else cls.other_trainer,
+                datetime=monday + timedelta(days=day), duration_minutes=60, topic=f'День {day}',
+                location='Зал 1' if day < 5 else 'Зал 2',
+            ))
+        for i, student in enumerate(cls.students):
+            TrainingAttendance.objects.create(participant=student, session=cls.sessions[0], attended=i > 0)
+        TrainingSessions.objects.create(
+            trainer=cls.trainer, datetime=monday + timedelta(days=14), duration_minutes=60, topic='Позже',
+        )
+
+    def get(self, headers=None, **params):
+        params = {'start': '2024-03-04', 'end': '2024-03-10', **params}
+        return self.client.get('/api/calendar/', params, headers=headers or {})
+
+    def test_week_with_counts_in_two_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 2)  # отпечаток + выборка
+        data = response.json()
+        self.assertEqual(len(data), 7)
+        self.assertEqual(data[0]['trainer_name'], 'Тренеров Пётр')
+        self.assertEqual((data[0]['booked'], data[0]['attended']), (3, 2))
+        self.assertEqual((data[1]['booked'], data[1]['attended']), (0, 0))
+
+    def test_filters(self):
+        self.assertEqual(len(self.get(trainer=self.trainer.id).json()), 4)
+        self.assertEqual(len(self.get(location='Зал 2').json()), 2)
+        self.assertEqual(self.get(end='2024-01-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/calendar/').status_code, 400)
+
+    def test_not_modified_until_something_changes(self):
+        etag = self.get()['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        TrainingAttendance.objects.filter(session=self.sessions[0], attended=False).update(attended=True)
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_offsetting_changes_in_two_sessions(self):
+        first = TrainingAttendance.objects.filter(session=self.sessions[0], attended=True).first()
+        second = TrainingAttendance.objects.create(participant=self.students[0], session=self.sessions[1])
+        etag = self.get()['ETag']
+        self.client.patch(f'/api/training-attendance/{first.pk}/', {'attended': False}, content_type='application/json')
+        self.client.patch(f'/api/training-attendance/{second.pk}/', {'attended': True}, content_type='application/json')
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['attended'] for row in response.json()[:2]], [1, 1])
+
+
+class RegistrationTests(TestCase):
+    def setUp(self):
+        self.event = Events.objects.create(
+            name='Турнир', datetime=timezone.now() + timedelta(days=7), location='Зал 1', max_participants=2,
+        )
+        self.people = [make_participant(email=f'reg{i}@example.com') for i in range(4)]
+
+    def register(self, participant, waitlist=False):
+        return self.client.post(
+            f'/api/events/{self.event.id}/register/', {'participant': participant.id, 'waitlist': waitlist},
+            content_type='application/json',
+        )
+
+    def test_full_event_and_waitlist_promotion(self):
+        self.assertEqual(self.register(self.people[0]).status_code, 201)
+        self.assertEqual(self.register(self.people[0]).status_code, 200)  # повторно — та же запись
+        self.assertEqual(self.register(self.people[1]).status_code, 201)
+
+        full = self.register(self.people[2])
+        self.assertEqual(full.status_code, 409)
+        self.assertEqual(full.json()['code'], 'full')
+
+        waiting = self.register(self.people[2], waitlist=True)
+        self.assertEqual(waiting.json()['status'], 'waitlist')
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 2)
+
+        response = self.client.post(
+            f'/api/events/{self.event.id}/unregister/', {'participant': self.people[0].id},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['promoted'], [self.people[2].id])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 2)
+        self.assertEqual(
+            EventParticipants.objects.get(event=self.event, participant=self.people[2]).status, 'registered'
+        )
+
+    def test_viewset_create_and_delete_respect_capacity(self):
+        for person in self.people[:2]:
+            response = self.client.post(
+                '/api/event-participants/', {'event': self.event.id, 'participant': person.id},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/api/event-participants/', {'event': self.event.id, 'participant': self.people[2].id},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+
+        booking = EventParticipants.objects.filter(event=self.event).first()
+        self.assertEqual(self.client.delete(f'/api/event-participants/{booking.id}/').status_code, 204)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 1)
+
+    def test_roster_marks_are_counted(self):
+        session = TrainingSessions.objects.create(
+            trainer=self.people[3], datetime=timezone.now(), duration_minutes=60, topic='Группа', max_participants=5,
+        )
+        self.client.put(
+            f'/api/training-sessions/{session.id}/roster/',
+            [{'participant': person.id, 'attended': True} for person in self.people[:3]],
+            content_type='application/json',
+        )
+        session.refresh_from_db()
+        self.assertEqual(session.booked_count, 3)
+
+    def test_cancel_reads_status_under_lock(self):
+        for person in self.people[:2]:
+            self.register(person)
+        self.register(self.people[2], waitlist=True)
+        stale = EventParticipants.objects.get(event=self.event, participant=self.people[2])
+        self.client.post(
+            f'/api/events/{self.event.id}/unregister/', {'participant': self.people[0].id},
+            content_type='application/json',
+        )
+        # stale.status ещё 'waitlist', а запись уже переведена и занимает место
+        cancel(EVENT_REGISTRATION, stale)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 1)
+        self.assertEqual(cancel(EVENT_REGISTRATION, stale), [])  # уже удалена — счётчик не трогаем
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 1)
+
+    def test_update_moves_places(self):
+        other = Events.objects.create(
+            name='Кубок', datetime=timezone.now() + timedelta(days=8), location='Зал 2', max_participants=1,
+        )
+        for person in self.people[:2]:
+            self.register(person)
+        self.register(self.people[2], waitlist=True)
+        booking = EventParticipants.objects.get(event=self.event, participant=self.people[0])
+
+        response = self.client.patch(
+            f'/api/event-participants/{booking.id}/', {'event': other.id}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.event.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.event.registered_count, other.registered_count), (2, 1))
+        self.assertEqual(
+            EventParticipants.objects.get(event=self.event, participant=self.people[2]).status, 'registered'
+        )
+
+        moved = EventParticipants.objects.get(event=self.event, participant=self.people[1])
+        response = self.client.patch(
+            f'/api/event-participants/{moved.id}/', {'event': other.id}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(EventParticipants.objects.get(pk=moved.pk).event_id, self.event.id)
+
+        response = self.client.patch(
+            f'/api/event-participants/{moved.id}/', {'status': 'waitlist'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 1)
+
+
+class SubscriptionCycleTests(TestCase):
+    run_date = date(2024, 6, 1)
+
+    def setUp(self):
+        self.participant = make_participant()
+        self.plan = TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+        archived = TariffPlans.objects.create(name='Архив', price=Decimal('100.00'), duration_days=30, is_active=False)
+        self.renewing = self.subscribe(date(2024, 5, 31), auto_renew=True)
+        self.long_lapsed = self.subscribe(date(2024, 1, 31), auto_renew=True)
+        self.lapsing = self.subscribe(date(2024, 5, 20))
+        self.archived = self.subscribe(date(2024, 5, 20), auto_renew=True, plan=archived)
+        self.current = self.subscribe(date(2024, 6, 1), auto_renew=True)
+
+    def subscribe(self, end_date, auto_renew=False, plan=None):
+        return Subscriptions.objects.create(
+            participant=self.participant, tariff_plan=plan or self.plan, status='active',
+            start_date=end_date - timedelta(days=29), end_date=end_date, auto_renew=auto_renew,
+        )
+
+    def run_cycle(self):
+        out = StringIO()
+        call_command('run_subscription_cycle', date=self.run_date.isoformat(), chunk_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_impossible_date_is_command_error(self):
+        with self.assertRaisesMessage(CommandError, '--date'):
+            call_command('run_subscription_cycle', date='2024-02-30', stdout=StringIO())
+
+    def test_expires_and_renews(self):
+        self.run_cycle()
+        statuses = dict(Subscriptions.objects.filter(
+            id__in=[self.renewing.id, self.long_lapsed.id, self.lapsing.id, self.archived.id, self.current.id]
+        ).values_list('id', 'status'))
+        self.assertEqual(statuses, {
+            self.renewing.id: 'expired', self.long_lapsed.id: 'expired', self.lapsing.id: 'expired',
+            self.archived.id: 'expired', self.current.id: 'active',
+        })
+
+        renewals = Subscriptions.objects.filter(payments__notes__startswith='Автопродление').order_by('start_date')
+        self.assertEqual(
+            [(sub.start_date, sub.end_date) for sub in renewals],
+            [(date(2024, 6, 1), date(2024, 6, 30))] * 2,  # пропущенные периоды не выставляются
+        )
+        payments = Payments.objects.filter(payment_method='auto')
+        self.assertEqual([payment.amount for payment in payments], [Decimal('3000.00')] * 2)
+        self.assertEqual(RevenueDaily.objects.get(date=self.run_date).amount, Decimal('6000.00'))
+
+    def test_second_run_for_same_date_is_noop(self):
+        self.run_cycle()
+        subscriptions, payments = Subscriptions.objects.count(), Payments.objects.count()
+        self.assertIn('истекло 0, продлено 0', self.run_cycle())
+        self.assertEqual((Subscriptions.objects.count(), Payments.objects.count()), (subscriptions, payments))
+
+
+class LockerBillingTests(TestCase):
+    period = date(2024, 6, 1)
+
+    def setUp(self):
+        self.participant = make_participant()
+        self.monthly = self.rent('1', date(2024, 5, 31), 'monthly', auto_renew=True)
+        self.quarterly = self.rent('2', date(2024, 3, 10), 'квартал', auto_renew=True)
+        self.off_quarter = self.rent('3', date(2024, 4, 10), 'quarter', auto_renew=True)
+        self.ending = self.rent('4', date(2024, 5, 15), 'monthly')
+        self.new = self.rent('5', date(2024, 6, 20), None)
+        self.completed = self.rent('6', date(2024, 5, 1), 'monthly', auto_renew=True, status='completed')
+
+    def rent(self, number, start_date, payment_period, auto_renew=False, status='active'):
+        return LockerRentals.objects.create(
+            locker=Lockers.objects.create(number=number), participant=self.participant,
+            start_date=start_date, status=status, rental_cost=Decimal('500.00'),
+            payment_period=payment_period, auto_renew=auto_renew,
+        )
+
+    def run_billing(self, **options):
+        out = StringIO()
+        call_command('run_locker_billing', period='2024-06', stdout=out, **options)
+        return out.getvalue()
+
+    def test_bills_due_rentals_and_closes_without_auto_renew(self):
+        self.run_billing()
+        billed = dict(Payments.objects.values_list('idempotency_key', 'payment_date'))
+        self.assertEqual(billed, {
+            f'locker-rental:{self.monthly.id}:2024-06': date(2024, 6, 30),
+            f'locker-rental:{self.quarterly.id}:2024-06': date(2024, 6, 10),
+            f'locker-rental:{self.new.id}:2024-06': date(2024, 6, 20),
+        })
+        self.monthly.refresh_from_db()
+        self.assertEqual(self.monthly.payment.amount, Decimal('500.00'))
+        self.ending.refresh_from_db()
+        self.assertEqual((self.ending.status, self.ending.actual_end_date), ('completed', date(2024, 6, 14)))
+        self.assertEqual(RevenueDaily.objects.filter(purpose='locker').count(), 3)
+
+    def test_second_run_for_same_period_is_noop(self):
+        self.run_billing()
+        self.assertIn('счетов 0 на 0 руб., закрыто аренд 0, уже выставлено 3', self.run_billing())
+        self.assertEqual(Payments.objects.count(), 3)
+
+    def test_dry_run_changes_nothing(self):
+        out = self.run_billing(dry_run=True)
+        self.assertIn('Будет: 2024-06: счетов 3 на 1500.00 руб., закрыто аренд 1', out)
+        self.assertIn('шкаф №4', out)
+        self.assertFalse(Payments.objects.exists())
+        self.assertEqual(LockerRentals.objects.get(pk=self.ending.pk).status, 'active')
+
+
+class EquipmentAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.participant = make_participant()
+        cls.today = timezone.localdate()
+        cls.free = Equipment.objects.create(name='Лыжи 1', type='skis', size='170')
+        cls.booked = Equipment.objects.create(name='Лыжи 2', type='skis', size='170')
+        cls.overdue = Equipment.objects.create(name='Лыжи 3', type='skis', size='170')
+        cls.returned = Equipment.objects.create(name='Лыжи 4', type='skis', size='170')
+        Equipment.objects.create(name='Лыжи 5', type='skis', size='180')
+        cls.rent(cls.booked, 5, 9)
+        cls.rent(cls.overdue, -10, -3)
+        cls.rent(cls.returned, 3, 12, returned=4)
+
+    @classmethod
+    def rent(cls, equipment, start, end, returned=None):
+        return EquipmentRentals.objects.create(
+            participant=cls.participant, equipment=equipment,
+            rental_date=cls.today + timedelta(days=start), return_date=cls.today + timedelta(days=end),
+            actual_return_date=cls.today + timedelta(days=returned) if returned is not None else None,
+        )
+
+    def get(self, **params):
+        params = {'type': 'skis', 'size': '170', **params}
+        return self.client.get('/api/equipment/availability/', params)
+
+    def test_available_and_booked_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get(**{
+                'from': (self.today + timedelta(days=7)).isoformat(),
+                'to': (self.today + timedelta(days=10)).isoformat(),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['available']], [self.free.id, self.returned.id])
+        self.assertEqual(
+            [(item['id'], item['free_from'], item['overdue']) for item in data['booked']],
+            [(self.booked.id, (self.today + timedelta(days=10)).isoformat(), False), (self.overdue.id, None, True)],
+        )
+
+    def test_bad_params(self):
+        self.assertEqual(self.get(**{'from': '2024-03-10', 'to': '2024-03-01'}).status_code, 400)
+        self.assertEqual(self.get(**{'from': 'завтра', 'to': '2024-03-01'}).status_code, 400)
+        self.assertEqual(self.get(**{'from': '2024-02-30', 'to': '2024-03-01'}).status_code, 400)
+
+    def test_api_rejects_double_rental(self):
+        payload = {
+            'participant': self.participant.id, 'equipment': self.booked.id,
+            'rental_date': (self.today + timedelta(days=9)).isoformat(),
+            'return_date': (self.today + timedelta(days=11)).isoformat(),
+        }
+        response = self.client.post('/api/equipment-rentals/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('equipment', response.json())
+        payload['rental_date'] = (self.today + timedelta(days=10)).isoformat()
+        response = self.client.post('/api/equipment-rentals/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_postgres_exclusion_constraint(self):
+        if connection.vendor != 'postgresql':
+            raise SkipTest('Ограничение EXCLUDE есть только в PostgreSQL')
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')  # ALTER TABLE не идёт при отложенных проверках FK
+        call_command('setup_equipment_constraints', stdout=StringIO())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.rent(self.booked, 8, 15)
+        self.rent(self.booked, 10, 15)
+
+
+@override_settings(CRM_EQUIPMENT={'LATE_FEE_PER_DAY': Decimal('50.00')})
+class OverdueEquipmentTests(TestCase):
+    run_date = date(2024, 6, 10)
+
+    @classmethod
+    def setUpTestData(cls):
+        participant = make_participant()
+        skis = Equipment.objects.create(name='Лыжи', type='skis')
+        boots = Equipment.objects.create(name='Ботинки', type='boots')
+
+        def rent(equipment, return_date, returned=None, cost='300.00'):
+            return EquipmentRentals.objects.create(
+                participant=participant, equipment=equipment, rental_date=date(2024, 6, 1),
+                return_date=return_date, actual_return_date=returned, cost=Decimal(cost), status='active',
+            )
+
+        cls.late_skis = rent(skis, date(2024, 6, 7))
+        cls.late_boots = rent(boots, date(2024, 6, 9), cost='100.00')
+        cls.returned = rent(skis, date(2024, 6, 5), returned=date(2024, 6, 8))
+        cls.current = rent(boots, date(2024, 6, 10))
+
+    def accrue(self, run_date):
+        out = StringIO()
+        call_command('accrue_equipment_fees', date=run_date.isoformat(), stdout=out)
+        return out.getvalue()
+
+    def test_accrual_is_set_based_and_idempotent(self):
+        out = self.accrue(self.run_date)
+        self.assertIn('skis: просрочено 1, пени 150.00', out)
+        self.assertIn('просроченных аренд 2', out)
+        self.accrue(self.run_date)
+        rentals = EquipmentRentals.objects.in_bulk()
+        self.assertEqual(
+            (rentals[self.late_skis.id].cost, rentals[self.late_skis.id].late_fee, rentals[self.late_skis.id].status),
+            (Decimal('450.00'), Decimal('150.00'), 'overdue'),
+        )
+        self.assertEqual(rentals[self.late_boots.id].cost, Decimal('150.00'))
+        self.assertEqual(
+            (rentals[self.returned.id].cost, rentals[self.current.id].cost), (Decimal('300.00'), Decimal('300.00')),
+        )
+        self.accrue(self.run_date + timedelta(days=1))
+        self.assertEqual(EquipmentRentals.objects.get(pk=self.late_skis.id).cost, Decimal('500.00'))
+
+    def test_impossible_date_is_command_error(self):
+        with self.assertRaisesMessage(CommandError, '--date'):
+            call_command('accrue_equipment_fees', date='2024-02-30', stdout=StringIO())
+
+    def test_dry_run_reports_would_be_fees(self):
+        out = StringIO()
+        call_command('accrue_equipment_fees', date=self.run_date.isoformat(), dry_run=True, stdout=out)
+        self.assertIn('skis: просрочено 1, пени 150.00', out.getvalue())
+        self.assertIn('boots: просрочено 1, пени 50.00', out.getvalue())
+        self.assertEqual(EquipmentRentals.objects.get(pk=self.late_skis.id).late_fee, Decimal('0'))
+
+    def test_overdue_endpoint(self):
+        response = self.client.get('/api/equipment-rentals/overdue/')
+        self.assertEqual(response.status_code, 200)
+        # относительно сегодняшней даты просрочены все невозвращённые, давние первыми
+        self.assertEqual(
+            [row['id'] for row in response.json()['results']],
+            [self.late_skis.id, self.late_boots.id, self.current.id],
+        )
+        response = self.client.get('/api/equipment-rentals/overdue/', {'type': 'skis'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.late_skis.id])
+
+
+@override_settings(CRM_EQUIPMENT={'MAINTENANCE_INTERVAL_DAYS': 180, 'MAINTENANCE_INTERVALS': {'skis': 30}})
+class MaintenancePlannerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        week_start = cls.today - timedelta(days=cls.today.weekday())
+
+        def item(name, type_, due_in_days, condition='good'):
+            return Equipment.objects.create(
+                name=name, type=type_, condition=condition, next_maintenance_date=cls.today + timedelta(days=due_in_days),
+            )
+
+        cls.overdue = item('Лыжи 1', 'skis', -20, condition='worn')
+        cls.due = item('Ботинки 1', 'boots', 3)
+        cls.later = item('Лыжи 2', 'skis', 30)
+        cls.week_start = week_start
+
+    def test_due_list_with_condition_filter(self):
+        response = self.client.get('/api/equipment/maintenance/')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.overdue.id, self.due.id])
+        response = self.client.get('/api/equipment/maintenance/', {'condition': 'worn,broken'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.overdue.id])
+        self.assertEqual(self.client.get('/api/equipment/maintenance/', {'until': 'скоро'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/equipment/maintenance/', {'until': '2024-02-30'}).status_code, 400)
+
+    def test_mark_serviced_uses_type_interval_in_one_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/equipment/mark-serviced/',
+                {'ids': [self.overdue.id, self.due.id], 'date': '2024-06-01', 'condition': 'good'},
+                content_type='application/json',
+            )
+        self.assertEqual(response.json(), {'updated': 2})
+        self.assertEqual(len(ctx.captured_queries), 2)  # выборка + bulk_update
+        dates = dict(Equipment.objects.values_list('id', 'next_maintenance_date'))
+        self.assertEqual(dates[self.overdue.id], date(2024, 7, 1))
+        self.assertEqual(dates[self.due.id], date(2024, 11, 28))
+        self.assertEqual(Equipment.objects.get(pk=self.overdue.id).condition, 'good')
+
+    def test_weekly_capacity(self):
+        response = self.client.get('/api/equipment/maintenance/weekly/', {'weeks': 8})
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        self.assertEqual(rows[0]['week'], self.week_start.isoformat())
+        self.assertEqual(rows[0]['overdue'], 1)
+        self.assertEqual(sum(row['due'] for row in rows), 3)
+        self.assertEqual(self.client.get('/api/equipment/maintenance/weekly/', {'weeks': 0}).status_code, 400)
+
+
+class CurrentUserProfileTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        cache.clear()
+        self.member = make_participant(first_name='Анна', last_name='Петрова', phone='+7 900 111-22-33')
+        self.user = SystemUsers.objects.create(
+            username='anna', email='anna@example.com', password_hash='-', role='trainer', member=self.member,
+        )
+        self.auth = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def get(self, **headers):
+        return self.client.get('/api/profile/', headers={**self.auth, **headers})
+
+    def test_profile_from_cache_with_etag(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get()
+        self.assertEqual(len(ctx.captured_queries), 2)  # пользователь из токена + профиль с участником
+        data = response.json()
+        self.assertEqual((data['first_name'], data['role'], data['birth_date']), ('Анна', 'trainer', '1990-05-17'))
+        self.assertEqual(data['address'], 'Не указан')
+
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.get(**{'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_saving_member_or_user_resets_cache(self):
+        etag = self.get()['ETag']
+        self.member.phone = '+7 900 000-00-01'
+        self.member.save()
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['phone'], '+7 900 000-00-01')
+
+        self.user.role = 'admin'
+        self.user.save()
+        self.assertEqual(self.get().json()['role'], 'admin')
+        self.member.delete()
+        self.assertEqual(self.get().json()['first_name'], '')
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get('/api/me/').status_code, 401)
+
+
+class AsyncReadViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        cls.member = make_participant(first_name='Анна', last_name='Петрова', email='anna@example.com')
+        cls.user = SystemUsers.objects.create(username='anna', email='anna@example.com', password_hash='-', member=cls.member)
+        cls.token = str(RefreshToken.for_user(cls.user).access_token)
+        trainer = make_participant(first_name='Пётр', last_name='Тренеров', email='coach@example.com')
+        start = timezone.make_aware(timezone.datetime(2024, 3, 4, 18, 0))
+        for day in range(3):
+            TrainingSessions.objects.create(trainer=trainer, datetime=start + timedelta(days=day), duration_minutes=60)
+        cls.taken = Lockers.objects.create(number='1', zone='A')
+        Lockers.objects.create(number='2', zone='A')
+        Lockers.objects.create(number='3', zone='B')
+        LockerRentals.objects.create(
+            locker=cls.taken, participant=cls.member, start_date=date(2024, 1, 1), status='active',
+            rental_cost=Decimal('500.00'),
+        )
+
+    async def test_profile_matches_sync_view(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        sync = await sync_to_async(self.client.get)('/api/profile/', headers=headers)
+        response = await self.async_client.get('/api/async/profile/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual(response['ETag'], sync['ETag'])
+        cached = await self.async_client.get('/api/async/profile/', headers={**headers, 'If-None-Match': sync['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual((await self.async_client.get('/api/async/profile/')).status_code, 401)
+
+    async def test_calendar_matches_sync_view(self):
+        params = {'start': '2024-03-04', 'end': '2024-03-10'}
+        sync = await sync_to_async(self.client.get)('/api/calendar/', params)
+        response = await self.async_client.get('/api/async/calendar/', params)
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual(response['ETag'], sync['ETag'])
+
+    async def test_search(self):
+        def setup_search():
+            with transaction.atomic():
+                call_command('setup_search', stdout=StringIO())
+
+        try:
+            await sync_to_async(setup_search)()
+        except DatabaseError as e:
+            raise SkipTest(f'Поисковые индексы недоступны: {e}')
+        response = await self.async_client.get('/api/async/participants/search/', {'search': 'Петрова'})
+        self.assertEqual([row['id'] for row in response.json()['participants']], [self.member.id])
+
+    async def test_lockers(self):
+        data = (await self.async_client.get('/api/async/lockers/', {'zone': 'A'})).json()
+        self.assertEqual((data['total_count'], data['occupied_count'], data['count']), (2, 1, 2))
+        self.assertEqual([row['total'] for row in data['zone_stats']], [2, 1])
+        taken = data['lockers'][0]
+        self.assertEqual((taken['status'], taken['current_rental']['participant']['id']), ('occupied', self.member.id))
+
+
+# Реплика-заглушка: в тестах роль реплики играет алиас default (как TEST MIRROR)
+@override_settings(CRM_DATABASE={**DATABASE_DEFAULTS, 'REPLICAS': ['default']})
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+
+    def read_aliases(self, method, url, **kwargs):
+        """Ответ и алиасы, которые вернул роутер для чтений во время запроса"""
+        aliases = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            aliases.append(db_for_read(router, model, **hints))
+            return aliases[-1]
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy):
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, set(aliases)
+
+    def test_list_and_retrieve_read_from_replica(self):
+        response, aliases = self.read_aliases('get', '/api/tariff-plans/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {'default'})
+        response, aliases = self.read_aliases('get', f'/api/tariff-plans/{self.plan.pk}/')
+        self.assertEqual(response.json()['name'], 'Месяц')
+        self.assertEqual(aliases, {'default'})
+
+    def test_other_requests_use_primary(self):
+        _, aliases = self.read_aliases('get', '/api/equipment-rentals/overdue/')
+        self.assertEqual(aliases, {None})
+        self.assertEqual(ReplicaRouter().db_for_read(TariffPlans), None)
+        with override_settings(CRM_DATABASE={'REPLICAS': ['replica']}):
+            self.assertTrue(ReplicaRouter().allow_migrate('default', 'core'))
+            self.assertFalse(ReplicaRouter().allow_migrate('replica', 'core'))
+
+    def test_reads_stick_to_primary_after_write(self):
+        response, _ = self.read_aliases(
+            'post', '/api/tariff-plans/', data={'name': 'Год', 'price': '30000.00', 'duration_days': 365},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        cookie = response.cookies[DATABASE_DEFAULTS['STICKY_COOKIE']]
+        self.assertEqual(cookie['max-age'], DATABASE_DEFAULTS['STICKY_SECONDS'])
+        # Клиент теста хранит куку: следующий список читается с основной БД
+        response, aliases = self.read_aliases('get', '/api/tariff-plans/')
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(aliases, {None})
+
+    @override_settings(CRM_DATABASE=DATABASE_DEFAULTS)
+    def test_disabled_without_replicas(self):
+        response, _ = self.read_aliases(
+            'post', '/api/tariff-plans/', data={'name': 'Год', 'price': '30000.00', 'duration_days': 365},
+            content_type='application/json',
+        )
+        self.assertNotIn(DATABASE_DEFAULTS['STICKY_COOKIE'], response.cookies)
+        _, aliases = self.read_aliases('get', '/api/tariff-plans/')
+        self.assertEqual(aliases, {None})
+
+
+# Транзакции настоящие: в TestCase изменения справочников в кэш не попадают (ждут коммита)
+@override_settings(CRM_AUDIT={'ENABLED': False})
+class ReferenceCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        reference.reset_stats()
+        self.addCleanup(cache.clear)
+        self.plan = TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+        self.member = make_participant()
+
+    def subscription(self, plan_id):
+        return SubscriptionSerializer(data={
+            'participant': self.member.pk, 'tariff_plan': plan_id,
+            'start_date': '2024-01-01', 'end_date': '2024-01-31',
+        })
+
+    def test_fk_validation_uses_cache(self):
+        self.assertTrue(self.subscription(self.plan.pk).is_valid())
+        with CaptureQueriesContext(connection) as ctx:
+            serializer = self.subscription(self.plan.pk)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['tariff_plan'].name, 'Месяц')
+        self.assertFalse(any('tariff_plans' in query['sql'] for query in ctx.captured_queries))
+        missing = self.subscription(999999)
+        self.assertFalse(missing.is_valid())
+        self.assertIn('tariff_plan', missing.errors)
+
+        position = Positions.objects.create(name='Тренер')
+        serializer = ParticipantSerializer(instance=self.member, data={'position': position.pk}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_save_and_delete_bump_generation(self):
+        self.assertEqual(reference.tariff_plan(self.plan.pk).price, Decimal('3000.00'))
+        self.plan.price = Decimal('3500.00')
+        self.plan.save()
+        self.assertEqual(reference.tariff_plan(self.plan.pk).price, Decimal('3500.00'))
+        self.plan.delete()
+        self.assertIsNone(reference.tariff_plan(self.plan.pk))
+
+    def test_other_worker_reads_shared_cache(self):
+        reference.tariff_plan(self.plan.pk)
+        reference.clear_local()  # как новый процесс
+        with CaptureQueriesContext(connection) as ctx:
+            reference.tariff_plan(self.plan.pk)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        stats = reference.reference_stats()['tables']['tariff_plans']
+        self.assertEqual((stats['misses'], stats['shared_hits']), (1, 1))
+
+    def test_local_cache_counter_expires(self):
+        # Другой воркер с LocMemCache: сброса не видит, но счётчик истекает
+        reference.tariff_plan(self.plan.pk)
+        TariffPlans.objects.filter(pk=self.plan.pk).update(price=Decimal('4000.00'))
+        cache.delete(reference._generation_key('tariff_plans'))  # истёк COUNTER_LOCAL_TIMEOUT
+        self.assertEqual(reference.tariff_plan(self.plan.pk).price, Decimal('4000.00'))
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['core.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_rows_without_signals_and_rollbacks(self):
+        reference.tariff_plan(self.plan.pk)
+        [bulk] = TariffPlans.objects.bulk_create([TariffPlans(name='Год', price=Decimal('1'), duration_days=365)])
+        self.assertEqual(reference.tariff_plan(bulk.pk).name, 'Год')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Lockers.objects.create(number='1', zone='Откат')
+            self.assertEqual(reference.locker_zones(), ['Откат'])
+            raise RuntimeError
+        self.assertEqual(reference.locker_zones(), [])
+
+    def test_lockers_page_and_metrics(self):
+        Lockers.objects.create(number='1', zone='A')
+        self.client.get(reverse('lockers_list'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('lockers_list'))
+        self.assertEqual(response.context['zones'], ['A'])
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in ctx.captured_queries))
+        stats = self.client.get('/api/reference-cache/stats/').json()
+        self.assertEqual(stats['tables']['locker_zones'], {'local_hits': 1, 'shared_hits': 0, 'misses': 1, 'hit_ratio': 0.5})
+        self.assertEqual(stats['queries_saved'], 1)
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.people = [make_participant(email=f'poll{i}@example.com') for i in range(3)]
+        cls.event = Events.objects.create(
+            name='Турнир', datetime=timezone.now(), location='Зал', max_participants=10,
+        )
+        Lockers.objects.create(number='1', zone='A')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_not_modified_without_serialization(self):
+        response = self.client.get('/api/participants/')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        with mock.patch.object(ParticipantSerializer, 'to_representation') as serialize, \
+                CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get('/api/participants/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], etag)
+        serialize.assert_not_called()
+        self.assertEqual(len(ctx.captured_queries), 1)  # только агрегат
+        # Другие параметры — другая выдача
+        self.assertNotEqual(self.client.get('/api/participants/?page_size=1')['ETag'], etag)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_etag_survives_local_counter_timeout(self):
+        etag = self.client.get('/api/participants/')['ETag']
+        later = time.time() + COUNTER_LOCAL_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.client.get('/api/participants/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_process_local_cache_uses_updated_at_only(self):
+        # Счётчики воркера не видят правок из других процессов — без общего кэша не используются
+        etag = self.client.get('/api/participants/')['ETag']
+        cache.clear()  # другой воркер: своего счётчика нет
+        self.assertEqual(self.client.get('/api/participants/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Participants.objects.filter(pk=self.people[0].pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get('/api/participants/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # Шкафы без updated_at — без ETag
+        self.assertFalse(self.client.get('/api/lockers/').has_header('ETag'))
+        self.assertFalse(self.client.get(f'/api/lockers/{Lockers.objects.get().pk}/').has_header('ETag'))
+
+    def test_list_etag_follows_changes(self):
+        etags = {self.client.get('/api/participants/')['ETag']}
+        self.people[0].phone = '+79990000000'
+        self.people[0].save()
+        etags.add(self.client.get('/api/participants/')['ETag'])
+        self.people[1].delete()
+        etags.add(self.client.get('/api/participants/')['ETag'])
+        self.assertEqual(len(etags), 3)
+
+        # Шкафы без updated_at — по счётчику изменений таблицы: save() и mark_changed после UPDATE
+        etag = self.client.get('/api/lockers/')['ETag']
+        Lockers.objects.get(number='1').save()
+        self.assertEqual(self.client.get('/api/lockers/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get('/api/lockers/')['ETag']
+        Lockers.objects.filter(number='1').update(zone='B')
+        mark_changed(Lockers)
+        self.assertEqual(self.client.get('/api/lockers/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_retrieve_uses_row_updated_at(self):
+        url = f'/api/events/{self.event.pk}/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        with mock.patch.object(EventSerializer, 'to_representation') as serialize:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        serialize.assert_not_called()
+        self.assertEqual(self.client.get(f'/api/lockers/{Lockers.objects.get().pk}/').get('Last-Modified'), None)
+
+        # Запись меняет счётчик мест через UPDATE — updated_at сдвигается вместе с ним
+        self.client.post(f'{url}register/', {'participant': self.people[2].pk}, content_type='application/json')
+        updated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.json()['registered_count'], 1)
+
+    def test_expanded_relations_change_etag(self):
+        payment = Payments.objects.create(
+            participant=self.people[0], amount=Decimal('1.00'), payment_date=date(2024, 1, 4),
+            payment_method='cash', purpose='subscription',
+        )
+        for url in ('/api/payments/?expand=participant', f'/api/payments/{payment.pk}/?expand=participant'):
+            etag = self.client.get(url)['ETag']
+            self.people[0].last_name = f'Петров{len(url)}'
+            self.people[0].save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Last-Modified', response)
+            # Правка в обход сигналов видна по updated_at связи
+            etag = response['ETag']
+            Participants.objects.filter(pk=self.people[0].pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=self.client.get(url)['ETag']).status_code, 304)
+
+
+class FieldSelectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = TariffPlans.objects.create(name='Месяц', price=Decimal('3000.00'), duration_days=30)
+        cls.position = Positions.objects.create(name='Тренер')
+        for i in range(3):
+            cls.add_payment(i)
+
+    @classmethod
+    def add_payment(cls, i):
+        member = make_participant(email=f'expand{i}@example.com', address='Длинный адрес', position=cls.position)
+        subscription = Subscriptions.objects.create(
+            participant=member, tariff_plan=cls.plan, start_date=date(2024, 1, 1), end_date=date(2024, 1, 31),
+        )
+        return Payments.objects.create(
+            participant=member, subscription=subscription, amount=Decimal('3000.00'), payment_date=date(2024, 1, 1),
+            payment_method='card', purpose='subscription', notes='x' * 1000,
+        )
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), ctx.captured_queries
+
+    def test_fields_limit_payload_and_columns(self):
+        data, queries = self.get('/api/payments/?fields=id,amount,payment_date')
+        self.assertEqual(set(data['results'][0]), {'id', 'amount', 'payment_date'})
+        self.assertNotIn('"notes"', queries[-1]['sql'])
+
+    def test_expand_uses_joins_not_n_plus_one(self):
+        url = '/api/payments/?fields=id,amount&expand=participant.position,subscription.tariff_plan'
+        data, queries = self.get(url)
+        row = data['results'][0]
+        self.assertEqual(set(row), {'id', 'amount', 'participant', 'subscription'})
+        self.assertEqual(row['participant']['position']['name'], 'Тренер')
+        self.assertEqual(row['subscription']['tariff_plan']['name'], 'Месяц')
+        self.assertEqual(row['subscription']['participant'], row['participant']['id'])
+
+        for i in range(3, 10):
+            self.add_payment(i)
+        more, more_queries = self.get(url)
+        self.assertEqual(len(more['results']), 10)
+        self.assertEqual(len(more_queries), len(queries))  # агрегат ETag + страница
+
+    def test_retrieve_and_writes(self):
+        payment = Payments.objects.first()
+        data, queries = self.get(f'/api/payments/{payment.pk}/?expand=participant&fields=participant')
+        self.assertEqual(data, {'participant': ParticipantSerializer(payment.participant).data})
+        self.assertEqual(len(queries), 1)
+        # Изменения возвращают полное представление
+        response = self.client.patch(
+            f'/api/payments/{payment.pk}/?fields=id', {'notes': 'y'}, content_type='application/json',
+        )
+        self.assertIn('amount', response.json())
+
+    def test_unknown_fields_and_relations(self):
+        self.assertEqual(self.client.get('/api/payments/?fields=nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/?expand=notes').status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/?expand=participant.nope').status_code, 400)
+
+
+class FastReadTests(TestCase):
+    PREFIXES = (
+        'participants', 'tariff-plans', 'subscriptions', 'payments', 'training-sessions', 'training-attendance',
+        'equipment', 'equipment-rentals', 'events', 'event-participants', 'positions', 'system-users',
+        'change-logs', 'lockers', 'locker-rentals',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        trainer = make_participant(last_name='Тренер', email='fast-trainer@example.com')
+        member = make_participant(email='fast@example.com', position=Positions.objects.create(name='Гость'))
+        make_history(member, trainer, 3)
+        Payments.objects.create(
+            participant=member, amount=Decimal('0.10'), payment_date=date(2024, 2, 29),
+            payment_method='cash', purpose='разовое', notes='строка\u2028перенос 😀 "кавычки"',
+        )
+        TrainingAttendance.objects.filter(rating=0).update(rating=None)
+        Events.objects.create(
+            name='Марафон', datetime=timezone.now(), location='Парк', cost=Decimal('1500.50'),
+        )
+
+    def fetch(self, url, fast=True):
+        if fast:
+            response = self.client.get(url)
+        else:
+            # Исходный путь: сериализатор DRF и стандартный JSONRenderer
+            with mock.patch('core.fastread.compile_serializer', return_value=None), \
+                    mock.patch.object(APIView, 'renderer_classes', [JSONRenderer, BrowsableAPIRenderer]):
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.content
+
+    def assertSameBytes(self, url):
+        content = self.fetch(url)
+        self.assertEqual(content, self.fetch(url, fast=False), url)
+        return json.loads(content)
+
+    def test_list_and_retrieve_match_serializers(self):
+        for prefix in self.PREFIXES:
+            with self.subTest(prefix):
+                rows = self.assertSameBytes(f'/api/{prefix}/')['results']
+                if rows:
+                    self.assertSameBytes(f'/api/{prefix}/{rows[0]["id"]}/')
+
+    def test_fields_and_cursor_pages(self):
+        url = '/api/payments/?fields=amount,payment_date,subscription&page_size=2'
+        pages = 0
+        while url:
+            data = self.assertSameBytes(url)
+            self.assertEqual(set(data['results'][0]), {'amount', 'payment_date', 'subscription'})
+            url = data['next']
+            pages += 1
+        self.assertEqual(pages, 2)
+
+    def test_serializer_skipped_only_on_json_path(self):
+        # Патчится метод базового класса: свой to_representation у сериализатора отключает быстрый путь
+        original = Serializer.to_representation
+        with mock.patch.object(Serializer, 'to_representation', autospec=True, side_effect=original) as represent:
+            self.client.get('/api/payments/')
+            represent.assert_not_called()
+            self.client.get('/api/payments/?expand=participant')
+            self.assertTrue(represent.called)
+        self.assertEqual(self.client.get('/api/payments/?format=api').status_code, 200)
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'amount': Decimal('1.10'), 'day': date(2024, 2, 29),
+            'moment': timezone.make_aware(timezone.datetime(2024, 1, 1, 12, 30, 0, 123456)),
+            'text': 'a\u2028b\u2029c ё\n', 'big': 2 ** 70, 'none': None, 1: [True, 1.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(data, indented), JSONRenderer().render(data, indented))
+
+
+class FormatNegotiationTests(TestCase):
+    MSGPACK = 'application/msgpack'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_participant(email='formats@example.com')
+        Payments.objects.create(
+            participant=cls.member, amount=Decimal('3000.50'), payment_date=date(2024, 3, 1),
+            payment_method='card', purpose='subscription',
+        )
+
+    def setUp(self):
+        if msgpack is None:
+            raise SkipTest('msgpack не установлен')
+
+    def test_msgpack_list_matches_json(self):
+        for url in ('/api/payments/', f'/api/participants/{self.member.pk}/', '/api/payments/?expand=participant'):
+            response = self.client.get(url, HTTP_ACCEPT=self.MSGPACK)
+            self.assertEqual(response['Content-Type'], self.MSGPACK)
+            self.assertEqual(msgpack.unpackb(response.content), self.client.get(url).json())
+        data = msgpack.unpackb(self.client.get('/api/payments/?format=msgpack').content)
+        self.assertEqual(data['results'][0]['amount'], '3000.50')
+        participant = msgpack.unpackb(self.client.get(f'/api/participants/{self.member.pk}/?format=msgpack').content)
+        self.assertEqual(participant['birth_date'], '1990-05-17')
+
+    def test_parsers(self):
+        payment = {
+            'participant': self.member.pk, 'payment_date': '2024-03-02',
+            'payment_method': 'cash', 'purpose': 'разовое',
+        }
+        response = self.client.post(
+            '/api/payments/', msgpack.packb({**payment, 'amount': '1500.50'}), content_type=self.MSGPACK,
+            HTTP_ACCEPT=self.MSGPACK,
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(msgpack.unpackb(response.content)['amount'], '1500.50')
+        response = self.client.post('/api/payments/', {**payment, 'amount': 99.9}, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Payments.objects.get(pk=response.json()['id']).amount, Decimal('99.90'))
+
+        for body, content_type in ((b'\xc1', self.MSGPACK), (b'{"amount":', 'application/json')):
+            response = self.client.post('/api/payments/', body, content_type=content_type)
+            self.assertEqual(response.status_code, 400, content_type)
+
+    def test_values_outside_serializers(self):
+        data = {
+            'amount': Decimal('1.10'), 'day': date(2024, 2, 29),
+            'moment': timezone.make_aware(timezone.datetime(2024, 1, 1, 12, 30, 0, 123456)),
+        }
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(data)),
+            {'amount': '1.10', 'day': '2024-02-29', 'moment': '2024-01-01T12:30:00.123456Z'},
+        )
+        # JsonResponse-представления: те же значения, что давал DjangoJSONEncoder
+        self.assertEqual(
+            json.loads(FastJsonResponse(data).content), json.loads(json.dumps(data, cls=DjangoJSONEncoder)),
+        )
+        with self.assertRaises(TypeError):
+            FastJsonResponse([1])
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class CompressionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        member = make_participant(email='compression@example.com')
+        Payments.objects.bulk_create([
+            Payments(
+                participant=member, amount=Decimal('1500.50'), payment_date=date(2024, 3, 1),
+                payment_method='card', purpose='subscription', notes=f'Платёж {i}',
+            )
+            for i in range(60)
+        ])
+
+    def test_negotiation(self):
+        encodings = ['zstd', 'br', 'gzip']
+        available = [name for name in encodings if CODECS[name] is not None]
+        self.assertEqual(choose_encoding('gzip, deflate', encodings), 'gzip')
+        self.assertEqual(choose_encoding('*;q=0.5', encodings), available[0])
+        self.assertEqual(choose_encoding('zstd, br, gzip', encodings), available[0])
+        self.assertEqual(choose_encoding('br;q=0.5, gzip;q=0.8', encodings), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, identity', encodings))
+        self.assertIsNone(choose_encoding('', encodings))
+
+    def test_list_compressed_with_weak_etag(self):
+        plain = self.client.get('/api/payments/')
+        response = self.client.get('/api/payments/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(int(response['Content-Length']), len(plain.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        cached = self.client.get('/api/payments/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        # Меньше порога — как есть
+        small = self.client.get('/api/positions/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_streaming_export_by_chunks(self):
+        url = '/api/payments/export/?format=csv'
+        plain = b''.join(self.client.get(url).streaming_content)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+        self.assertEqual(route_levels('/api/payments/export/', compression_settings())['gzip'], 1)
+
+    def test_skipped_media_and_routes(self):
+        factory = RequestFactory(HTTP_ACCEPT_ENCODING='gzip')
+        body = b'<svg>' + b'x' * 5000
+
+        def compressed(path, content_type):
+            response = CompressionMiddleware(lambda request: HttpResponse(body, content_type=content_type))(
+                factory.get(path)
+            )
+            return response.has_header('Content-Encoding')
+
+        self.assertTrue(compressed('/media/logo.svg', 'image/svg+xml'))
+        self.assertFalse(compressed('/media/photo.png', 'image/png'))
+        self.assertFalse(compressed('/media/archive.zip', 'application/zip'))
+        self.assertFalse(compressed('/admin/', 'text/html; charset=utf-8'))
+
+    def test_html_gzip_with_random_padding(self):
+        body = b'<html>' + b'csrfmiddlewaretoken ' * 500 + b'</html>'
+        middleware = CompressionMiddleware(lambda request: HttpResponse(body, content_type='text/html; charset=utf-8'))
+        request = RequestFactory(HTTP_ACCEPT_ENCODING='zstd, br, gzip').get('/lockers/?zone=A')
+        responses = [middleware(request) for _ in range(20)]
+        self.assertEqual({response['Content-Encoding'] for response in responses}, {'gzip'})
+        self.assertEqual({gzip.decompress(response.content) for response in responses}, {body})
+        self.assertGreater(len({len(response.content) for response in responses}), 1)
+
+
+@override_settings(CRM_AUDIT={'ENABLED': False})
+class SetupSchemaTests(TransactionTestCase):
+    """Схема «CRM» без миграций: setup_schema досоздаёт недостающее и заполняет его"""
+
+    def setup_schema(self):
+        out = StringIO()
+        call_command('setup_schema', stdout=out)
+        return out.getvalue()
+
+    def test_up_to_date_schema_is_left_alone(self):
+        self.assertIn('Схема уже актуальна', self.setup_schema())
+
+    def test_missing_table_is_created_and_filled(self):
+        Payments.objects.create(
+            participant=make_participant(), amount=Decimal('700.00'), payment_date=date(2024, 1, 5),
+            payment_method='card', purpose='subscription',
+        )
+        with connection.schema_editor() as editor:
+            editor.delete_model(RevenueDaily)
+        self.assertIn('+ revenue_daily', self.setup_schema())
+        self.assertEqual(RevenueDaily.objects.get().amount, Decimal('700.00'))
+        self.assertIn('Схема уже актуальна', self.setup_schema())
+
+    def test_missing_counter_column_is_added_and_recounted(self):
+        session = TrainingSessions.objects.create(
+            trainer=make_participant(), datetime=timezone.now(), duration_minutes=60, topic='Группа',
+        )
+        TrainingAttendance.objects.create(session=session, participant=make_participant(email='a@example.com'))
+        TrainingAttendance.objects.create(
+            session=session, participant=make_participant(email='b@example.com'), status='waitlist',
+        )
+        with connection.schema_editor() as editor:
+            editor.remove_field(TrainingSessions, TrainingSessions._meta.get_field('booked_count'))
+        self.assertIn('+ training_sessions.booked_count', self.setup_schema())
+        session.refresh_from_db()
+        self.assertEqual(session.booked_count, 1)
+
+    def test_missing_unique_column_is_added(self):
+        with connection.schema_editor() as editor:
+            editor.remove_field(Payments, Payments._meta.get_field('idempotency_key'))
+        self.assertIn('+ payments.idempotency_key', self.setup_schema())
+        payment = {
+            'participant': make_participant(), 'amount': Decimal('500.00'), 'payment_date': date(2024, 1, 1),
+            'payment_method': 'card', 'purpose': 'locker', 'idempotency_key': 'locker:1:2024-01',
+        }
+        Payments.objects.create(**payment)
+        with self.assertRaises(IntegrityError):
+            Payments.objects.create(**payment)
+
+    def test_missing_late_fee_column_is_added(self):
+        with connection.schema_editor() as editor:
+            editor.remove_field(EquipmentRentals, EquipmentRentals._meta.get_field('late_fee'))
+        self.assertIn('+ equipment_rentals.late_fee', self.setup_schema())
+        rental = EquipmentRentals.objects.create(
+            participant=make_participant(), equipment=Equipment.objects.create(name='Лыжи', type='skis'),
+            rental_date=date(2024, 6, 1), return_date=date(2024, 6, 7),
+        )
+        self.assertEqual(EquipmentRentals.objects.get(pk=rental.pk).late_fee, Decimal('0'))
+
+    def test_missing_indexes_are_created(self):
+        for model in SCHEMA_INDEXES:
+            with connection.schema_editor() as editor:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+        out = self.setup_schema()
+        for model in SCHEMA_INDEXES:
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            for index in model._meta.indexes:
+                self.assertIn(f'+ {index.name}', out)
+                self.assertIn(index.name, constraints)
+        self.assertIn('Схема уже актуальна', self.setup_schema())
@@ -1,11 +1,18 @@
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from drf_spectacular.utils import extend_schema, extend_schema_view
 from django.shortcuts import render
 from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import quote_etag
 from rest_framework.response import Response
 
 from .models import (
@@ -19,8 +26,29 @@ from .serializers import (
     PaymentSerializer, TrainingSessionSerializer, TrainingAttendanceSerializer,
     EquipmentSerializer, EquipmentRentalSerializer, EventSerializer,
     EventParticipantSerializer, PositionSerializer, SystemUserSerializer,
-    ChangeLogSerializer, LockerSerializer, LockerRentalSerializer
+    ChangeLogSerializer, LockerSerializer, LockerRentalSerializer,
+    RosterEntrySerializer, RosterSerializer, RevenueRowSerializer, RevenueTotalSerializer,
+    CalendarSessionSerializer, EquipmentAvailabilitySerializer, EquipmentBookedSerializer,
+    MarkServicedSerializer, MaintenanceWeekSerializer
 )
+from .equipment import (
+    DEFAULT_DUE_DAYS, MAX_PLAN_WEEKS, availability, due_for_maintenance, maintenance_weekly, mark_serviced,
+    overdue_rentals,
+)
+from .conditional import ConditionalGetMixin, mark_changed
+from .export import ExportMixin
+from .fastread import FastReadMixin
+from .fieldsets import FieldSelectionMixin
+from .importer import Importer, open_rows, detect_format, DEFAULT_BATCH_SIZE as DEFAULT_IMPORT_BATCH_SIZE
+from .pagination import CRMPageNumberPagination
+from .reference import locker_zones, reference_stats
+from .profile import get_profile
+from .registration import (
+    EVENT_REGISTRATION, SESSION_REGISTRATION, BookingViewSetMixin, RegistrationMixin, recount
+)
+from .reports import GRANULARITIES, revenue_report
+from .schedule import calendar_queryset, calendar_sessions, calendar_etag, parse_bound
+from .services import ParticipantCard
 
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
@@ -42,10 +70,11 @@ def get_tokens_for_user(user):
     partial_update=extend_schema(summary="Частичное обновление"),
     destroy=extend_schema(summary="Удалить участника"),
 )
-class ParticipantsViewSet(viewsets.ModelViewSet):
+class ParticipantsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Participants.objects.all()
     serializer_class = ParticipantSerializer
     permission_classes = [AllowAny]
+    ordering = ('-id',)
 
 
 # НОВАЯ view для HTML страницы
@@ -68,11 +97,10 @@ def students_list_view(request):
     return render(request, 'students_list.html', context)
 
 
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render
 from .models import Participants, Subscriptions, Payments, Lockers
 
-from django.shortcuts import render, get_object_or_404
-from django.db.models import Sum, Count, Avg
+from django.db.models import Sum
 from django.utils import timezone
 from datetime import timedelta
 from .models import Participants, Subscriptions, Payments, TrainingSessions, TrainingAttendance, LockerRentals, \
@@ -80,172 +108,8 @@ from .models import Participants, Subscriptions, Payments, TrainingSessions, Tra
 
 
 def participant_card_view(request, participant_id):
-    # Получаем участника из базы данных
-    participant = get_object_or_404(Participants, id=participant_id)
-
-    # Получаем связанные данные
-    # Абонементы
-    subscriptions = Subscriptions.objects.filter(participant=participant)
-
-    # Платежи - ДВА ОТДЕЛЬНЫХ QUERYSET
-    payments_all = Payments.objects.filter(participant=participant)
-    payments = payments_all.order_by('-payment_date')[:10]  # Только для отображения
-
-    # Тренировки (группы)
-    training_sessions = TrainingSessions.objects.filter(
-        trainingattendance__participant=participant
-    ).distinct().order_by('-datetime')
-
-    # Посещаемость тренировок
-    attendance_records = TrainingAttendance.objects.filter(
-        participant=participant
-    ).order_by('-session__datetime')
-
-    # Шкафчики
-    locker_rentals = LockerRentals.objects.filter(
-        participant=participant
-    ).order_by('-start_date')
-
-    # Мероприятия
-    event_participations = EventParticipants.objects.filter(
-        participant=participant
-    ).order_by('-registration_date')
-
-    # Тренер (если участник является тренером)
-    is_trainer = False
-    if participant.participant_type == 'trainer':
-        is_trainer = True
-        # Получаем тренировки, которые ведет этот тренер
-        training_sessions_led = TrainingSessions.objects.filter(
-            trainer=participant
-        ).order_by('-datetime')
-
-    # Рассчитываем статистику
-    active_subscriptions = subscriptions.filter(status='active')
-    total_cost = sum(sub.tariff_plan.price for sub in active_subscriptions if sub.tariff_plan and sub.tariff_plan.price)
-
-    # Посещаемость
-    total_attended = attendance_records.filter(attended=True).count()
-    total_sessions = attendance_records.count()
-    attendance_percentage = (total_attended / total_sessions * 100) if total_sessions > 0 else 0
-
-    # Средняя оценка
-    avg_rating = attendance_records.filter(rating__isnull=False).aggregate(avg=Avg('rating'))['avg']
-
-    # Активные аренды
-    active_locker_rentals = locker_rentals.filter(status='active')
-
-    # Рассчитываем возраст
-    age = None
-    if participant.birth_date:
-        today = timezone.now().date()
-        age = today.year - participant.birth_date.year - (
-                (today.month, today.day) < (participant.birth_date.month, participant.birth_date.day)
-        )
-
-    # Получаем системного пользователя (если есть)
-    system_user = SystemUsers.objects.filter(member=participant).first()
-
-    # шкафы
-    locker_rental = locker_rentals.first() if locker_rentals.exists() else None
-    locker_obj = locker_rental.locker if locker_rental else None
-
-    # Формируем контекст для шаблона
-    context = {
-        'student': participant,
-        'subscriptions': subscriptions,
-        'payments': payments,
-        'training_sessions': training_sessions,
-        'attendance_records': attendance_records,
-        'locker_rentals': locker_rentals,
-        'locker_rental': locker_rental,  # объект LockerRentals
-        'locker': locker_obj,  # объект Lockers (сам шкаф)
-        'event_participations': event_participations,
-        'active_subscriptions_count': active_subscriptions.count(),
-        'total_cost': total_cost,
-        'total_sessions': total_sessions,
-        'total_attended': total_attended,
-        'attendance_percentage': round(attendance_percentage, 1),
-        'avg_rating': round(avg_rating, 1) if avg_rating else None,
-        'active_locker_rentals_count': active_locker_rentals.count(),
-        'age': age,
-        'system_user': system_user,
-        'is_trainer': is_trainer,
-    }
-
-    # Добавляем данные о тренировках тренера, если участник - тренер
-    if is_trainer:
-        context['training_sessions_led'] = training_sessions_led
-        context['trainer_sessions_count'] = training_sessions_led.count()
-        context['trainer_upcoming_sessions'] = training_sessions_led.filter(
-            datetime__gte=timezone.now()
-        ).count()
-
-    # Группируем абонементы по статусам для шаблона
-    subscription_statuses = {
-        'active': subscriptions.filter(status='active'),
-        'pending': subscriptions.filter(status='pending'),
-        'expired': subscriptions.filter(status='expired'),
-        'cancelled': subscriptions.filter(status='cancelled'),
-    }
-    context['subscription_statuses'] = subscription_statuses
-
-    # Получаем последние заметки из разных источников
-    notes_list = []
-
-    # Заметки из модели Participants
-    if participant.notes:
-        notes_list.append({
-            'date': participant.updated_at,
-            'content': participant.notes,
-            'source': 'Профиль',
-            'type': 'general'
-        })
-
-    # Заметки из посещаемости
-    for attendance in attendance_records.filter(notes__isnull=False):
-        notes_list.append({
-            'date': attendance.created_at,
-            'content': attendance.notes,
-            'source': f'Тренировка: {attendance.session.topic}',
-            'type': 'attendance'
-        })
-
-    # Заметки из платежей
-    for payment in payments_all.filter(notes__isnull=False):
-        notes_list.append({
-            'date': payment.created_at,
-            'content': payment.notes,
-            'source': f'Платёж: {payment.amount} руб.',
-            'type': 'payment'
-        })
-
-    # Сортируем заметки по дате
-    notes_list.sort(key=lambda x: x['date'], reverse=True)
-    context['all_notes'] = notes_list[:20]  # Ограничиваем 20 заметками
-
-    # Подготавливаем данные для графиков (если нужно)
-    # Последние 30 дней посещаемости
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    recent_attendance = attendance_records.filter(
-        session__datetime__gte=thirty_days_ago
-    ).order_by('session__datetime')
-
-    attendance_by_date = {}
-    for record in recent_attendance:
-        date_str = record.session.datetime.date().isoformat()
-        if date_str not in attendance_by_date:
-            attendance_by_date[date_str] = {'attended': 0, 'total': 0}
-        attendance_by_date[date_str]['total'] += 1
-        if record.attended:
-            attendance_by_date[date_str]['attended'] += 1
-
-    context['attendance_chart_data'] = {
-        'dates': list(attendance_by_date.keys()),
-        'attended': [data['attended'] for data in attendance_by_date.values()],
-        'total': [data['total'] for data in attendance_by_date.values()]
-    }
-
+    """Карточка участника: контекст собирается сервисом ParticipantCard"""
+    context = ParticipantCard.for_id(participant_id).get_context()
     return render(request, 'card.html', context)
 
 
@@ -318,197 +182,329 @@ def get_participant_contacts(participant):
     retrieve=extend_schema(summary="Тариф по ID"),
     create=extend_schema(summary="Создать тариф"),
 )
-class TariffPlansViewSet(viewsets.ModelViewSet):
-    queryset = TariffPlans.objects.all()
+class TariffPlansViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = TariffPlans.objects.all().order_by('id')
     serializer_class = TariffPlanSerializer
     permission_classes = [AllowAny]
+    pagination_class = CRMPageNumberPagination
 
 
 # === АБОНЕМЕНТЫ ===
-class SubscriptionsViewSet(viewsets.ModelViewSet):
+class SubscriptionsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Subscriptions.objects.all()
     serializer_class = SubscriptionSerializer
     permission_classes = [AllowAny]
+    ordering = ('-start_date', 'id')
 
 
 # === ПЛАТЕЖИ ===
-class PaymentsViewSet(viewsets.ModelViewSet):
+class PaymentsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Payments.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [AllowAny]
+    ordering = ('-payment_date', 'id')
 
 
 # === ТРЕНИРОВКИ ===
-class TrainingSessionsViewSet(viewsets.ModelViewSet):
+class TrainingSessionsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, RegistrationMixin, viewsets.ModelViewSet):
     queryset = TrainingSessions.objects.all()
     serializer_class = TrainingSessionSerializer
     permission_classes = [AllowAny]
+    ordering = ('-datetime', 'id')
+    registration_spec = SESSION_REGISTRATION
+    booking_serializer_class = TrainingAttendanceSerializer
+
+    @extend_schema(
+        summary="Список группы на тренировке и массовая отметка посещаемости",
+        request=RosterEntrySerializer(many=True),
+        responses=RosterSerializer(many=True),
+    )
+    @action(detail=True, methods=['get', 'put', 'patch'], url_path='roster')
+    def roster(self, request, pk=None):
+        """
+        GET — все отметки посещаемости тренировки.
+        PUT — записывает переданные строки целиком (неуказанные поля сбрасываются).
+        PATCH — меняет только переданные поля.
+        Число запросов не зависит от размера группы: upsert по (participant, session).
+        """
+        session = self.get_object()
+
+        if request.method != 'GET':
+            entries = RosterEntrySerializer(data=request.data, many=True)
+            entries.is_valid(raise_exception=True)
+            error = save_roster(session, entries.validated_data, partial=request.method == 'PATCH')
+            if error:
+                return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        attendance = TrainingAttendance.objects.filter(session=session).select_related('participant').order_by(
+            'participant__last_name', 'participant__first_name', 'id'
+        )
+        return Response(RosterSerializer(attendance, many=True).data)
+
+
+ROSTER_FIELDS = ('attended', 'rating', 'notes')
+ROSTER_DEFAULTS = {'attended': False, 'rating': None, 'notes': None}
+
+
+def save_roster(session, entries, partial=False):
+    """Upsert посещаемости группы одной транзакцией; возвращает текст ошибки или None"""
+    by_participant = {entry['participant']: entry for entry in entries}
+    if len(by_participant) != len(entries):
+        return "Участник указан в списке несколько раз"
+
+    ids = list(by_participant)
+    known_ids = set(Participants.objects.filter(id__in=ids).values_list('id', flat=True))
+    missing = sorted(set(ids) - known_ids)
+    if missing:
+        return f"Участники не найдены: {', '.join(map(str, missing))}"
+
+    with transaction.atomic():
+        current = {}
+        if partial:
+            current = {
+                row['participant_id']: row
+                for row in TrainingAttendance.objects.filter(session=session, participant_id__in=ids)
+                .values('participant_id', *ROSTER_FIELDS)
+            }
+
+        rows = []
+        for participant_id, entry in by_participant.items():
+            values = dict(current.get(participant_id) or ROSTER_DEFAULTS) if partial else dict(ROSTER_DEFAULTS)
+            values.pop('participant_id', None)
+            values.update({field: entry[field] for field in ROSTER_FIELDS if field in entry})
+            rows.append(TrainingAttendance(participant_id=participant_id, session=session, **values))
+
+        TrainingAttendance.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['participant', 'session'],
+            update_fields=list(ROSTER_FIELDS),
+        )
+        mark_changed(TrainingAttendance)
+        # Строки, созданные отметкой тренера, занимают места — счётчик пересчитываем
+        recount(SESSION_REGISTRATION, [session.pk])
+    return None
 
 
 # === ПОСЕЩАЕМОСТЬ ===
-class TrainingAttendanceViewSet(viewsets.ModelViewSet):
+class TrainingAttendanceViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, BookingViewSetMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = TrainingAttendance.objects.all()
     serializer_class = TrainingAttendanceSerializer
     permission_classes = [AllowAny]
+    ordering = ('-id',)
+    registration_spec = SESSION_REGISTRATION
 
 
 # === ИНВЕНТАРЬ ===
-class EquipmentViewSet(viewsets.ModelViewSet):
+class EquipmentViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Equipment.objects.all()
     serializer_class = EquipmentSerializer
     permission_classes = [AllowAny]
+    ordering = ('id',)
+
+    @extend_schema(summary="Инвентарь, которому пора на обслуживание")
+    @action(detail=False, methods=['get'], url_path='maintenance')
+    def maintenance(self, request):
+        """
+        Обслуживание до ?until= (по умолчанию — неделя вперёд), просроченное первым.
+        ?condition=worn,broken — фильтр по состоянию, ?type= — по типу.
+        """
+        params = request.query_params
+        until = timezone.localdate() + timedelta(days=DEFAULT_DUE_DAYS)
+        if params.get('until'):
+            try:
+                until = parse_date(params['until'])
+            except ValueError:  # формат верный, но даты нет: 2024-02-30
+                until = None
+            if until is None:
+                return Response({"detail": "until: ожидается дата ГГГГ-ММ-ДД"}, status=status.HTTP_400_BAD_REQUEST)
+        conditions = [value for value in params.get('condition', '').split(',') if value]
+        queryset = due_for_maintenance(until, conditions=conditions, equipment_type=params.get('type'))
+        self.ordering = ('next_maintenance_date', 'id')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @extend_schema(summary="Отметить обслуживание", request=MarkServicedSerializer)
+    @action(detail=False, methods=['post'], url_path='mark-serviced')
+    def mark_serviced(self, request):
+        """{ids, date?, condition?} — следующая дата сдвигается на интервал своего типа"""
+        params = MarkServicedSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        updated = mark_serviced(
+            params.validated_data['ids'], params.validated_data.get('date'), params.validated_data.get('condition'),
+        )
+        return Response({"updated": updated})
+
+    @extend_schema(summary="Нагрузка на обслуживание по неделям", responses=MaintenanceWeekSerializer(many=True))
+    @action(detail=False, methods=['get'], url_path='maintenance/weekly', pagination_class=None)
+    def maintenance_weekly(self, request):
+        """?weeks= (по умолчанию 8), ?type=; просроченное входит в текущую неделю"""
+        weeks = request.query_params.get('weeks', '8')
+        if not weeks.isdigit() or not 1 <= int(weeks) <= MAX_PLAN_WEEKS:
+            return Response({"detail": f"weeks: от 1 до {MAX_PLAN_WEEKS}"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = maintenance_weekly(int(weeks), equipment_type=request.query_params.get('type'))
+        return Response(MaintenanceWeekSerializer(rows, many=True).data)
 
 
 # === АРЕНДА ИНВЕНТАРЯ ===
-class EquipmentRentalsViewSet(viewsets.ModelViewSet):
+class EquipmentRentalsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = EquipmentRentals.objects.all()
     serializer_class = EquipmentRentalSerializer
     permission_classes = [AllowAny]
+    ordering = ('-rental_date', 'id')
+
+    def perform_save(self, serializer):
+        # Параллельную выдачу того же инвентаря ловит ограничение equipment_rentals_no_overlap (PostgreSQL)
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError({"equipment": "Инвентарь на эти даты уже выдан"})
+
+    perform_create = perform_save
+    perform_update = perform_save
+
+    @extend_schema(summary="Просроченные аренды (не возвращены в срок)")
+    @action(detail=False, methods=['get'], url_path='overdue')
+    def overdue(self, request):
+        """Открытые аренды с прошедшей датой возврата, самые давние первыми; ?type= — тип инвентаря"""
+        queryset = overdue_rentals()
+        if request.query_params.get('type'):
+            queryset = queryset.filter(equipment__type=request.query_params['type'])
+        self.ordering = ('return_date', 'id')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
 
 # === МЕРОПРИЯТИЯ ===
-class EventsViewSet(viewsets.ModelViewSet):
+class EventsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, RegistrationMixin, viewsets.ModelViewSet):
     queryset = Events.objects.all()
     serializer_class = EventSerializer
     permission_classes = [AllowAny]
+    ordering = ('-datetime', 'id')
+    registration_spec = EVENT_REGISTRATION
+    booking_serializer_class = EventParticipantSerializer
 
 
 # === УЧАСТНИКИ МЕРОПРИЯТИЙ ===
-class EventParticipantsViewSet(viewsets.ModelViewSet):
+class EventParticipantsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, BookingViewSetMixin, viewsets.ModelViewSet):
     queryset = EventParticipants.objects.all()
     serializer_class = EventParticipantSerializer
     permission_classes = [AllowAny]
+    ordering = ('-registration_date', 'id')
+    registration_spec = EVENT_REGISTRATION
 
 
 # === ДОЛЖНОСТИ ===
-class PositionsViewSet(viewsets.ModelViewSet):
-    queryset = Positions.objects.all()
+class PositionsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = Positions.objects.all().order_by('id')
     serializer_class = PositionSerializer
     permission_classes = [AllowAny]
+    pagination_class = CRMPageNumberPagination
 
 
 # === СИСТЕМНЫЕ ПОЛЬЗОВАТЕЛИ ===
-class SystemUsersViewSet(viewsets.ModelViewSet):
+class SystemUsersViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = SystemUsers.objects.all()
     serializer_class = SystemUserSerializer
     permission_classes = [AllowAny]
+    ordering = ('id',)
 
 
 # === ЛОГИ ИЗМЕНЕНИЙ (только чтение) ===
-class ChangeLogsViewSet(viewsets.ReadOnlyModelViewSet):
+class ChangeLogsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ReadOnlyModelViewSet):
     queryset = ChangeLogs.objects.all().order_by('-change_time')
     serializer_class = ChangeLogSerializer
     permission_classes = [AllowAny]
+    ordering = ('-change_time', '-id')
 
 
 # === ШКАФЫ ===
-class LockersViewSet(viewsets.ModelViewSet):
+ACTIVE_LOCKER_RENTAL_STATUSES = ('active', 'occupied')
+
+
+class LockersViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Lockers.objects.all()
     serializer_class = LockerSerializer
     permission_classes = [AllowAny]
+    ordering = ('number',)
 
 
 
 # === АРЕНДА ШКАФОВ ===
-class LockerRentalsViewSet(viewsets.ModelViewSet):
+class LockerRentalsViewSet(ConditionalGetMixin, FastReadMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = LockerRentals.objects.all()
     serializer_class = LockerRentalSerializer
     permission_classes = [AllowAny]
+    ordering = ('-start_date', 'id')
 
 
-# views.py
 # views.py
 def lockers_list_view(request):
     """Страница со списком шкафчиков"""
     from django.core.paginator import Paginator
-    from django.db.models import Q
-
-    # Получаем все шкафчики с предзагрузкой связанных данных
-    lockers = Lockers.objects.all().order_by('zone', 'number')  # Исправлено: lockers вместо lockers_list
-
-    # Получаем активные аренды
-    active_rentals = LockerRentals.objects.filter(
-        Q(status='active') | Q(status='occupied')
-    ).select_related('participant', 'locker')
-
-    # Создаем словарь для быстрого доступа к активным арендам
-    active_rental_dict = {}
-    for rental in active_rentals:
-        active_rental_dict[rental.locker_id] = {
-            'rental': rental,
-            'participant': rental.participant
-        }
+    from django.db.models import Q, Count, Exists, OuterRef
+
+    # Активные аренды: занятость шкафчика вычисляется в SQL через EXISTS
+    active_rentals = LockerRentals.objects.filter(status__in=ACTIVE_LOCKER_RENTAL_STATUSES)
+    occupied = Exists(active_rentals.filter(locker=OuterRef('pk')))
+
+    lockers = Lockers.objects.annotate(is_occupied=occupied).order_by('zone', 'number')
 
     # Фильтрация
     zone = request.GET.get('zone')
     status_filter = request.GET.get('status')
     condition = request.GET.get('condition')
 
-    # Применяем фильтры КАЖДЫЙ РАЗ К QuerySet, а не к списку
     if zone:
-        lockers = lockers.filter(zone=zone)  # Исправлено: lockers вместо locker
+        lockers = lockers.filter(zone=zone)
 
     if condition:
         lockers = lockers.filter(condition=condition)
 
-    # Применяем фильтр по статусу
-    if status_filter:
-        if status_filter == 'occupied':
-            # Оставляем только занятые шкафчики
-            occupied_ids = list(active_rental_dict.keys())
-            # Фильтруем QuerySet по ID занятых шкафчиков
-            lockers = lockers.filter(id__in=occupied_ids)
-        elif status_filter == 'available':
-            # Оставляем только свободные шкафчики
-            occupied_ids = list(active_rental_dict.keys())
-            # Фильтруем QuerySet по ID НЕ занятых шкафчиков
-            lockers = lockers.exclude(id__in=occupied_ids)
-        elif status_filter in ['reserved', 'maintenance']:
-            # Фильтруем по полю status в модели
-            lockers = lockers.filter(status=status_filter)
-
-    # Получаем список уникальных зон для фильтра
-    zones = Lockers.objects.exclude(
-        Q(zone__isnull=True) | Q(zone='')
-    ).values_list('zone', flat=True).distinct().order_by('zone')
-
-    # ТОЛЬКО ПОСЛЕ ВСЕХ ФИЛЬТРОВ преобразуем в список и добавляем арендаторов
-    lockers_list = []
-    for locker in lockers:
-        rental_info = active_rental_dict.get(locker.id)
-        if rental_info:
-            locker.current_rental = rental_info['rental']
-            locker.current_participant = rental_info['participant']
-            locker.status = 'occupied'
-        else:
-            locker.current_rental = None
-            locker.current_participant = None
-            # Если в модели есть поле status, используем его
-            locker.status = getattr(locker, 'status', 'available')
-        lockers_list.append(locker)
-
-    # Статистика
-    total_count = len(lockers_list)
-    occupied_ids = list(active_rental_dict.keys())
-    occupied_count = len(occupied_ids)
-    available_count = total_count - occupied_count
-    # Считаем шкафчики в ремонте, если есть такое поле в модели
-    if hasattr(Lockers, 'status'):
-        maintenance_count = lockers.filter(status='maintenance').count()
-    else:
-        maintenance_count = 0
-
-    # Пагинация
-    paginator = Paginator(lockers_list, 20)
+    # Статистика по отфильтрованным шкафчикам — одним агрегирующим запросом
+    stats = lockers.aggregate(
+        total_count=Count('id'),
+        occupied_count=Count('id', filter=Q(is_occupied=True)),
+    )
+
+    # Фильтр по статусу — условие в запросе
+    if status_filter == 'occupied':
+        lockers = lockers.filter(is_occupied=True)
+    elif status_filter == 'available':
+        lockers = lockers.filter(is_occupied=False)
+    elif status_filter in ['reserved', 'maintenance']:
+        # Статусов резерва и ремонта в модели Lockers нет
+        lockers = lockers.none()
+
+    # Список зон для фильтра — из кэша справочников
+    zones = locker_zones()
+
+    # Пагинация на стороне БД (LIMIT/OFFSET)
+    paginator = Paginator(lockers, 20)
     page_number = request.GET.get('page')
     lockers_page = paginator.get_page(page_number)
 
+    # Текущие аренды и арендаторы — только для шкафчиков на странице
+    page_lockers = list(lockers_page.object_list)
+    current_rentals = {}
+    occupied_ids = [locker.id for locker in page_lockers if locker.is_occupied]
+    if occupied_ids:
+        for rental in active_rentals.filter(locker_id__in=occupied_ids).select_related('participant').order_by('start_date'):
+            current_rentals[rental.locker_id] = rental
+
+    for locker in page_lockers:
+        locker.current_rental = current_rentals.get(locker.id)
+        locker.current_participant = locker.current_rental.participant if locker.current_rental else None
+        locker.status = 'occupied' if locker.is_occupied else 'available'
+    lockers_page.object_list = page_lockers
+
     context = {
         'lockers': lockers_page,
-        'total_count': total_count,
-        'available_count': available_count,
-        'occupied_count': occupied_count,
-        'maintenance_count': maintenance_count,
+        'total_count': stats['total_count'],
+        'available_count': stats['total_count'] - stats['occupied_count'],
+        'occupied_count': stats['occupied_count'],
+        'maintenance_count': 0,
         'zones': zones,
         'selected_zone': zone,
         'selected_status': status_filter,
@@ -518,58 +514,50 @@ def lockers_list_view(request):
     return render(request, 'lockers_list.html', context)
 
 
-from django.http import JsonResponse
-from django.db.models import Q
+from core.renderers import FastJsonResponse
 from core.models import Participants  # Или как называется ваша модель участников
+from core.search import search_participants, DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT
 
 
 def get_available_participants(request):
     """
-    Возвращает список участников для выбора при назначении аренды
+    Возвращает список участников для выбора при назначении аренды.
+
+    Параметры: search — строка поиска (ФИО, email, телефон), limit — число результатов.
     """
     try:
-        # Получаем всех активных участников
-        participants = Participants.objects.filter(
-            is_active=True
-        ).order_by('last_name', 'first_name')
-
-        # Применяем поиск, если есть параметр search
-        search = request.GET.get('search', '')
-        if search:
-            participants = participants.filter(
-                Q(last_name__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(middle_name__icontains=search) |
-                Q(phone__icontains=search) |
-                Q(email__icontains=search)
-            )
+        limit = request.GET.get('limit') or DEFAULT_SEARCH_LIMIT
+        found = search_participants(request.GET.get('search', ''), limit=limit)
 
-        # Преобразуем в список словарей
         participants_list = []
-        for participant in participants:
+        for participant in found:
             participants_list.append({
-                'id': participant.id,
-                'last_name': participant.last_name or '',
-                'first_name': participant.first_name or '',
-                'middle_name': participant.middle_name or '',
-                'phone': participant.phone or '',
-                'email': participant.email or '',
-                'full_name': f"{participant.last_name} {participant.first_name} {participant.middle_name or ''}".strip(),
+                'id': participant['id'],
+                'last_name': participant['last_name'] or '',
+                'first_name': participant['first_name'] or '',
+                'middle_name': '',
+                'phone': participant['phone'] or '',
+                'email': participant['email'] or '',
+                'full_name': f"{participant['last_name']} {participant['first_name']}".strip(),
             })
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'participants': participants_list
         })
 
+    except ValueError:
+        return FastJsonResponse({
+            'success': False,
+            'error': 'Некорректный параметр limit'
+        }, status=400)
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
 
 
-from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from core.models import Lockers, LockerRentals
@@ -586,18 +574,18 @@ def delete_locker(request, locker_id):
         locker_number = locker.number
         locker.delete()
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'message': f'Шкафчик №{locker_number} удален'
         })
 
     except Lockers.DoesNotExist:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': 'Шкафчик не найден'
         }, status=404)
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -632,7 +620,7 @@ def update_locker(request, locker_id):
 
         locker.save()
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'message': 'Данные обновлены',
             'data': {
@@ -647,12 +635,12 @@ def update_locker(request, locker_id):
         })
 
     except Lockers.DoesNotExist:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': 'Шкафчик не найден'
         }, status=404)
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -670,7 +658,7 @@ def create_locker(request):
 
         # Проверяем обязательные поля
         if not data.get('number'):
-            return JsonResponse({
+            return FastJsonResponse({
                 'success': False,
                 'error': 'Номер шкафчика обязателен'
             }, status=400)
@@ -685,7 +673,7 @@ def create_locker(request):
             notes=data.get('notes')
         )
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'message': 'Шкафчик создан',
             'data': {
@@ -700,7 +688,7 @@ def create_locker(request):
         })
 
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -718,7 +706,7 @@ def create_locker_rental(request):
 
         # Проверяем обязательные поля
         if not data.get('locker_id') or not data.get('participant_id'):
-            return JsonResponse({
+            return FastJsonResponse({
                 'success': False,
                 'error': 'ID шкафчика и участника обязательны'
             }, status=400)
@@ -738,7 +726,7 @@ def create_locker_rental(request):
         locker.status = 'occupied'
         locker.save()
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'message': 'Аренда создана',
             'data': {
@@ -751,7 +739,7 @@ def create_locker_rental(request):
         })
 
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -777,18 +765,18 @@ def end_locker_rental(request, rental_id):
         locker.status = 'available'
         locker.save()
 
-        return JsonResponse({
+        return FastJsonResponse({
             'success': True,
             'message': 'Аренда завершена'
         })
 
     except LockerRentals.DoesNotExist:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': 'Аренда не найдена'
         }, status=404)
     except Exception as e:
-        return JsonResponse({
+        return FastJsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -870,107 +858,179 @@ def create_locker_view(request):
 
     except Exception as e:
         return Response({'success': False, 'error': str(e)}, status=400)
-# === ТЕКУЩИЙ ПОЛЬЗОВАТЕЛЬ ===
-# core/views.py
-# core/views.py
-class CurrentUserProfile(APIView):
-    permission_classes = [IsAuthenticated]
+# === ИМПОРТ ===
+class ImportUploadView(APIView):
+    """Загрузка CSV/XLSX: POST multipart с полем file (+ dry_run, batch_size)"""
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser]
 
-    def get(self, request):
-        # Получаем user_id из токена
-        auth_header = request.headers.get('Authorization', '')
+    @extend_schema(
+        summary="Пакетный импорт из CSV/XLSX",
+        request={"multipart/form-data": {"type": "object", "properties": {"file": {"type": "string", "format": "binary"}}}},
+    )
+    def post(self, request, resource):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Файл не передан"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not auth_header.startswith('Bearer '):
-            return Response(
-                {"detail": "Токен не предоставлен"},
-                status=status.HTTP_401_UNAUTHORIZED
+        try:
+            importer = Importer(
+                resource,
+                batch_size=int(request.data.get('batch_size') or DEFAULT_IMPORT_BATCH_SIZE),
+                dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true'),
             )
+            report = importer.run(open_rows(upload, detect_format(upload.name)))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
 
-        import jwt
-        token = auth_header.split(' ')[1]
 
+# === КАЛЕНДАРЬ ===
+class CalendarView(APIView):
+    """
+    Тренировки за период для календаря уроков: ?start=&end=&trainer=&location=.
+
+    Отвечает 304 на If-None-Match, если в периоде ничего не менялось —
+    отпечаток считается одним агрегатом, без выборки и сериализации.
+    """
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Календарь тренировок за период", responses=CalendarSessionSerializer(many=True))
+    def get(self, request):
+        params = request.query_params
+        if not params.get('start') or not params.get('end'):
+            return Response({"detail": "Нужны параметры start и end"}, status=status.HTTP_400_BAD_REQUEST)
+        trainer = params.get('trainer')
+        if trainer and not trainer.isdigit():
+            return Response({"detail": "trainer: ожидается id"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            # Декодируем токен
-            decoded = jwt.decode(token, options={"verify_signature": False})
-            user_id = decoded.get('user_id')
-            print(f"DEBUG: User ID from token: {user_id}")
+            queryset = calendar_queryset(
+                parse_bound(params['start']), parse_bound(params['end'], end=True),
+                trainer=trainer, location=params.get('location'),
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = quote_etag(calendar_etag(queryset))
+        not_modified = get_conditional_response(request._request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = Response(CalendarSessionSerializer(calendar_sessions(queryset), many=True).data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 
-            # Получаем пользователя
+# === СВОБОДНЫЙ ИНВЕНТАРЬ ===
+class EquipmentAvailabilityView(APIView):
+    """
+    Свободный инвентарь на период: ?type=&size=&from=&to= (даты включительно).
+    Занятые единицы возвращаются с датой, когда освободятся.
+    """
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Свободный инвентарь на период", responses=EquipmentBookedSerializer(many=True))
+    def get(self, request):
+        params = request.query_params
+        if not params.get('type'):
+            return Response({"detail": "Нужен параметр type"}, status=status.HTTP_400_BAD_REQUEST)
+        dates = {}
+        for name in ('from', 'to'):
             try:
-                user = SystemUsers.objects.get(id=user_id)
-                print(f"DEBUG: Found user: {user.email}")
-
-                # Инициализируем данные
-                profile_data = {
-                    'email': user.email or "",
-                    'role': user.role or "user",
-                    'first_name': "",
-                    'last_name': "",
-                    'phone': "",
-                    'birth_date': "",
-                    'join_date': "",
-                    'emergency_contact': "",
-                    'address': "",
-                }
-
-                # Если есть связанный участник, берем все данные оттуда
-                if user.member:
-                    try:
-                        member = Participants.objects.get(id=user.member_id)
-                        print(f"DEBUG: Found member: {member.first_name} {member.last_name}")
-
-                        # Форматируем даты в строку (если они не None)
-                        birth_date_str = ""
-                        join_date_str = ""
-
-                        if member.birth_date:
-                            birth_date_str = member.birth_date.strftime('%Y-%m-%d')
-
-                        if member.join_date:
-                            join_date_str = member.join_date.strftime('%Y-%m-%d')
-
-                        # Заполняем данные из participants
-                        profile_data.update({
-                            'first_name': member.first_name or "",
-                            'last_name': member.last_name or "",
-                            'phone': member.phone or "",
-                            'birth_date': birth_date_str,
-                            'join_date': join_date_str,
-                            'emergency_contact': member.emergency_contact or "",
-                            'address': member.address or "",
-                        })
-
-                    except Participants.DoesNotExist:
-                        print("DEBUG: Member not found")
-
-                # Если какие-то поля пустые, ставим заглушки
-                if not profile_data['phone']:
-                    profile_data['phone'] = '+7 (999) 000-00-00'
-                if not profile_data['birth_date']:
-                    profile_data['birth_date'] = '1990-01-01'
-                if not profile_data['join_date']:
-                    profile_data['join_date'] = '2024-01-01'
-                if not profile_data['emergency_contact']:
-                    profile_data['emergency_contact'] = 'Не указан'
-                if not profile_data['address']:
-                    profile_data['address'] = 'Не указан'
-
-                return Response(profile_data)
-
-            except SystemUsers.DoesNotExist:
-                print(f"DEBUG: User with ID {user_id} not found in DB")
-                return Response(
-                    {"detail": "Пользователь не найден"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
+                dates[name] = parse_date(params.get(name) or '')
+            except ValueError:  # формат верный, но даты нет: 2024-02-30
+                dates[name] = None
+            if dates[name] is None:
+                return Response({"detail": f"{name}: ожидается дата ГГГГ-ММ-ДД"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            available, booked = availability(params['type'], dates['from'], dates['to'], size=params.get('size'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'from': dates['from'],
+            'to': dates['to'],
+            'available': EquipmentAvailabilitySerializer(available, many=True).data,
+            'booked': EquipmentBookedSerializer(booked, many=True).data,
+        })
 
-        except Exception as e:
-            print(f"DEBUG: Error: {e}")
+
+# === МЕТРИКИ КЭША СПРАВОЧНИКОВ ===
+class ReferenceCacheStatsView(APIView):
+    """Попадания и промахи кэша справочников в этом процессе (воркере)"""
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Метрики кэша справочников")
+    def get(self, request):
+        return Response(reference_stats())
+
+
+# === ОТЧЁТЫ ===
+class RevenueReportView(APIView):
+    """Выручка по периодам из свёртки revenue_daily, без сканирования payments"""
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Выручка по дням/неделям/месяцам", responses=RevenueRowSerializer(many=True))
+    def get(self, request):
+        params = request.query_params
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = params.get(name)
+            if value:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:  # формат верный, но даты нет: 2024-02-30
+                    dates[name] = None
+                if dates[name] is None:
+                    return Response({"detail": f"{name}: ожидается дата ГГГГ-ММ-ДД"}, status=status.HTTP_400_BAD_REQUEST)
+
+        granularity = params.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
             return Response(
-                {"detail": "Ошибка обработки токена"},
-                status=status.HTTP_400_BAD_REQUEST
+                {"detail": f"granularity: одно из {', '.join(GRANULARITIES)}"}, status=status.HTTP_400_BAD_REQUEST
             )
 
+        report = revenue_report(
+            granularity,
+            payment_method=params.get('payment_method'),
+            purpose=params.get('purpose'),
+            status=params.get('status'),
+            **dates,
+        )
+        return Response({
+            'granularity': granularity,
+            'results': RevenueRowSerializer(report['results'], many=True).data,
+            'total': RevenueTotalSerializer(report['total']).data,
+        })
+
+
+# === ТЕКУЩИЙ ПОЛЬЗОВАТЕЛЬ ===
+class CurrentUserProfile(APIView):
+    """
+    Профиль пользователя из токена (/api/profile/, /api/me/).
+
+    Пользователя уже проверил JWTAuthentication; данные профиля берутся из
+    кэша (сбрасывается при сохранении пользователя или его участника),
+    на If-None-Match с тем же ETag — 304.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(summary="Профиль текущего пользователя")
+    def get(self, request):
+        profile = get_profile(request.user.pk)
+        if profile is None:
+            return Response({"detail": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
+        data, etag = profile
+        etag = quote_etag(etag)
+        not_modified = get_conditional_response(request._request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 # === ВХОД (исправленная версия) ===
 @extend_schema(
     summary="Вход в систему",